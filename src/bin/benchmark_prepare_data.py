@@ -0,0 +1,560 @@
+"""benchmark_prepare_data.py.
+
+Benchmarks prepare_data.py on synthetic MALLET state files of several sizes.
+
+- Generates topic-state files with a given number of documents, tokens per
+  document, Zipfian vocabulary and topics, with sources containing spaces
+- Times `process_mallet_state_file` (and each of its stages, from its
+  profile report) and the helpers `jsd_matrix`, `compute_mds`,
+  `sparse_doc_topic_matrix` and `doc_topic_csc` for each size tier
+- Saves the timings as a baseline JSON file, and fails when a later run is
+  slower than the baseline by more than a threshold
+- Checks that the fast paths (numpy engine, worker processes, concurrent
+  writers, out-of-core counts) write the same files as the reference
+  python engine, and that the files match those recorded in the baseline
+
+To use as a module, call
+
+```python
+from benchmark_prepare_data import run_benchmarks, write_synthetic_state
+
+write_synthetic_state("topic-state.gz", num_docs=1000, tokens_per_doc=200)
+results = run_benchmarks(["small"], "bench")
+```
+"""
+
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from prepare_data import (
+    PROFILE_FILENAME,
+    compute_mds,
+    doc_topic_csc,
+    jsd_matrix,
+    process_mallet_state_file,
+    read_state_counts,
+    sparse_doc_topic_matrix,
+    topic_word_distributions,
+)
+
+# Synthetic state sizes: "small" runs in seconds, "large" is 10M tokens
+SIZE_TIERS = {
+    "tiny": {"num_docs": 40, "tokens_per_doc": 30, "vocab_size": 200, "num_topics": 5},
+    "small": {
+        "num_docs": 500,
+        "tokens_per_doc": 200,
+        "vocab_size": 5000,
+        "num_topics": 20,
+    },
+    "medium": {
+        "num_docs": 5000,
+        "tokens_per_doc": 200,
+        "vocab_size": 20000,
+        "num_topics": 50,
+    },
+    "large": {
+        "num_docs": 20000,
+        "tokens_per_doc": 500,
+        "vocab_size": 100000,
+        "num_topics": 100,
+    },
+}
+DEFAULT_TIERS = ("small", "medium")
+REGRESSION_THRESHOLD = 0.25  # Allowed slowdown over the baseline, as a fraction
+MIN_REGRESSION_SECONDS = 0.05  # Slowdowns smaller than this are timing noise
+SYNTHETIC_CHUNK_CELLS = 1 << 24  # Tokens x topics sampled at a time
+
+# Fast paths checked against the reference python engine
+GOLDEN_VARIANTS = {
+    "numpy": {"engine": "numpy"},
+    "workers": {"engine": "numpy", "workers": 2},
+    "writers": {"writers": 4},
+    "max_memory": {"engine": "numpy", "max_memory": 16 << 20},
+}
+# Header topics without tokens in the benchmark states
+GOLDEN_UNUSED_TOPICS = 1
+# Files that record how a run went rather than its output
+GOLDEN_EXCLUDED = (PROFILE_FILENAME, "state-counts.npz", "state-counts-doc-topic.npy")
+
+
+def write_synthetic_state(
+    filepath: str,
+    num_docs: int = 1000,
+    tokens_per_doc: int = 200,
+    vocab_size: int = 5000,
+    num_topics: int = 20,
+    zipf_exponent: float = 1.1,
+    alpha: float = 0.1,
+    beta: float = 0.01,
+    seed: int = 0,
+    unused_topics: int = 0,
+) -> int:
+    """Write a synthetic gzipped MALLET topic-state file.
+
+    Document lengths are Poisson distributed around `tokens_per_doc`, each
+    document draws its topic mixture from a Dirichlet(`alpha`) distribution,
+    and each token draws a word rank from a Zipf distribution, shifted so
+    that every topic favours different words. Sources contain spaces, like
+    file paths often do.
+
+    Args:
+        filepath (str): Path of the state file to write
+        num_docs (int): Number of documents
+        tokens_per_doc (int): Mean number of tokens per document
+        vocab_size (int): Number of word types
+        num_topics (int): Number of topics
+        zipf_exponent (float): Exponent of the Zipfian word frequencies
+        alpha (float): Dirichlet concentration of document topic mixtures,
+            also written as every topic's alpha in the header
+        beta (float): Beta written in the header
+        seed (int): Random seed; the same arguments give the same file
+        unused_topics (int): Topics listed in the header after the others,
+            with no tokens
+
+    Returns:
+        int: Number of tokens written
+    """
+    rng = np.random.default_rng(seed)
+    doc_lengths = np.maximum(rng.poisson(tokens_per_doc, num_docs), 1)
+    ranks = np.arange(1, vocab_size + 1, dtype=np.float64)
+    word_probabilities = ranks**-zipf_exponent
+    word_probabilities /= word_probabilities.sum()
+    topic_stride = max(1, vocab_size // num_topics)
+
+    docs_per_chunk = max(1, SYNTHETIC_CHUNK_CELLS // (tokens_per_doc * num_topics))
+    with gzip.open(filepath, "wt", encoding="utf-8") as f:
+        f.write("#doc source pos typeindex type topic\n")
+        f.write(f"#alpha : {' '.join([str(alpha)] * (num_topics + unused_topics))}\n")
+        f.write(f"#beta : {beta}\n")
+        for start in range(0, num_docs, docs_per_chunk):
+            lengths = doc_lengths[start : start + docs_per_chunk]
+            docs = np.repeat(np.arange(start, start + len(lengths)), lengths)
+            offsets = np.cumsum(lengths) - lengths
+            positions = np.arange(len(docs)) - np.repeat(offsets, lengths)
+
+            mixtures = rng.dirichlet(np.full(num_topics, alpha), len(lengths))
+            cumulative = np.cumsum(mixtures, axis=1)[docs - start]
+            draws = rng.random(len(docs))[:, None]
+            topics = np.minimum((cumulative < draws).sum(axis=1), num_topics - 1)
+            words = rng.choice(vocab_size, len(docs), p=word_probabilities)
+            words = (words + topics * topic_stride) % vocab_size
+
+            f.writelines(
+                f"{doc} file:/corpus/Volume {doc // 100}/doc {doc}.txt "
+                f"{pos} {word} w{word} {topic}\n"
+                for doc, pos, word, topic in zip(
+                    docs.tolist(), positions.tolist(), words.tolist(), topics.tolist()
+                )
+            )
+    return int(doc_lengths.sum())
+
+
+def best_time(function, repeat: int = 1) -> float:
+    """Return the fastest of `repeat` timed calls of `function`, in seconds."""
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def golden_digests(output_dir: str) -> dict[str, str]:
+    """Hash the output files of a run.
+
+    Args:
+        output_dir (str): Output directory of `process_mallet_state_file`
+
+    Returns:
+        dict[str, str]: SHA-256 digest of each file, by path relative to
+            `output_dir`, leaving out profiles and caches
+    """
+    digests = {}
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, output_dir).replace(os.sep, "/")
+            if relative.split("/")[0] in GOLDEN_EXCLUDED:
+                continue
+            with open(path, "rb") as f:
+                digests[relative] = hashlib.file_digest(f, "sha256").hexdigest()
+    return dict(sorted(digests.items()))
+
+
+def _quietly(function, *args, **kwargs):
+    """Call `function` without printing its progress messages."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def _diff_digests(expected: dict, actual: dict) -> list[str]:
+    """List the files that differ between two sets of digests."""
+    names = sorted(set(expected) | set(actual))
+    return [name for name in names if expected.get(name) != actual.get(name)]
+
+
+def check_golden(
+    state_file: str, work_dir: str, variants: dict | None = None
+) -> tuple[dict[str, str], list[str]]:
+    """Check that fast paths write the same files as the reference settings.
+
+    Args:
+        state_file (str): Path to a MALLET state file
+        work_dir (str): Directory for the output of each run
+        variants (dict | None): Keyword arguments of `process_mallet_state_file`
+            by variant name (default: GOLDEN_VARIANTS)
+
+    Returns:
+        tuple[dict[str, str], list[str]]: Digests of the reference files,
+            and a message for each file a variant wrote differently
+    """
+    variants = GOLDEN_VARIANTS if variants is None else variants
+    reference_dir = os.path.join(work_dir, "reference")
+    _quietly(process_mallet_state_file, state_file, reference_dir, generate_all=True)
+    reference = golden_digests(reference_dir)
+
+    mismatches = []
+    for name, kwargs in variants.items():
+        variant_dir = os.path.join(work_dir, name)
+        _quietly(
+            process_mallet_state_file,
+            state_file,
+            variant_dir,
+            generate_all=True,
+            **kwargs,
+        )
+        mismatches += [
+            f"{name}: {path} differs from the reference"
+            for path in _diff_digests(reference, golden_digests(variant_dir))
+        ]
+    return reference, mismatches
+
+
+def benchmark_tier(
+    state_file: str,
+    work_dir: str,
+    repeat: int = 1,
+    engine: str = "numpy",
+    workers: int = 1,
+) -> dict[str, float]:
+    """Time the pipeline and its helpers on one state file.
+
+    Args:
+        state_file (str): Path to a MALLET state file
+        work_dir (str): Directory for the pipeline's output
+        repeat (int): Number of runs; the fastest time of each step is kept
+        engine (str): State parser passed to `process_mallet_state_file`
+        workers (int): Parsing processes passed to `process_mallet_state_file`
+
+    Returns:
+        dict[str, float]: Seconds taken by the whole pipeline, each of its
+            stages (prefixed "stage:") and each helper
+    """
+    output_dir = os.path.join(work_dir, "output")
+    timings = {}
+    for _ in range(max(1, repeat)):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        start = time.perf_counter()
+        _quietly(
+            process_mallet_state_file,
+            state_file,
+            output_dir,
+            generate_all=True,
+            engine=engine,
+            workers=workers,
+            profile=True,
+        )
+        run = {"process_mallet_state_file": time.perf_counter() - start}
+        with open(os.path.join(output_dir, PROFILE_FILENAME)) as f:
+            for stage in json.load(f)["stages"]:
+                run[f"stage:{stage['name']}"] = stage["wall_seconds"]
+        for name, seconds in run.items():
+            timings[name] = min(seconds, timings.get(name, seconds))
+
+    counts = _quietly(read_state_counts, state_file, engine="numpy")
+    mat, smoothing = topic_word_distributions(counts.topic_word, float(counts.beta))
+    dist = jsd_matrix(mat, smoothing=smoothing)
+    doc_topic_lists = counts.doc_topic.T.tolist()
+    timings["jsd_matrix"] = best_time(
+        lambda: jsd_matrix(mat, smoothing=smoothing), repeat
+    )
+    timings["compute_mds"] = best_time(lambda: compute_mds(dist), repeat)
+    timings["compute_mds:classical"] = best_time(
+        lambda: compute_mds(dist, engine="classical"), repeat
+    )
+    timings["sparse_doc_topic_matrix"] = best_time(
+        lambda: sparse_doc_topic_matrix(doc_topic_lists), repeat
+    )
+    timings["doc_topic_csc"] = best_time(
+        lambda: doc_topic_csc(counts.doc_topic), repeat
+    )
+    return timings
+
+
+def run_benchmarks(
+    tiers=DEFAULT_TIERS,
+    work_dir: str | None = None,
+    repeat: int = 1,
+    engine: str = "numpy",
+    workers: int = 1,
+    golden: bool = True,
+) -> dict:
+    """Benchmark each size tier on a synthetic state file.
+
+    Args:
+        tiers (Iterable[str]): Names of size tiers in SIZE_TIERS
+        work_dir (str | None): Directory for state files and output
+            (default: a temporary directory, removed afterwards)
+        repeat (int): Number of timed runs of each step
+        engine (str): State parser of the timed pipeline runs
+        workers (int): Parsing processes of the timed pipeline runs
+        golden (bool): Whether to also check the fast paths against the
+            reference settings and record the reference digests
+
+    Returns:
+        dict: Results by tier, with the tier's sizes, its number of tokens,
+            its timings and, with `golden`, the reference digests and any
+            mismatches
+    """
+    unknown = [tier for tier in tiers if tier not in SIZE_TIERS]
+    if unknown:
+        raise ValueError(f"Unknown size tiers: {', '.join(unknown)}")
+
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        results = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "engine": engine,
+            "workers": workers,
+            "tiers": {},
+        }
+        # Warm up, so the first tier is not charged for loading libraries
+        warm_up_dir = os.path.join(work_dir, "warm-up")
+        os.makedirs(warm_up_dir, exist_ok=True)
+        warm_up_state = os.path.join(warm_up_dir, "topic-state.gz")
+        write_synthetic_state(warm_up_state, **SIZE_TIERS["tiny"])
+        _quietly(process_mallet_state_file, warm_up_state, warm_up_dir, engine=engine)
+
+        for tier in tiers:
+            tier_dir = os.path.join(work_dir, tier)
+            os.makedirs(tier_dir, exist_ok=True)
+            state_file = os.path.join(tier_dir, "topic-state.gz")
+            print(f"Generating {tier} state file...")
+            # A topic without tokens checks that every path drops it
+            tokens = write_synthetic_state(
+                state_file, **SIZE_TIERS[tier], unused_topics=GOLDEN_UNUSED_TOPICS
+            )
+
+            print(f"Timing {tier} tier ({tokens:,} tokens)...")
+            result = {
+                "sizes": SIZE_TIERS[tier],
+                "tokens": tokens,
+                "timings": benchmark_tier(
+                    state_file, tier_dir, repeat, engine, workers
+                ),
+            }
+            if golden:
+                print(f"Checking {tier} fast paths against the reference...")
+                digests, mismatches = check_golden(
+                    state_file, os.path.join(tier_dir, "golden")
+                )
+                result["golden"] = digests
+                result["mismatches"] = mismatches
+            results["tiers"][tier] = result
+    return results
+
+
+def compare_to_baseline(
+    results: dict,
+    baseline: dict,
+    threshold: float = REGRESSION_THRESHOLD,
+    min_seconds: float = MIN_REGRESSION_SECONDS,
+) -> list[str]:
+    """Compare benchmark results with a saved baseline.
+
+    A step regresses when it takes more than (1 + `threshold`) times its
+    baseline time, and at least `min_seconds` longer, so that very short
+    steps do not fail on timing noise. Tiers with reference digests in both
+    must also have written the same files.
+
+    Args:
+        results (dict): Results of `run_benchmarks`
+        baseline (dict): Earlier results of `run_benchmarks`
+        threshold (float): Allowed slowdown, as a fraction of the baseline time
+        min_seconds (float): Smallest slowdown reported, in seconds
+
+    Returns:
+        list[str]: A message for each regression or changed file
+    """
+    failures = []
+    for tier, result in results["tiers"].items():
+        previous = baseline.get("tiers", {}).get(tier)
+        if previous is None:
+            continue
+        for step, seconds in result["timings"].items():
+            before = previous["timings"].get(step)
+            if before is None:
+                continue
+            if seconds > before * (1 + threshold) and seconds - before >= min_seconds:
+                failures.append(
+                    f"{tier}: {step} took {seconds:.3f}s, "
+                    f"{seconds / before - 1:.0%} slower than {before:.3f}s"
+                )
+        if "golden" in result and "golden" in previous:
+            failures += [
+                f"{tier}: {path} differs from the baseline output"
+                for path in _diff_digests(previous["golden"], result["golden"])
+            ]
+    return failures
+
+
+def print_results(results: dict, baseline: dict | None = None) -> None:
+    """Print the timings of each tier, with the baseline times if given."""
+    for tier, result in results["tiers"].items():
+        print(f"\n{tier} ({result['tokens']:,} tokens)")
+        previous = (baseline or {}).get("tiers", {}).get(tier, {}).get("timings", {})
+        for step, seconds in result["timings"].items():
+            line = f"  {step:<45} {seconds:9.3f}s"
+            if step in previous:
+                line += f"  (baseline {previous[step]:.3f}s)"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark prepare_data.py on synthetic MALLET state files",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                                  # Time the small and medium tiers
+  %(prog)s --tiers large --repeat 3         # Best of 3 runs on 10M tokens
+  %(prog)s --save-baseline bench.json       # Record a baseline
+  %(prog)s --baseline bench.json            # Fail if slower than the baseline
+  %(prog)s --generate state.gz --docs 1000  # Only write a synthetic state file
+
+Size tiers:
+  tiny     40 documents, 30 tokens each, 200 words, 5 topics
+  small    500 documents, 200 tokens each, 5,000 words, 20 topics
+  medium   5,000 documents, 200 tokens each, 20,000 words, 50 topics
+  large    20,000 documents, 500 tokens each, 100,000 words, 100 topics
+        """,
+    )
+    parser.add_argument(
+        "--tiers",
+        default=",".join(DEFAULT_TIERS),
+        help=f"Comma-separated size tiers to run (default: {','.join(DEFAULT_TIERS)})",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of timed runs of each step; the fastest is kept (default: 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("python", "numpy"),
+        default="numpy",
+        help="State parser of the timed pipeline runs (default: numpy)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Parsing processes of the timed pipeline runs (default: 1)",
+    )
+    parser.add_argument(
+        "--work-dir",
+        help="Keep state files and output in this directory (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Baseline JSON to compare with; exits with status 1 on regressions",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        help="Write the results to this JSON file as a new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help=f"Allowed slowdown over the baseline as a fraction (default: {REGRESSION_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--no-golden",
+        action="store_true",
+        help="Skip checking the fast paths' output against the reference",
+    )
+    generate = parser.add_argument_group("synthetic state file")
+    generate.add_argument(
+        "--generate", metavar="FILE", help="Write a synthetic state file and exit"
+    )
+    generate.add_argument("--docs", type=int, default=1000, help="(default: 1000)")
+    generate.add_argument(
+        "--tokens-per-doc", type=int, default=200, help="(default: 200)"
+    )
+    generate.add_argument("--vocab", type=int, default=5000, help="(default: 5000)")
+    generate.add_argument("--topics", type=int, default=20, help="(default: 20)")
+    generate.add_argument("--seed", type=int, default=0, help="(default: 0)")
+
+    args = parser.parse_args()
+
+    if args.generate:
+        tokens = write_synthetic_state(
+            args.generate,
+            num_docs=args.docs,
+            tokens_per_doc=args.tokens_per_doc,
+            vocab_size=args.vocab,
+            num_topics=args.topics,
+            seed=args.seed,
+        )
+        print(f"Wrote {args.generate} with {tokens:,} tokens")
+        sys.exit(0)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(
+        [tier.strip() for tier in args.tiers.split(",") if tier.strip()],
+        args.work_dir,
+        repeat=args.repeat,
+        engine=args.engine,
+        workers=args.workers,
+        golden=not args.no_golden,
+    )
+    print_results(results, baseline)
+
+    failures = [
+        f"{tier}: {mismatch}"
+        for tier, result in results["tiers"].items()
+        for mismatch in result.get("mismatches", [])
+    ]
+    if baseline is not None:
+        failures += compare_to_baseline(results, baseline, args.threshold)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if failures:
+        print("\n❌ Benchmark failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n✅ No regressions")
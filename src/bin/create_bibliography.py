@@ -30,25 +30,14 @@ create_bibliography(
 import argparse
 import json
 import re
+from importlib.util import find_spec
 from pathlib import Path
 
-import pandas as pd
-from dateutil import parser as date_parser
-from nameparser import HumanName
-
-# Import citeproc-py components (optional dependency)
-try:
-    from citeproc import (
-        Citation,
-        CitationItem,
-        CitationStylesBibliography,
-        CitationStylesStyle,
-    )
-    from citeproc.source.json import CiteProcJSON
+# pandas, dateutil, nameparser and citeproc-py are imported by the functions
+# that use them, so that --help and CSL JSON input start quickly
 
-    CITEPROC_AVAILABLE = True
-except ImportError:
-    CITEPROC_AVAILABLE = False
+# citeproc-py is an optional dependency
+CITEPROC_AVAILABLE = find_spec("citeproc") is not None
 
 # Valid CSL JSON fields (comprehensive list)
 VALID_CSL_FIELDS = {
@@ -190,6 +179,9 @@ def parse_authors(author_string: str) -> list:
     Returns:
         list: List of author objects in CSL format
     """
+    import pandas as pd
+    from nameparser import HumanName
+
     if not author_string or pd.isna(author_string):
         return []
 
@@ -301,6 +293,9 @@ def parse_date(date_string: str) -> dict | None:
     Returns:
         dict: CSL date object with date-parts
     """
+    import pandas as pd
+    from dateutil import parser as date_parser
+
     if not date_string or pd.isna(date_string):
         return None
 
@@ -430,6 +425,14 @@ def format_citation_with_citeproc(
 
     # Try to use actual citeproc-py formatting first
     try:
+        from citeproc import (
+            Citation,
+            CitationItem,
+            CitationStylesBibliography,
+            CitationStylesStyle,
+        )
+        from citeproc.source.json import CiteProcJSON
+
         if debug:
             print(
                 f"Attempting citeproc-py formatting for {csl_entry.get('id', 'unknown')}"
@@ -573,6 +576,8 @@ def convert_metadata_to_csl(
     Returns:
         list: List of CSL entries with formatted citations
     """
+    import pandas as pd
+
     try:
         # Read CSV file
         df = pd.read_csv(metadata_file)
@@ -798,6 +803,7 @@ def create_bibliography(
     output: str = "bibliography.json",
     style: str = "chicago-author-date",
     debug: bool = False,
+    compress: bool = False,
 ):
     """Process the metadata.
 
@@ -806,6 +812,8 @@ def create_bibliography(
         output (str): Output JSON file
         style (str): Citation style for formatting
         debug (bool): Enable debug output for troubleshooting
+        compress (bool): Also write .gz and .br siblings of the output file
+            for server.py to send to browsers
     """
     # Map common style shortcuts to their full names
     style_mapping = {
@@ -868,6 +876,10 @@ def create_bibliography(
         with open(output_file, "w", encoding="utf-8") as f:
             json.dump(csl_entries, f, indent=2, ensure_ascii=False)
         print(f"Saved {len(csl_entries)} CSL entries to {output_file}")
+        if compress:
+            from prepare_data import write_compressed_siblings
+
+            write_compressed_siblings([str(output_file)])
 
         # Print some statistics
         formatted_count = sum(
@@ -921,8 +933,14 @@ def main():
         help="Output JSON file (default: bibliography.json)",
     )
 
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Also write .gz and .br (with brotli installed) siblings of the output file",
+    )
+
     args = parser.parse_args()
-    create_bibliography(args.input, args.output, args.style, args.debug)
+    create_bibliography(args.input, args.output, args.style, args.debug, args.compress)
 
 
 if __name__ == "__main__":
@@ -11,7 +11,12 @@ Processes a MALLET topic-state.gz file and generates all necessary files for dfr
 - tw.json (topic-words JSON for advanced features and dfr-browser compatibility)
 - dt.zip (sparse doc-topic matrix for advanced features and dfr-browser compatibility)
 - metadata.csv (basic document metadata if not exists)
-
+- doc-lengths.bin and doc-topic-counts.bin (token counts per document for browser)
+- vocab.txt and word-topics.bin (word frequencies and topic counts for browser)
+- topic-docs/ (top documents of each topic for browser)
+- facets/ (topic totals and documents by metadata field for browser)
+- state-seek.bin (offsets of each document in the state file, with --seek-index)
+- profile.json (time and peak memory of each stage, with --profile)
 
 To use as a module, call
 
@@ -23,18 +28,60 @@ process_mallet_state_file(statefile, output_dir, top_words, generate_all=False)
 """
 
 import argparse
+import bz2
+import cProfile
 import csv
 import gzip
+import hashlib
+import importlib
+import io
 import json
+import lzma
+import multiprocessing
 import os
+import platform
+import queue
+import shutil
+import sys
+import threading
+import time
 import warnings
 import zipfile as zf
-from collections import defaultdict
+import zlib
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass
+from functools import partial
+from itertools import pairwise
+from typing import TYPE_CHECKING, Self
 
-# For topic coordinate generation
 import numpy as np
-import pandas as pd
-from sklearn.manifold import MDS
+
+# pandas, scipy and sklearn are imported by the stages that use them, so that
+# --help and the state parser start without loading them
+if TYPE_CHECKING:
+    import pandas as pd
+    from scipy import sparse
+
+# Brotli siblings of output files (optional dependency)
+try:
+    import brotli
+
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Peak memory of finished child processes (Unix only)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+JSD_BLOCK_CELLS = 1 << 22  # Target topic pairs x words per distance block
+LAYOUT_ENGINES = ("smacof", "classical")
 
 
 # --- Topic coordinate generation (from scale_topics.py) ---
@@ -51,12 +98,13 @@ def topic_word_matrix_from_topic_words(
     Returns:
         np.ndarray: Topic-word matrix of shape (num_topics, vocab_size)
     """
+    word_index = {word: i for i, word in enumerate(vocab)}
     mat = np.zeros((len(topic_words), len(vocab)))
     for i, topic in enumerate(topic_words):
         words = topic["words"][:top_n]
         for rank, word in enumerate(words):
-            if word in vocab:
-                mat[i, vocab.index(word)] = 1.0 / (rank + 1)
+            if word in word_index:
+                mat[i, word_index[word]] = 1.0 / (rank + 1)
         if mat[i].sum() > 0:
             mat[i] /= mat[i].sum()
     return mat
@@ -81,29 +129,200 @@ def jensen_shannon(p: np.ndarray, q: np.ndarray) -> float:
     return 0.5 * kl(p, m) + 0.5 * kl(q, m)
 
 
-def jsd_matrix(mat: np.ndarray) -> np.ndarray:
+def topic_word_distributions(
+    topic_word_counts: "np.ndarray | sparse.spmatrix", beta: float
+) -> "tuple[sparse.csr_matrix, np.ndarray]":
+    """Compute smoothed topic-word distributions over the full vocabulary.
+
+    The smoothed distribution p(w|k) = (n_kw + beta) / (n_k + V * beta) is
+    returned as a sparse part (n_kw / (n_k + V * beta)) plus a per-topic
+    smoothing mass added to every word, so it never has to be stored densely.
+
+    Args:
+        topic_word_counts (np.ndarray | sparse.spmatrix): Topic-word counts
+            (num_topics x vocab_size)
+        beta (float): Topic-word smoothing parameter
+
+    Returns:
+        tuple[sparse.csr_matrix, np.ndarray]: Sparse part and per-topic smoothing
+    """
+    from scipy import sparse
+
+    counts = sparse.csr_matrix(topic_word_counts, dtype=np.float64)
+    vocab_size = counts.shape[1]
+    denominators = np.asarray(counts.sum(axis=1)).ravel() + vocab_size * beta
+    scale = np.divide(
+        1.0, denominators, out=np.zeros_like(denominators), where=denominators > 0
+    )
+    return sparse.diags(scale) @ counts, beta * scale
+
+
+def _xlogx(x: np.ndarray) -> np.ndarray:
+    """Elementwise x * log(x), with 0 * log(0) = 0."""
+    positive = x > 0
+    return np.where(positive, x * np.log(np.where(positive, x, 1.0)), 0.0)
+
+
+def jsd_matrix(
+    mat: "np.ndarray | sparse.spmatrix",
+    smoothing: np.ndarray | None = None,
+    n_jobs: int = 1,
+    block_size: int | None = None,
+) -> np.ndarray:
     """Compute Jensen-Shannon distance matrix for topic-word distributions.
 
+    Uses JS(P || Q) = H(M) - (H(P) + H(Q)) / 2 with H(X) = -sum(x log x), so
+    the per-topic terms are computed once and only the mixture term is
+    computed per pair, over blocks of topics with broadcasting. Only the upper
+    triangle of blocks is computed; the lower one is mirrored.
+
     Args:
-        mat (np.ndarray): Topic-word matrix (num_topics x vocab_size)
+        mat (np.ndarray | sparse.spmatrix): Topic-word distributions
+            (num_topics x vocab_size). With a sparse matrix, each block pair
+            only touches the words either block uses.
+        smoothing (np.ndarray | None): Per-topic mass added to every word of the
+            distribution, as returned by `topic_word_distributions`
+        n_jobs (int): Number of threads computing blocks in parallel
+        block_size (int | None): Topics per block (default: sized to keep each
+            block pair near JSD_BLOCK_CELLS cells)
 
     Returns:
         np.ndarray: Jensen-Shannon distance matrix (num_topics x num_topics)
     """
-    n = mat.shape[0]
+    from scipy import sparse
+
+    is_sparse = sparse.issparse(mat)
+    mat = (
+        sparse.csr_matrix(mat, dtype=np.float64)
+        if is_sparse
+        else np.asarray(mat, dtype=np.float64)
+    )
+    n, vocab_size = mat.shape
+    floor = (
+        np.zeros(n) if smoothing is None else np.asarray(smoothing, dtype=np.float64)
+    )
+
+    # Per-topic sum of x log x, computed once
+    if is_sparse:
+        rows = np.repeat(np.arange(n), np.diff(mat.indptr))
+        self_terms = np.bincount(
+            rows, weights=_xlogx(mat.data + floor[rows]), minlength=n
+        ) + (vocab_size - np.diff(mat.indptr)) * _xlogx(floor)
+    else:
+        self_terms = _xlogx(mat + floor[:, None]).sum(axis=1)
+
+    if block_size is None:
+        block_size = int(np.sqrt(JSD_BLOCK_CELLS / max(vocab_size, 1)))
+    block_size = max(1, block_size)
+    blocks = [np.arange(i, min(i + block_size, n)) for i in range(0, n, block_size)]
     dist = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            dist[i, j] = jensen_shannon(mat[i], mat[j])
+
+    def fill_block(pair):
+        rows_i, rows_j = pair
+        if is_sparse:
+            block_i, block_j = mat[rows_i], mat[rows_j]
+            cols = np.union1d(block_i.indices, block_j.indices)
+            p = block_i[:, cols].toarray()
+            q = block_j[:, cols].toarray()
+            untouched = vocab_size - len(cols)
+        else:
+            p, q = mat[rows_i], mat[rows_j]
+            untouched = 0
+        p = p + floor[rows_i, None]
+        q = q + floor[rows_j, None]
+        mixture = _xlogx(0.5 * (p[:, None, :] + q[None, :, :])).sum(axis=2)
+        if untouched:
+            mixture += untouched * _xlogx(
+                0.5 * (floor[rows_i, None] + floor[None, rows_j])
+            )
+        block = 0.5 * (self_terms[rows_i, None] + self_terms[None, rows_j]) - mixture
+        dist[np.ix_(rows_i, rows_j)] = block
+        dist[np.ix_(rows_j, rows_i)] = block.T
+
+    pairs = [(bi, bj) for i, bi in enumerate(blocks) for bj in blocks[i:]]
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(fill_block, pairs))
+    else:
+        for pair in pairs:
+            fill_block(pair)
+
+    # Clear rounding noise: divergences are non-negative and zero on the diagonal
+    np.maximum(dist, 0.0, out=dist)
+    np.fill_diagonal(dist, 0.0)
     return dist
 
 
-def compute_mds(dist: np.ndarray, n_components: int = 2) -> np.ndarray:
+def classical_mds(dist: np.ndarray, n_components: int = 2) -> np.ndarray:
+    """Compute classical MDS (PCoA) coordinates from a distance matrix.
+
+    Double-centres the squared distances and takes the top eigenvectors, so it
+    needs a single eigen-decomposition and no iterations.
+
+    Args:
+        dist (np.ndarray): Distance matrix (num_topics x num_topics)
+        n_components (int): Number of MDS components (default: 2)
+
+    Returns:
+        np.ndarray: MDS coordinates (num_topics x n_components)
+    """
+    n = dist.shape[0]
+    squared = np.asarray(dist, dtype=np.float64) ** 2
+    centred = squared - squared.mean(axis=0) - squared.mean(axis=1)[:, None]
+    centred += squared.mean()
+    eigenvalues, eigenvectors = np.linalg.eigh(-0.5 * centred)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    coords = np.zeros((n, n_components))
+    k = len(order)
+    coords[:, :k] = eigenvectors[:, order] * np.sqrt(np.maximum(eigenvalues[order], 0))
+    # Fix the sign of each axis so repeated runs give the same picture
+    signs = np.sign(coords[np.abs(coords).argmax(axis=0), np.arange(n_components)])
+    signs[signs == 0] = 1.0
+    return coords * signs
+
+
+def layout_stress(dist: np.ndarray, coords: np.ndarray) -> float:
+    """Compute Kruskal's stress-1 of a layout against its distance matrix.
+
+    Args:
+        dist (np.ndarray): Distance matrix (num_topics x num_topics)
+        coords (np.ndarray): Layout coordinates (num_topics x n_components)
+
+    Returns:
+        float: Stress-1 (0 is a perfect fit)
+    """
+    upper = np.triu_indices(dist.shape[0], k=1)
+    layout_dist = np.sqrt(((coords[:, None, :] - coords[None, :, :]) ** 2).sum(axis=2))[
+        upper
+    ]
+    total = float((dist[upper] ** 2).sum())
+    if total == 0:
+        return 0.0
+    return float(np.sqrt(((dist[upper] - layout_dist) ** 2).sum() / total))
+
+
+def compute_mds(
+    dist: np.ndarray,
+    n_components: int = 2,
+    engine: str = "smacof",
+    n_jobs: int | None = None,
+    init: np.ndarray | None = None,
+    tol: float = 1e-3,
+) -> np.ndarray:
     """Compute MDS coordinates from distance matrix.
 
     Args:
         dist (np.ndarray): Distance matrix (num_topics x num_topics)
         n_components (int): Number of MDS components (default: 2)
+        engine (str): Layout engine: "smacof" runs sklearn's iterative metric
+            MDS with 4 initializations; "classical" runs classical MDS (PCoA),
+            which is much faster and does not need sklearn
+        n_jobs (int | None): Number of SMACOF initializations run in parallel
+        init (np.ndarray | None): Initial SMACOF configuration (num_topics x
+            n_components). If given, SMACOF runs once from it instead of from
+            4 random starts.
+        tol (float): Relative stress improvement below which SMACOF stops
+            when started from `init`; random starts keep sklearn's default
 
     Returns:
         np.ndarray: MDS coordinates (num_topics x n_components)
@@ -111,66 +330,284 @@ def compute_mds(dist: np.ndarray, n_components: int = 2) -> np.ndarray:
     # NOTE:
     When all topics are identical or very similar, the Jensen-Shannon distance matrix will have very small or zero distances. Division by zero/near-zero triggers a RuntimeWarning in sklearn's MDS implementation. This may be caused by not enough documents to create distinct topics, by the model creating redundant/similar topics, by poor model quality, or by homogeneous data in which documents are too similar. This function will calculate coordinates anyway, so we suppress the warning.
     """
+    if engine not in LAYOUT_ENGINES:
+        raise ValueError(f"Unknown layout engine: {engine!r}")
+    if engine == "classical":
+        return classical_mds(dist, n_components)
+
+    from sklearn.manifold import MDS
+
     # Suppress the specific RuntimeWarning from sklearn
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=RuntimeWarning)
 
+        # A warm start is already close to its optimum, so one run with a
+        # looser tolerance settles it
+        options = {"n_init": 4} if init is None else {"n_init": 1, "eps": tol}
         mds = MDS(
             n_components=n_components,
             dissimilarity="precomputed",
             random_state=42,
-            n_init=4,
             max_iter=300,
+            n_jobs=n_jobs,
+            **options,
         )
-        coords = mds.fit_transform(dist)
+        coords = mds.fit_transform(dist, init=init)
 
     return coords
 
 
+def read_topic_alignment(filepath: str) -> dict[int, int]:
+    """Read a topic alignment CSV with `topic` and `previous_topic` columns.
+
+    Args:
+        filepath (str): Path to the alignment CSV
+
+    Returns:
+        dict[int, int]: Mapping of topic numbers to previous topic numbers
+    """
+    import pandas as pd
+
+    df = pd.read_csv(filepath)
+    return dict(zip(df["topic"].astype(int), df["previous_topic"].astype(int)))
+
+
+def warm_start_layout(
+    dist: np.ndarray,
+    previous_coords: "pd.DataFrame",
+    topic_alignment: dict[int, int] | None = None,
+) -> tuple[np.ndarray | None, np.ndarray]:
+    """Build an initial layout from the coordinates of a previous model.
+
+    Aligned topics start at their previous position. Each new topic starts
+    next to the aligned topic it is closest to.
+
+    Args:
+        dist (np.ndarray): Distance matrix (num_topics x num_topics)
+        previous_coords (pd.DataFrame): Previous topic_coords.csv data
+        topic_alignment (dict[int, int] | None): Mapping of topic numbers to
+            previous topic numbers (default: topics keep their numbers)
+
+    Returns:
+        tuple[np.ndarray | None, np.ndarray]: Initial coordinates (None if no
+            topic is aligned) and the indices of the aligned topics
+    """
+    n = dist.shape[0]
+    previous = {
+        int(t): (x, y)
+        for t, x, y in zip(
+            previous_coords["topic"], previous_coords["x"], previous_coords["y"]
+        )
+    }
+    if topic_alignment is None:
+        topic_alignment = {t: t for t in range(n)}
+    matched = np.array(
+        [t for t in range(n) if topic_alignment.get(t) in previous], dtype=np.int64
+    )
+    if len(matched) == 0:
+        return None, matched
+
+    init = np.zeros((n, 2))
+    init[matched] = [previous[topic_alignment[t]] for t in matched]
+    spread = float(np.ptp(init[matched], axis=0).max()) or 1.0
+    for t in sorted(set(range(n)) - set(matched.tolist())):
+        nearest = matched[np.argmin(dist[t, matched])]
+        angle = 2.0 * np.pi * t / n
+        init[t] = init[nearest] + 0.01 * spread * np.array(
+            [np.cos(angle), np.sin(angle)]
+        )
+    return init, matched
+
+
+def procrustes_align(
+    coords: np.ndarray, target: np.ndarray, matched: np.ndarray
+) -> np.ndarray:
+    """Rotate, reflect and shift a layout onto a target layout.
+
+    Fits the orthogonal transform on the matched topics only, without scaling,
+    so topics keep their places across model versions.
+
+    Args:
+        coords (np.ndarray): Layout to align (num_topics x 2)
+        target (np.ndarray): Target positions (num_topics x 2)
+        matched (np.ndarray): Indices of topics with a target position
+
+    Returns:
+        np.ndarray: Aligned layout
+    """
+    source_centre = coords[matched].mean(axis=0)
+    target_centre = target[matched].mean(axis=0)
+    u, _, vt = np.linalg.svd(
+        (coords[matched] - source_centre).T @ (target[matched] - target_centre)
+    )
+    return (coords - source_centre) @ (u @ vt) + target_centre
+
+
 def write_topic_coords_csv(
-    topic_words: list[dict], output_dir: str, top_n: int = 15
-) -> None:
+    topic_words: list[dict],
+    output_dir: str,
+    top_n: int = 15,
+    topic_word: "np.ndarray | sparse.spmatrix | None" = None,
+    beta: float = 0.01,
+    n_jobs: int = 1,
+    layout: str = "smacof",
+    mds_jobs: int | None = None,
+    previous_coords: str | None = None,
+    topic_alignment: dict[int, int] | None = None,
+    profile: "PipelineProfile | None" = None,
+) -> list[str]:
     """Generate and write topic_coords.csv for dfr-browser.
 
     Args:
         topic_words (list[dict]): List of topic words data structures
         output_dir (str): Directory to write the CSV file
         top_n (int): Number of top words to consider per topic
+        topic_word (np.ndarray | sparse.spmatrix | None): Topic-word counts; if
+            given, distances use the smoothed distributions over the full
+            vocabulary instead of the rank-weighted top_n words
+        beta (float): Topic-word smoothing parameter for `topic_word`
+        n_jobs (int): Number of threads computing the distance matrix
+        layout (str): Layout engine passed to `compute_mds`
+        mds_jobs (int | None): Number of SMACOF initializations run in parallel
+        previous_coords (str | None): Path to the topic_coords.csv of a previous
+            model version; its layout is used as the SMACOF starting point and
+            the result is rotated onto it
+        topic_alignment (dict[int, int] | None): Mapping of topic numbers to
+            topic numbers in `previous_coords` (default: identity)
+        profile (PipelineProfile | None): Profile recording the "jsd" and
+            "mds" stages
+
+    Returns:
+        list[str]: Paths of the files written
     """
-    # Build vocab from all top words
-    vocab = sorted({w for topic in topic_words for w in topic["words"][:top_n]})
-    mat = topic_word_matrix_from_topic_words(topic_words, vocab, top_n=top_n)
-    dist = jsd_matrix(mat)
-    coords = compute_mds(dist)
+    import pandas as pd
+
+    with profile_stage(profile, "jsd"):
+        if topic_word is not None:
+            mat, smoothing = topic_word_distributions(topic_word, beta)
+            dist = jsd_matrix(mat, smoothing=smoothing, n_jobs=n_jobs)
+        else:
+            # Build vocab from all top words
+            vocab = sorted({w for topic in topic_words for w in topic["words"][:top_n]})
+            mat = topic_word_matrix_from_topic_words(topic_words, vocab, top_n=top_n)
+            dist = jsd_matrix(mat, n_jobs=n_jobs)
+    init, matched = None, None
+    if previous_coords is not None:
+        init, matched = warm_start_layout(
+            dist, pd.read_csv(previous_coords), topic_alignment
+        )
+        if init is None:
+            print("No topics aligned with the previous layout, starting cold")
+    start = time.perf_counter()
+    with profile_stage(profile, "mds"):
+        coords = compute_mds(dist, engine=layout, n_jobs=mds_jobs, init=init)
+        if init is not None:
+            coords = procrustes_align(coords, init, matched)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{layout} layout: stress-1 {layout_stress(dist, coords):.4f} in {elapsed:.2f}s"
+    )
     df = pd.DataFrame(
         {"topic": list(range(len(topic_words))), "x": coords[:, 0], "y": coords[:, 1]}
     )
     filepath = os.path.join(output_dir, "topic_coords.csv")
     df.to_csv(filepath, index=False)
     print(f"Wrote topic_coords.csv with {len(topic_words)} topics")
+    return [filepath]
 
 
 def get_top_words_and_weights(
-    topic_word_counts: list[int], vocab: dict, n: int
+    topic_word_counts: np.ndarray | list[int], vocab: list[str] | dict, n: int
 ) -> dict[str, list[str | float]]:
     """Get the top n words and their weights for a topic.
 
+    Candidates are selected with `np.argpartition`, so only the top n words are
+    sorted. Ties are broken by word index, as a stable full sort would do.
+
     Args:
-        topic_word_counts (list[int]): List of word counts for the topic
-        vocab (dict): Mapping of word indices to word strings
+        topic_word_counts (np.ndarray | list[int]): Word counts for the topic
+        vocab (list[str] | dict): Mapping of word indices to word strings
         n (int): Number of top words to retrieve
 
     Returns:
         dict: Dictionary with 'words' and 'weights' lists
     """
-    word_indices = list(range(len(topic_word_counts)))
-    word_indices.sort(key=lambda i: -topic_word_counts[i])
+    counts = np.asarray(topic_word_counts, dtype=np.int64)
+    n = min(n, len(counts))
+    if n <= 0:
+        return {"words": [], "weights": []}
+    if n < len(counts):
+        candidates = np.argpartition(-counts, n - 1)[:n]
+        threshold = counts[candidates].min()
+        above = np.flatnonzero(counts > threshold)
+        ties = np.flatnonzero(counts == threshold)[: n - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(len(counts))
+    top = candidates[np.lexsort((candidates, -counts[candidates]))].tolist()
     return {
-        "words": [vocab[i] for i in word_indices[:n]],
-        "weights": [topic_word_counts[i] for i in word_indices[:n]],
+        "words": [vocab[i] for i in top],
+        "weights": counts[top].tolist(),
     }
 
 
+CHUNK_ROWS = 10_000  # Documents read, normalized or formatted at a time by default
+
+
+def doc_topic_csc(
+    doc_topic_counts: np.ndarray,
+    chunk_rows: int | None = None,
+    spill_path: str | None = None,
+) -> dict:
+    """Build the compressed sparse column form of doc-topic counts.
+
+    Topic `t` has documents i[p[t]:p[t + 1]], in order, with counts
+    x[p[t]:p[t + 1]]. The counts are read twice, chunk by chunk: once to
+    count each topic's documents and once to fill in the arrays.
+
+    Args:
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics),
+            possibly a disk-backed np.memmap
+        chunk_rows (int | None): Number of documents read at a time
+            (default: CHUNK_ROWS)
+        spill_path (str | None): Build 'i' and 'x' in memory-mapped files at
+            this path plus ".i" and ".x", which the caller removes
+            (default: in memory)
+
+    Returns:
+        dict: Arrays under 'i' (uint32 doc indices), 'p' (int64 topic
+            offsets) and 'x' (int32 counts)
+    """
+    num_topics = np.shape(doc_topic_counts)[1]
+    nonzero = np.zeros(num_topics, dtype=np.int64)
+    for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows):
+        nonzero += np.count_nonzero(chunk, axis=0)
+    indptr = np.zeros(num_topics + 1, dtype=np.int64)
+    np.cumsum(nonzero, out=indptr[1:])
+    if spill_path is not None and indptr[-1]:
+        indices = np.memmap(
+            spill_path + ".i", dtype=np.uint32, mode="w+", shape=indptr[-1]
+        )
+        data = np.memmap(spill_path + ".x", dtype=np.int32, mode="w+", shape=indptr[-1])
+    else:
+        indices = np.empty(indptr[-1], dtype=np.uint32)
+        data = np.empty(indptr[-1], dtype=np.int32)
+
+    cursor = indptr[:-1].copy()  # Next free slot of each topic
+    start = 0
+    for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows):
+        # Transposed, so nonzero cells come by topic, then document
+        topics, docs = np.nonzero(chunk.T)
+        counts_per_topic = np.bincount(topics, minlength=num_topics)
+        group_starts = np.cumsum(counts_per_topic) - counts_per_topic
+        slots = cursor[topics] + np.arange(len(topics)) - group_starts[topics]
+        indices[slots] = docs + start
+        data[slots] = chunk[docs, topics]
+        cursor += counts_per_topic
+        start += len(chunk)
+    return {"i": indices, "p": indptr, "x": data}
+
+
 def sparse_doc_topic_matrix(doc_topic_matrix: list[list[int]]) -> dict:
     """Convert a dense doc-topic matrix to a sparse representation.
 
@@ -180,53 +617,55 @@ def sparse_doc_topic_matrix(doc_topic_matrix: list[list[int]]) -> dict:
     Returns:
         dict: Sparse matrix representation with 'i', 'p', 'x' keys
     """
-    num_docs = len(doc_topic_matrix[0])
-    indices = []
-    indptr = [0]
-    data = []
-    nnz = 0  # Number of non-zeros
-    for topic_counts in doc_topic_matrix:
-        for doc_idx in range(num_docs):
-            count = topic_counts[doc_idx]
-            if count != 0:
-                indices.append(doc_idx)
-                data.append(count)
-                nnz += 1
-        indptr.append(nnz)
-    return {"i": indices, "p": indptr, "x": data}
+    csc = doc_topic_csc(np.asarray(doc_topic_matrix, dtype=np.int64).T)
+    return {key: values.tolist() for key, values in csc.items()}
 
 
-def normalize_doc_topic_proportions(doc_topic_counts: list[dict]) -> list[list[float]]:
+def normalize_doc_topic_proportions(doc_topic_counts: np.ndarray) -> np.ndarray:
     """Convert raw counts to normalized proportions for each document.
 
     Args:
-        doc_topic_counts (list[dict]): List of dicts with topic counts per document
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics)
 
     Returns:
-        list[list[float]]: List of normalized topic proportions per document
+        np.ndarray: Normalized topic proportions per document; documents with
+            no tokens get all-zero rows
     """
-    proportions = []
-    for doc_counts in doc_topic_counts:
-        total = sum(doc_counts.values())
-        if total == 0:
-            proportions.append([0.0] * len(doc_counts))
-        else:
-            # Create normalized proportions for all topics
-            max_topic = max(doc_counts.keys()) if doc_counts else 0
-            doc_proportions = []
-            for topic in range(max_topic + 1):
-                prop = doc_counts.get(topic, 0) / total
-                doc_proportions.append(prop)
-            proportions.append(doc_proportions)
+    counts = np.asarray(doc_topic_counts)
+    totals = counts.sum(axis=1, keepdims=True)
+    proportions = np.zeros(counts.shape, dtype=np.float64)
+    np.divide(counts, totals, out=proportions, where=totals > 0)
     return proportions
 
 
-def write_topic_keys_txt(topic_words: list[dict], output_dir: str) -> None:
+def iter_doc_proportions(doc_topic_counts: np.ndarray, chunk_rows: int | None = None):
+    """Yield normalized topic proportions for consecutive chunks of documents.
+
+    Args:
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics),
+            possibly a disk-backed np.memmap
+        chunk_rows (int | None): Number of documents per chunk (default: CHUNK_ROWS)
+
+    Yields:
+        np.ndarray: Normalized topic proportions for the next chunk of documents
+    """
+    num_docs = len(doc_topic_counts)
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    for start in range(0, num_docs, chunk_rows):
+        yield normalize_doc_topic_proportions(
+            doc_topic_counts[start : start + chunk_rows]
+        )
+
+
+def write_topic_keys_txt(topic_words: list[dict], output_dir: str) -> list[str]:
     """Write topic-keys.txt file compatible with dfr-browser.
 
     Args:
         topic_words (list[dict]): List of topic words data structures
         output_dir (str): Directory to write the topic-keys.txt file
+
+    Returns:
+        list[str]: Paths of the files written
     """
     filepath = os.path.join(output_dir, "topic-keys.txt")
     with open(filepath, "w") as f:
@@ -235,55 +674,392 @@ def write_topic_keys_txt(topic_words: list[dict], output_dir: str) -> None:
             # Format: topic_number weight word1 word2 word3...
             f.write(f"{i}\t1.0\t{' '.join(words)}\n")
     print(f"Wrote topic-keys.txt with {len(topic_words)} topics")
+    return [filepath]
+
+
+PROPORTION_DECIMALS = 10  # Decimal places of proportions in doc-topic.txt
+
+
+def format_proportions(values: np.ndarray, decimals: int = PROPORTION_DECIMALS):
+    """Format values in [0, 1] with fixed decimals in bulk.
+
+    Gives the same digits as f"{value:.{decimals}f}", without formatting
+    each value in Python: values are scaled and rounded with NumPy and
+    their digits taken arithmetically. Values whose scaled float is too
+    close to a rounding tie to decide are formatted by Python.
+
+    Args:
+        values (np.ndarray): Values between 0 and 1
+        decimals (int): Number of decimal places (at most 16)
+
+    Returns:
+        np.ndarray: ASCII codes (uint8), shape values.shape + (decimals + 2,)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    width = decimals + 2
+    text = np.empty((values.size, width), dtype=np.uint8)
+    text[:] = np.frombuffer(f"{0:.{decimals}f}".encode(), dtype=np.uint8)
 
+    # Zeros, usually most cells, keep the template
+    nonzero = np.flatnonzero(values)
+    scaled = values.ravel()[nonzero] * 10.0**decimals
+    rounded = np.rint(scaled).astype(np.int64)
+    # Split the integer part and digits into halves that fit in int32
+    low_digits = decimals // 2
+    high, low = np.divmod(rounded, 10**low_digits)
+    digits = np.empty((len(nonzero), decimals + 1), dtype=np.uint8)
+    for part, start, count in (
+        (high, 0, decimals + 1 - low_digits),
+        (low, decimals + 1 - low_digits, low_digits),
+    ):
+        powers = 10 ** np.arange(count - 1, -1, -1, dtype=np.int32)
+        digits[:, start : start + count] = (
+            part.astype(np.int32)[:, None] // powers % 10 + 48
+        )
+    text[nonzero, 0] = digits[:, 0]
+    text[nonzero, 2:] = digits[:, 1:]
+
+    for tie in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-5):
+        value = f"{values.ravel()[nonzero[tie]]:.{decimals}f}"
+        text[nonzero[tie]] = np.frombuffer(value.encode(), dtype=np.uint8)
+    return text.reshape(values.shape + (width,))
 
-def write_doc_topic_txt(doc_proportions: list[list[float]], output_dir: str) -> None:
+
+def write_doc_topic_txt(doc_proportions, output_dir: str) -> list[str]:
     """Write doc-topic.txt file compatible with dfr-browser.
 
     Args:
-        doc_proportions (list[list[float]]): List of normalized topic proportions per document
+        doc_proportions (np.ndarray | Iterator[np.ndarray]): Normalized topic
+            proportions per document, or an iterator over consecutive chunks
+            of them
         output_dir (str): Directory to write the doc-topic.txt file
+
+    Returns:
+        list[str]: Paths of the files written
     """
+    if not isinstance(doc_proportions, Iterator):
+        doc_proportions = [doc_proportions]
     filepath = os.path.join(output_dir, "doc-topic.txt")
+    doc_idx = 0
     with open(filepath, "w") as f:
-        for doc_idx, proportions in enumerate(doc_proportions):
+        for chunk in doc_proportions:
+            chunk = np.asarray(chunk, dtype=np.float64)
+            if chunk.size == 0:
+                continue
             # Format: docNum docName proportion1 proportion2 ...
-            prop_str = "\t".join(f"{p:.10f}" for p in proportions)
-            f.write(f"{doc_idx}\tdoc{doc_idx + 1}\t{prop_str}\n")
-    print(f"Wrote doc-topic.txt with {len(doc_proportions)} documents")
+            cells = format_proportions(chunk)
+            rows = np.empty(cells.shape[:2] + (cells.shape[2] + 1,), dtype=np.uint8)
+            rows[..., :-1] = cells
+            rows[..., -1] = ord("\t")
+            rows[:, -1, -1] = ord("\n")
+            text = rows.tobytes().decode("ascii")
+            row_length = rows[0].size
+            f.write(
+                "".join(
+                    f"{doc_idx + i}\tdoc{doc_idx + i + 1}\t"
+                    + text[i * row_length : (i + 1) * row_length]
+                    for i in range(len(chunk))
+                )
+            )
+            doc_idx += len(chunk)
+    print(f"Wrote doc-topic.txt with {doc_idx} documents")
+    return [filepath]
+
+
+DOC_TOPIC_BINARY_MAGIC = b"DFRT"
+DOC_TOPIC_BINARY_FORMATS = ("float32", "uint16")
+UINT16_SCALE = 65535  # Fixed-point scale of uint16 proportions
+
+
+def _write_binary_header(f, header: dict) -> None:
+    """Write the magic bytes, header length and JSON header of a binary file.
+
+    The header is padded with spaces so the data that follows starts on an
+    8-byte boundary, where browsers can view it as a typed array.
+    """
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(8 + len(header_bytes)) % 8)
+    f.write(DOC_TOPIC_BINARY_MAGIC)
+    f.write(np.uint32(len(header_bytes)).astype("<u4").tobytes())
+    f.write(header_bytes)
+
+
+def _read_binary_header(f, filepath: str) -> dict:
+    """Read the header of a binary file, leaving `f` at the start of the data."""
+    if f.read(4) != DOC_TOPIC_BINARY_MAGIC:
+        raise ValueError(f"Not a dfr-browser binary file: {filepath}")
+    header_length = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+    return json.loads(f.read(header_length))
+
+
+def write_binary_arrays(filepath: str, header: dict, arrays: list[tuple]) -> None:
+    """Write named 1-D arrays to a binary file with a JSON header.
+
+    The file layout is that of doc-topic.bin. The header's "arrays" entry
+    gives the dtype, byte offset (from the end of the header) and length of
+    each array; every array starts on an 8-byte boundary.
+
+    Args:
+        filepath (str): Path of the file to write
+        header (dict): Additional header fields
+        arrays (list[tuple]): (name, dtype, length, chunks) for each array,
+            where `chunks` is an iterable of consecutive parts of the array
+    """
+    layout = {}
+    offset = 0
+    for name, dtype, length, _ in arrays:
+        layout[name] = {"dtype": dtype, "offset": offset, "length": length}
+        nbytes = length * np.dtype(dtype).itemsize
+        offset += nbytes + (-nbytes % 8)
+
+    with open(filepath, "wb") as f:
+        _write_binary_header(f, {**header, "byteOrder": "little", "arrays": layout})
+        for name, dtype, length, chunks in arrays:
+            little_endian = np.dtype(dtype).newbyteorder("<")
+            written = 0
+            for chunk in chunks:
+                data = np.asarray(chunk).astype(little_endian, copy=False)
+                f.write(data.tobytes())
+                written += data.size
+            if written != length:
+                raise ValueError(f"Array {name!r} has {written} values, not {length}")
+            f.write(b"\0" * (-(length * little_endian.itemsize) % 8))
+
+
+def read_binary_arrays(filepath: str) -> tuple[dict, dict[str, np.ndarray]]:
+    """Read a file written by `write_binary_arrays`.
+
+    Args:
+        filepath (str): Path of the binary file
+
+    Returns:
+        tuple[dict, dict[str, np.ndarray]]: Header and arrays by name
+    """
+    with open(filepath, "rb") as f:
+        header = _read_binary_header(f, filepath)
+        data = f.read()
+    arrays = {
+        name: np.frombuffer(
+            data,
+            dtype=np.dtype(spec["dtype"]).newbyteorder("<"),
+            count=spec["length"],
+            offset=spec["offset"],
+        )
+        for name, spec in header["arrays"].items()
+    }
+    return header, arrays
+
+
+def _iter_row_chunks(matrix: np.ndarray, chunk_rows: int | None = None):
+    """Yield consecutive row chunks of a (possibly memory-mapped) matrix."""
+    num_rows = len(matrix)
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    for start in range(0, num_rows, chunk_rows):
+        yield np.asarray(matrix[start : start + chunk_rows])
+
+
+def write_doc_lengths_bin(
+    doc_topic_counts: np.ndarray, output_dir: str, chunk_rows: int | None = None
+) -> list[str]:
+    """Write doc-lengths.bin with the number of tokens in each document.
+
+    Args:
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics)
+        output_dir (str): Directory to write the doc-lengths.bin file
+        chunk_rows (int | None): Number of documents read at a time
+            (default: CHUNK_ROWS)
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    num_docs = len(doc_topic_counts)
+    lengths = (
+        chunk.sum(axis=1) for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows)
+    )
+    filepath = os.path.join(output_dir, "doc-lengths.bin")
+    write_binary_arrays(
+        filepath, {"numDocs": num_docs}, [("lengths", "uint32", num_docs, lengths)]
+    )
+    print(f"Wrote doc-lengths.bin with {num_docs} documents")
+    return [filepath]
+
+
+def write_doc_topic_counts_bin(
+    doc_topic_counts: np.ndarray, output_dir: str, chunk_rows: int | None = None
+) -> list[str]:
+    """Write doc-topic-counts.bin, the raw doc-topic counts in CSR form.
+
+    Row `d` holds topics `indices[indptr[d]:indptr[d + 1]]` with counts
+    `data[indptr[d]:indptr[d + 1]]`.
+
+    Args:
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics)
+        output_dir (str): Directory to write the doc-topic-counts.bin file
+        chunk_rows (int | None): Number of documents read at a time
+            (default: CHUNK_ROWS)
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    num_docs, num_topics = doc_topic_counts.shape
+    # First pass: row sizes, so every array's length is known up front
+    row_nnz = np.concatenate(
+        [
+            np.count_nonzero(chunk, axis=1)
+            for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows)
+        ]
+        or [np.zeros(0, dtype=np.int64)]
+    )
+    indptr = np.zeros(num_docs + 1, dtype=np.int64)
+    np.cumsum(row_nnz, out=indptr[1:])
+    nnz = int(indptr[-1])
+    if nnz > np.iinfo(np.uint32).max:
+        raise ValueError("Too many non-zero doc-topic counts for doc-topic-counts.bin")
+
+    index_dtype = "uint16" if num_topics <= 1 << 16 else "uint32"
+    indices = (
+        np.nonzero(chunk)[1] for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows)
+    )
+    data = (
+        chunk[np.nonzero(chunk)]
+        for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows)
+    )
+    filepath = os.path.join(output_dir, "doc-topic-counts.bin")
+    write_binary_arrays(
+        filepath,
+        {"numDocs": num_docs, "numTopics": num_topics, "nnz": nnz},
+        [
+            ("indptr", "uint32", num_docs + 1, [indptr]),
+            ("indices", index_dtype, nnz, indices),
+            ("data", "uint32", nnz, data),
+        ],
+    )
+    print(f"Wrote doc-topic-counts.bin with {nnz:,} non-zero counts")
+    return [filepath]
+
+
+def write_doc_topic_bin(
+    doc_proportions,
+    num_docs: int,
+    num_topics: int,
+    output_dir: str,
+    dtype: str = "float32",
+) -> list[str]:
+    """Write doc-topic.bin, a binary doc-topic proportion matrix for dfr-browser.
+
+    The file starts with the magic bytes "DFRT", the header length as a
+    little-endian uint32 and a JSON header padded with spaces so the matrix
+    is 8-byte aligned. The matrix follows as little-endian float32 values, or
+    uint16 fixed-point values (proportion x 65535), one row per document.
+
+    Args:
+        doc_proportions (np.ndarray | Iterator[np.ndarray]): Normalized topic
+            proportions per document, or an iterator over consecutive chunks
+            of them
+        num_docs (int): Number of documents
+        num_topics (int): Number of topics
+        output_dir (str): Directory to write the doc-topic.bin file
+        dtype (str): Value encoding: "float32" or "uint16"
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    if dtype not in DOC_TOPIC_BINARY_FORMATS:
+        raise ValueError(f"Unknown doc-topic binary format: {dtype!r}")
+    if not isinstance(doc_proportions, Iterator):
+        doc_proportions = [doc_proportions]
+    header = {
+        "dtype": dtype,
+        "byteOrder": "little",
+        "numDocs": num_docs,
+        "numTopics": num_topics,
+    }
+    if dtype == "uint16":
+        header["scale"] = UINT16_SCALE
+    filepath = os.path.join(output_dir, "doc-topic.bin")
+    with open(filepath, "wb") as f:
+        _write_binary_header(f, header)
+        for chunk in doc_proportions:
+            chunk = np.asarray(chunk, dtype=np.float64).reshape(-1, num_topics)
+            if dtype == "uint16":
+                values = np.rint(chunk * UINT16_SCALE).astype("<u2")
+            else:
+                values = chunk.astype("<f4")
+            f.write(values.tobytes())
+    print(f"Wrote doc-topic.bin with {num_docs} documents ({dtype})")
+    return [filepath]
+
+
+def read_doc_topic_bin(filepath: str) -> np.ndarray:
+    """Read a doc-topic.bin file written by `write_doc_topic_bin`.
+
+    Args:
+        filepath (str): Path of the doc-topic.bin file
+
+    Returns:
+        np.ndarray: Topic proportions (num_docs x num_topics) as float32
+    """
+    with open(filepath, "rb") as f:
+        header = _read_binary_header(f, filepath)
+        shape = (header["numDocs"], header["numTopics"])
+        if header["dtype"] == "uint16":
+            values = np.fromfile(f, dtype="<u2", count=shape[0] * shape[1])
+            values = values.astype(np.float32) / header["scale"]
+        else:
+            values = np.fromfile(f, dtype="<f4", count=shape[0] * shape[1])
+    return values.reshape(shape)
 
 
 def write_doc_topic_counts_csv(
-    doc_topic_counts: list[dict], num_topics: int, output_dir: str
-) -> None:
+    doc_topic_counts: np.ndarray,
+    num_topics: int,
+    output_dir: str,
+    chunk_rows: int | None = None,
+) -> list[str]:
     """Write doc-topic-counts.csv with raw counts.
 
     Args:
-        doc_topic_counts (list[dict]): List of dicts with topic counts per document
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics)
         num_topics (int): Total number of topics
         output_dir (str): Directory to write the CSV file
+        chunk_rows (int | None): Number of documents formatted at a time
+            (default: CHUNK_ROWS)
+
+    Returns:
+        list[str]: Paths of the files written
     """
+    num_docs = len(doc_topic_counts)
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    # One row as csv.writer writes it, formatted for a whole chunk at once
+    row_format = ",".join(["%d"] * (num_topics + 1)) + "\r\n"
     filepath = os.path.join(output_dir, "doc-topic-counts.csv")
     with open(filepath, "w", newline="") as f:
         writer = csv.writer(f)
         # Header: docNum, topic0, topic1, ...
         writer.writerow(["docNum"] + [f"topic{i}" for i in range(num_topics)])
-        for doc_idx, topic_counts in enumerate(doc_topic_counts):
-            row = [doc_idx] + [topic_counts.get(i, 0) for i in range(num_topics)]
-            writer.writerow(row)
+        for start in range(0, num_docs, chunk_rows):
+            chunk = np.asarray(doc_topic_counts[start : start + chunk_rows])
+            table = np.empty((len(chunk), num_topics + 1), dtype=np.int64)
+            table[:, 0] = np.arange(start, start + len(chunk))
+            table[:, 1:] = chunk[:, :num_topics]
+            f.write(row_format * len(chunk) % tuple(table.ravel().tolist()))
+    return [filepath]
 
 
-def write_basic_metadata_csv(num_docs: int, output_dir: str) -> None:
+def write_basic_metadata_csv(num_docs: int, output_dir: str) -> list[str]:
     """Write basic metadata.csv if it doesn't exist.
 
     Args:
         num_docs (int): Number of documents
         output_dir (str): Directory to write the metadata.csv file
+
+    Returns:
+        list[str]: Paths of the files written
     """
     filepath = os.path.join(output_dir, "metadata.csv")
     if os.path.exists(filepath):
         print("metadata.csv already exists, skipping generation")
-        return
+        return []
 
     with open(filepath, "w", newline="") as f:
         writer = csv.writer(f)
@@ -291,157 +1067,4106 @@ def write_basic_metadata_csv(num_docs: int, output_dir: str) -> None:
         for i in range(num_docs):
             writer.writerow([i, f"doc{i + 1}", f"Document {i + 1}", "Unknown", "2024"])
     print(f"Generated basic metadata.csv with {num_docs} documents")
+    return [filepath]
 
 
-def write_topic_words_json(
-    alpha: list, topic_words: list[dict], output_dir: str
-) -> None:
-    """Write tw.json for advanced features.
+FACETS_DIR = "facets"
+FACET_FIELDS = ("year",)  # Metadata fields aggregated by default
+DATE_BUCKETS = {"year": "%Y", "month": "%Y-%m"}
 
-    Args:
-        alpha (list): List of alpha parameters for topics
-        topic_words (list[dict]): List of topic words data structures
-        output_dir (str): Directory to write the tw.json file
-    """
-    filepath = os.path.join(output_dir, "tw.json")
-    output = {"alpha": alpha, "tw": topic_words}
-    with open(filepath, "w") as f:
-        json.dump(output, f)
-    print("Wrote tw.json with topic-words data")
 
+def facet_buckets(metadata: "pd.DataFrame", field: str) -> tuple[np.ndarray, list[str]]:
+    """Assign each document to a bucket of a metadata field.
 
-def write_doc_topics_zip(sparse_matrix: dict, output_dir: str) -> None:
-    """Write dt.zip for advanced features.
+    `field` is a metadata column, whose distinct values are the buckets, or
+    "column:year" or "column:month" to bucket a date column by year or month.
+    Buckets are sorted numerically when every label is a number, otherwise
+    alphabetically. Empty and unparsable values get no bucket.
 
     Args:
-        sparse_matrix (dict): Sparse doc-topic matrix representation
-        output_dir (str): Directory to write the dt.zip file
+        metadata (pd.DataFrame): Document metadata, one row per document, read
+            as strings
+        field (str): Field specification
+
+    Returns:
+        tuple[np.ndarray, list[str]]: Bucket number of each document (-1 for
+            none), and the bucket labels
     """
-    filepath = os.path.join(output_dir, "dt.zip")
-    with zf.ZipFile(filepath, "w") as zipf:
-        zipf.writestr("dt.json", json.dumps(sparse_matrix))
-    print("Wrote dt.zip with sparse doc-topics matrix")
+    import pandas as pd
 
+    column, _, unit = field.partition(":")
+    values = metadata[column].fillna("").astype(str).str.strip()
+    if unit:
+        if unit not in DATE_BUCKETS:
+            raise ValueError(f"Unknown date bucket {unit!r} in facet {field!r}")
+        dates = pd.to_datetime(
+            values.where(values != ""), errors="coerce", format="mixed"
+        )
+        values = dates.dt.strftime(DATE_BUCKETS[unit]).fillna("")
+    labels = sorted(set(values) - {""})
+    numbers = pd.to_numeric(pd.Series(labels, dtype=object), errors="coerce")
+    if labels and numbers.notna().all():
+        labels = [labels[i] for i in np.argsort(numbers.to_numpy(), kind="stable")]
+    codes = pd.Index(labels).get_indexer(values).astype(np.int64)
+    return codes, labels
 
-def process_mallet_state_file(
-    state_file: str,
-    output_dir: str = ".",
-    n_top_words: int = 30,
-    generate_all: bool = False,
-) -> None:
-    """
-    Process MALLET topic-state file and generate dfr-browser files.
 
-    Args:
-        state_file (str): Path to MALLET topic-state.gz file
-        output_dir (str): Directory to write output files
-        n_top_words (int): Number of top words per topic to save
-        generate_all (bool): Whether to generate additional files beyond core requirements
-    """
-    print(f"Processing MALLET state file: {state_file}")
-    print(f"Output directory: {output_dir}")
+def write_metadata_facets(
+    doc_topic_counts: np.ndarray,
+    metadata_file: str,
+    output_dir: str,
+    fields=FACET_FIELDS,
+    chunk_rows: int | None = None,
+    sampled_docs: np.ndarray | None = None,
+) -> list[str]:
+    """Aggregate doc-topic counts by metadata fields into facets/<field>.bin.
 
-    # Initialize data structures
-    doc_topic_counts = []  # list of dicts: doc_idx -> {topic: count}
-    topic_word_counts = defaultdict(
-        lambda: defaultdict(int)
-    )  # topic -> word_idx -> count
-    # doc_lengths = defaultdict(int)  # doc_idx -> token_count
-    vocab = dict()  # word_idx -> word_string
+    Documents are joined with `metadata_file` by row number, as in the
+    browser, and grouped by each field's buckets (see `facet_buckets`). For
+    every field the file header lists the bucket labels, and the arrays are:
 
-    last_doc_idx = 0
-    current_doc_counts = defaultdict(int)
-    max_topic = 0
-    line_count = 0
+    - "docCounts" (uint32, one per bucket): documents in each bucket
+    - "topicTokens" (uint32, topic x bucket): tokens of each topic
+    - "proportionSums" (float32, topic x bucket): sums of document topic
+      proportions, so proportionSums / docCounts is the mean proportion
+    - "offsets" (uint32, buckets + 1) and "docs" (uint32): the documents of
+      bucket `b` are docs[offsets[b]:offsets[b + 1]]
 
-    # Process the state file
-    with gzip.open(state_file, "rt") as f:
-        # Skip header and read alpha parameters
-        f.readline()  # Skip #doc source pos typeindex type topic
-        alpha_line = f.readline().strip().split(" ")[2:]
-        alpha = list(map(float, alpha_line))
-        beta_line = f.readline().strip().split(" ")[2]
-        print(f"Found alpha parameters: {len(alpha)} topics")
-        print(f"Beta value: {beta_line}")
+    Counts are read chunk by chunk and grouped with a sparse indicator
+    matrix product. Fields missing from the metadata are skipped.
 
-        # Process each token line
-        for line in f:
-            line_count += 1
+    Args:
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics),
+            possibly a disk-backed np.memmap
+        metadata_file (str): Path to metadata.csv
+        output_dir (str): Directory to write the facets directory in
+        fields (Iterable[str]): Field specifications (see `facet_buckets`)
+        chunk_rows (int | None): Number of documents read at a time
+            (default: CHUNK_ROWS)
+        sampled_docs (np.ndarray | None): Whether each document was read by
+            a sample (see `StateCounts`); the others are left out of every
+            bucket (default: all documents)
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    import pandas as pd
+    from scipy import sparse
+
+    metadata = pd.read_csv(metadata_file, dtype=str, keep_default_na=False)
+    num_docs, num_topics = np.shape(doc_topic_counts)
+    num_rows = min(num_docs, len(metadata))
+
+    facets = {}
+    for field in fields:
+        if field.partition(":")[0] not in metadata.columns:
+            print(f"Skipping facet {field!r}: no such column in {metadata_file}")
+            continue
+        codes, labels = facet_buckets(metadata.iloc[:num_rows], field)
+        if sampled_docs is not None:
+            codes[~sampled_docs[:num_rows]] = -1
+        facets[field] = (
+            codes,
+            labels,
+            np.zeros((num_topics, len(labels)), dtype=np.int64),
+            np.zeros((num_topics, len(labels))),
+        )
+    if not facets:
+        return []
+
+    start = 0
+    for chunk in _iter_row_chunks(doc_topic_counts[:num_rows], chunk_rows):
+        proportions = normalize_doc_topic_proportions(chunk)
+        for codes, labels, tokens, proportion_sums in facets.values():
+            rows = np.flatnonzero(codes[start : start + len(chunk)] >= 0)
+            indicator = sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.int64), (codes[start + rows], rows)),
+                shape=(len(labels), len(chunk)),
+            )
+            tokens += (indicator @ chunk).T
+            proportion_sums += (indicator @ proportions).T
+        start += len(chunk)
+
+    facet_dir = os.path.join(output_dir, FACETS_DIR)
+    os.makedirs(facet_dir, exist_ok=True)
+    paths = []
+    for field, (codes, labels, tokens, proportion_sums) in facets.items():
+        if tokens.max(initial=0) > np.iinfo(np.uint32).max:
+            raise ValueError(f"Too many tokens in a bucket of facet {field!r}")
+        num_buckets = len(labels)
+        doc_counts = np.bincount(codes[codes >= 0], minlength=num_buckets)
+        docs = np.argsort(codes, kind="stable")[np.count_nonzero(codes < 0) :]
+        paths.append(os.path.join(facet_dir, f"{field.replace(':', '-')}.bin"))
+        write_binary_arrays(
+            paths[-1],
+            {
+                "field": field,
+                "buckets": labels,
+                "numDocs": num_docs,
+                "numTopics": num_topics,
+            },
+            [
+                ("docCounts", "uint32", num_buckets, [doc_counts]),
+                ("topicTokens", "uint32", tokens.size, [tokens]),
+                ("proportionSums", "float32", proportion_sums.size, [proportion_sums]),
+                (
+                    "offsets",
+                    "uint32",
+                    num_buckets + 1,
+                    [np.r_[0, np.cumsum(doc_counts)]],
+                ),
+                ("docs", "uint32", len(docs), [docs]),
+            ],
+        )
+        print(f"Wrote {FACETS_DIR}/ facet {field!r} with {num_buckets} buckets")
+    return paths
+
+
+TOPIC_DOCS_DIR = "topic-docs"
+TOP_DOCS = 100  # Documents ranked per topic in topic-docs/
+
+
+def write_topic_docs(
+    doc_topic_counts: np.ndarray,
+    output_dir: str,
+    top_docs: int = TOP_DOCS,
+    chunk_rows: int | None = None,
+) -> list[str]:
+    """Write each topic's top documents to topic-docs/topic-NNNNN.bin.
+
+    Documents are ranked by the topic's proportion of their tokens, highest
+    first, with ties in document order, as on the browser's topic page. Each
+    file holds the arrays "docs" (uint32), "counts" (uint32 topic tokens)
+    and "proportions" (float32), and its header gives the topic, the number
+    of documents and how many documents have tokens in the topic.
+
+    Only `top_docs` candidates per topic are held while the counts are read
+    chunk by chunk, so the whole proportion matrix is never built.
+
+    Args:
+        doc_topic_counts (np.ndarray): Doc-topic count matrix (num_docs x num_topics),
+            possibly a disk-backed np.memmap
+        output_dir (str): Directory to write the topic-docs directory in
+        top_docs (int): Documents kept per topic
+        chunk_rows (int | None): Number of documents read at a time
+            (default: CHUNK_ROWS)
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    num_docs, num_topics = np.shape(doc_topic_counts)
+    best_docs = [np.zeros(0, dtype=np.int64) for _ in range(num_topics)]
+    best_props = [np.zeros(0) for _ in range(num_topics)]
+    best_counts = [np.zeros(0, dtype=np.int64) for _ in range(num_topics)]
+    docs_with_topic = np.zeros(num_topics, dtype=np.int64)
+
+    start = 0
+    for chunk in _iter_row_chunks(doc_topic_counts, chunk_rows):
+        chunk = np.asarray(chunk, dtype=np.int64)
+        proportions = normalize_doc_topic_proportions(chunk)
+        docs_with_topic += np.count_nonzero(chunk, axis=0)
+        for topic in range(num_topics):
+            column = proportions[:, topic]
+            rows = np.flatnonzero(column > 0)
+            if len(rows) > top_docs:
+                # Keep every row tied with the last place; order settles ties
+                threshold = np.partition(column[rows], len(rows) - top_docs)[
+                    len(rows) - top_docs
+                ]
+                rows = rows[column[rows] >= threshold]
+            docs = np.r_[best_docs[topic], rows + start]
+            props = np.r_[best_props[topic], column[rows]]
+            counts = np.r_[best_counts[topic], chunk[rows, topic]]
+            order = np.lexsort((docs, -props))[:top_docs]
+            best_docs[topic] = docs[order]
+            best_props[topic] = props[order]
+            best_counts[topic] = counts[order]
+        start += len(chunk)
+
+    topic_dir = os.path.join(output_dir, TOPIC_DOCS_DIR)
+    os.makedirs(topic_dir, exist_ok=True)
+    paths = []
+    for topic in range(num_topics):
+        length = len(best_docs[topic])
+        paths.append(os.path.join(topic_dir, f"topic-{topic:05d}.bin"))
+        write_binary_arrays(
+            paths[-1],
+            {
+                "topic": topic,
+                "numDocs": num_docs,
+                "docsWithTopic": int(docs_with_topic[topic]),
+            },
+            [
+                ("docs", "uint32", length, [best_docs[topic]]),
+                ("counts", "uint32", length, [best_counts[topic]]),
+                ("proportions", "float32", length, [best_props[topic]]),
+            ],
+        )
+    print(f"Wrote top {top_docs} documents of {num_topics} topics to {TOPIC_DOCS_DIR}/")
+    return paths
+
+
+def vocabulary_order(topic_word) -> tuple[np.ndarray, np.ndarray]:
+    """Order type indices by corpus frequency, as in vocab.txt.
+
+    Args:
+        topic_word (np.ndarray | sparse.csr_matrix): Topic-word counts
+            (num_topics x vocab_size)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Type indices from most to least
+            frequent (ties keep type index order), and the frequency of each
+            type index
+    """
+    frequencies = np.asarray(topic_word.sum(axis=0)).ravel().astype(np.int64)
+    return np.argsort(-frequencies, kind="stable"), frequencies
+
+
+def write_word_topics(topic_word, vocab: list[str], output_dir: str) -> list[str]:
+    """Write vocab.txt and word-topics.bin, the topic counts of every word.
+
+    vocab.txt lists each word and its corpus frequency, tab-separated, from
+    most to least frequent. word-topics.bin holds the word-topic counts as a
+    CSR matrix in the layout of doc-lengths.bin, with one row per line of
+    vocab.txt: the topics of word `w` are `indices[indptr[w]:indptr[w + 1]]`
+    and their counts are the same slice of `data`.
+
+    Args:
+        topic_word (np.ndarray | sparse.csr_matrix): Topic-word counts
+            (num_topics x vocab_size)
+        vocab (list[str]): Word string for each type index
+        output_dir (str): Directory to write the files
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    from scipy import sparse
+
+    num_topics = topic_word.shape[0]
+    word_topic = sparse.csr_matrix(topic_word.T, dtype=np.int64)
+    order, frequencies = vocabulary_order(topic_word)
+    word_topic = word_topic[order]
+    word_topic.sort_indices()
+
+    vocab_path = os.path.join(output_dir, "vocab.txt")
+    word_topics_path = os.path.join(output_dir, "word-topics.bin")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.writelines(
+            f"{vocab[type_index]}\t{frequency}\n"
+            for type_index, frequency in zip(
+                order.tolist(), frequencies[order].tolist()
+            )
+        )
+
+    nnz = word_topic.nnz
+    write_binary_arrays(
+        word_topics_path,
+        {"numWords": len(order), "numTopics": num_topics, "nnz": nnz},
+        [
+            ("indptr", "uint32", len(order) + 1, [word_topic.indptr]),
+            (
+                "indices",
+                "uint16" if num_topics <= 1 << 16 else "uint32",
+                nnz,
+                [word_topic.indices],
+            ),
+            ("data", "uint32", nnz, [word_topic.data]),
+        ],
+    )
+    print(f"Wrote vocab.txt and word-topics.bin with {len(order)} words")
+    return [vocab_path, word_topics_path]
+
+
+def write_topic_words_json(
+    alpha: list, topic_words: list[dict], output_dir: str
+) -> list[str]:
+    """Write tw.json for advanced features.
+
+    Args:
+        alpha (list): List of alpha parameters for topics
+        topic_words (list[dict]): List of topic words data structures
+        output_dir (str): Directory to write the tw.json file
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    filepath = os.path.join(output_dir, "tw.json")
+    output = {"alpha": alpha, "tw": topic_words}
+    with open(filepath, "w") as f:
+        json.dump(output, f)
+    print("Wrote tw.json with topic-words data")
+    return [filepath]
+
+
+DT_ZIP_LEVEL = 6  # DEFLATE level of dt.zip
+JSON_CHUNK_VALUES = 1 << 16  # Numbers serialized at a time in dt.json
+
+
+def write_doc_topics_zip(
+    sparse_matrix: dict, output_dir: str, compresslevel: int = DT_ZIP_LEVEL
+) -> list[str]:
+    """Write dt.zip for advanced features.
+
+    dt.json is streamed into the archive a chunk of numbers at a time, in
+    the same format as `json.dumps`, and compressed with DEFLATE. The entry
+    has a fixed timestamp, so the same matrix always gives the same file, and
+    zip64 sizes, so it may grow past 2 GiB.
+
+    Args:
+        sparse_matrix (dict): Sparse doc-topic matrix representation, with
+            lists or arrays under 'i', 'p' and 'x'
+        output_dir (str): Directory to write the dt.zip file
+        compresslevel (int): DEFLATE level, from 0 (fastest) to 9 (smallest)
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    filepath = os.path.join(output_dir, "dt.zip")
+    with (
+        zf.ZipFile(
+            filepath, "w", compression=zf.ZIP_DEFLATED, compresslevel=compresslevel
+        ) as zipf,
+        # Entries opened by name keep ZipInfo's 1980 timestamp; zip64 allows a
+        # dt.json past 2 GiB, whose size isn't known until it is written
+        zipf.open("dt.json", "w", force_zip64=True) as f,
+    ):
+        f.write(b"{")
+        for n, (key, values) in enumerate(sparse_matrix.items()):
+            f.write(f"{', ' if n else ''}{json.dumps(key)}: [".encode())
+            values = np.asarray(values)
+            for start in range(0, len(values), JSON_CHUNK_VALUES):
+                chunk = values[start : start + JSON_CHUNK_VALUES].tolist()
+                f.write(((", " if start else "") + ", ".join(map(str, chunk))).encode())
+            f.write(b"]")
+        f.write(b"}")
+    print("Wrote dt.zip with sparse doc-topics matrix")
+    return [filepath]
+
+
+STATE_BLOCK_SIZE = 16 * 1024 * 1024  # Bytes of decompressed state per parse block
+PARSE_ENGINES = ("python", "numpy")
+DENSE_TOPIC_WORD_LIMIT = 1 << 26  # Max topics x vocab cells before going sparse
+CACHE_FILENAME = "state-counts.npz"
+CACHE_VERSION = 2
+DOC_TOPIC_SPILL_FILENAME = "doc-topic-counts.i32"  # Out-of-core doc-topic counts
+BLOCK_MEMORY_FACTOR = 5  # Peak parse memory per byte of state block
+DOC_CELL_MEMORY = 48  # Peak bytes per doc-topic cell while formatting rows
+MEMORY_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+CONFIG_FILENAME = "config.json"  # Browser configuration marked by --sample
+APPROXIMATE_CONFIG_KEY = "approximate"  # config.json entry describing a sample
+
+
+def parse_memory_size(value: str) -> int:
+    """Parse a memory size such as "512M" or "4G" into bytes.
+
+    Args:
+        value (str): Number of bytes, optionally followed by K, M, G or T
+            (binary units, with an optional "B" or "iB" suffix)
+
+    Returns:
+        int: Size in bytes
+    """
+    text = value.strip().upper().removesuffix("B").removesuffix("I")
+    unit = text[-1:] if text[-1:] in MEMORY_UNITS else ""
+    number = text[: len(text) - len(unit)]
+    try:
+        size = int(float(number) * MEMORY_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid memory size: {value!r}") from None
+    if size <= 0:
+        raise ValueError(f"Invalid memory size: {value!r}")
+    return size
+
+
+def memory_block_size(max_memory: int, workers: int = 1) -> int:
+    """Return the size of state blocks that keeps parsing within a budget.
+
+    Args:
+        max_memory (int): Memory budget in bytes
+        workers (int): Number of processes parsing blocks
+
+    Returns:
+        int: Bytes of decompressed state per block, at least 64 KiB
+    """
+    # Main process plus the window of blocks in flight to workers
+    blocks_in_memory = 1 if workers <= 1 else 2 * workers + 1
+    return max(
+        1 << 16,
+        min(STATE_BLOCK_SIZE, max_memory // (BLOCK_MEMORY_FACTOR * blocks_in_memory)),
+    )
+
+
+def parse_sample(value: str) -> float | int:
+    """Parse a sample size: a fraction of tokens or a number of documents.
+
+    Args:
+        value (str): A fraction such as "0.05" or "5%", or a whole number of
+            documents such as "1000"
+
+    Returns:
+        float | int: Fraction of tokens (float) or number of documents (int)
+    """
+    text = value.strip()
+    try:
+        if text.endswith("%"):
+            sample = float(text[:-1]) / 100
+        elif text.isdigit():
+            sample = int(text)
+        else:
+            sample = float(text)
+    except ValueError:
+        raise ValueError(f"Invalid sample: {value!r}") from None
+    if not sample > 0 or (isinstance(sample, float) and sample > 1):
+        raise ValueError(f"Invalid sample: {value!r}")
+    return sample
+
+
+_END = object()  # Marks the end of an iterator
+
+
+STDIN_STATE_FILE = "-"  # State file name that reads standard input
+STATE_MAGIC = {  # Leading bytes of each compressed state file format
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"(\xb5/\xfd": "zstd",
+}
+STATE_READ_SIZE = 1 << 18  # Compressed bytes decompressed at a time
+STATE_PREFETCH_CHUNKS = 8  # Decompressed chunks held ahead of the parser
+ZLIB_BACKENDS = ("isal.isal_zlib", "zlib_ng.zlib_ng")  # Faster zlib drop-ins
+
+
+def zlib_backend():
+    """Return the fastest installed zlib-compatible module.
+
+    ISA-L (`pip install isal`) and zlib-ng (`pip install zlib-ng`) decompress
+    gzip several times faster than zlib and have the same interface.
+
+    Returns:
+        module: `isal.isal_zlib`, `zlib_ng.zlib_ng` or `zlib`
+    """
+    for name in ZLIB_BACKENDS:
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            continue
+    return zlib
+
+
+def _zstd_decompressor():
+    """Return a new zstd decompressor (Python 3.14+ or `zstandard`)."""
+    try:
+        from compression import zstd
+
+        return zstd.ZstdDecompressor()
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            "Reading .zst state files requires Python 3.14 or the zstandard "
+            "package (pip install zstandard)"
+        ) from None
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def state_compression(head: bytes) -> str | None:
+    """Identify the compression of a state file from its first bytes.
+
+    Args:
+        head (bytes): First bytes of the file (at least 6)
+
+    Returns:
+        str | None: "gzip", "bz2", "xz" or "zstd", or None for plain text
+    """
+    for magic, compression in STATE_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _new_decompressor(compression: str):
+    """Return a new incremental decompressor for a compression format."""
+    if compression == "gzip":
+        return zlib_backend().decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if compression == "bz2":
+        return bz2.BZ2Decompressor()
+    if compression == "xz":
+        return lzma.LZMADecompressor()
+    return _zstd_decompressor()
+
+
+def _decompressed_chunks(raw, head: bytes, read_size: int = STATE_READ_SIZE):
+    """Yield the decompressed contents of a binary stream in chunks.
+
+    Concatenated compressed streams, as written by `cat`, pigz or pbzip2,
+    are decompressed one after another, and zero padding between them is
+    skipped as gzip does. The stream is closed afterwards.
+
+    Args:
+        raw: Binary stream positioned after `head`
+        head (bytes): Bytes already read from the start of the stream
+        read_size (int): Compressed bytes read at a time
+
+    Yields:
+        bytes: Decompressed data
+    """
+    with raw:
+        compression = state_compression(head)
+        if compression is None:
+            if head:
+                yield head
+            yield from iter(lambda: raw.read(read_size), b"")
+            return
+
+        decompressor, started = _new_decompressor(compression), False
+        data = head
+        while True:
+            if not started:
+                data = data.lstrip(b"\0")
+            while data:
+                started = True
+                chunk = decompressor.decompress(data)
+                if chunk:
+                    yield chunk
+                if not decompressor.eof:
+                    break
+                data = decompressor.unused_data.lstrip(b"\0")
+                decompressor, started = _new_decompressor(compression), False
+            data = raw.read(read_size)
+            if not data:
+                break
+        if started:
+            raise EOFError("State file ended before the end of its compressed data")
+
+
+def prefetch(iterable, depth: int = STATE_PREFETCH_CHUNKS):
+    """Iterate in a background thread, up to `depth` items ahead.
+
+    zlib, bz2 and lzma release the GIL while decompressing, so the items
+    are produced while the caller works on earlier ones. Errors are raised
+    in the caller when it reaches them.
+
+    Args:
+        iterable: Items to produce in the background
+        depth (int): Number of items held ready
+
+    Yields:
+        The items of `iterable`, in order
+    """
+    items = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Time out now and then so an abandoned consumer stops the thread
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as error:  # noqa: BLE001 - re-raised by the consumer
+            # Anything the thread raises must reach the consumer, which would
+            # otherwise wait for the end forever
+            put(error)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class _ChunkReader(io.RawIOBase):
+    """Read-only binary stream over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed and hasattr(self._chunks, "close"):
+            self._chunks.close()
+        super().close()
+
+
+def open_state_file(state_file: str, text: bool = False, pipelined: bool = True):
+    """Open a MALLET state file, decompressing it if needed.
+
+    The format is detected from the first bytes, so plain, gzip, bz2, xz
+    and zstd files are read whatever their names. Gzip is decompressed
+    with ISA-L or zlib-ng when one is installed (see `zlib_backend`). With
+    `pipelined`, a background thread decompresses ahead of the reader.
+
+    Args:
+        state_file (str): Path to a MALLET state file, or "-" for standard
+            input
+        text (bool): Whether to return a UTF-8 text stream rather than bytes
+        pipelined (bool): Whether to decompress in a background thread
+
+    Returns:
+        io.BufferedReader | io.TextIOWrapper: Decompressed state stream
+    """
+    with ExitStack() as stack:
+        if state_file == STDIN_STATE_FILE:
+            # Leave standard input open for the rest of the program
+            raw = stack.enter_context(
+                open(sys.stdin.fileno(), "rb", buffering=0, closefd=False)
+            )
+        else:
+            raw = stack.enter_context(open(state_file, "rb", buffering=0))
+        head = b""
+        while len(head) < 6:
+            data = raw.read(6 - len(head))
+            if not data:
+                break
+            head += data
+        chunks = _decompressed_chunks(raw, head)
+        if pipelined:
+            chunks = prefetch(chunks)
+        f = io.BufferedReader(_ChunkReader(chunks), buffer_size=STATE_READ_SIZE)
+        # From here the returned stream closes the file
+        stack.pop_all()
+    return io.TextIOWrapper(f, encoding="utf-8") if text else f
+
+
+def read_state_header_lines(f) -> list[str]:
+    """Read the "#" header lines at the start of a binary state stream.
+
+    A shard cut from the middle of a state file has none.
+
+    Args:
+        f: Binary state stream with a `peek` method, at its start
+
+    Returns:
+        list[str]: The header lines, up to three
+    """
+    lines = []
+    while len(lines) < 3 and f.peek(1)[:1] == b"#":
+        lines.append(f.readline().decode("utf-8"))
+    return lines
+
+
+def read_state_header(lines: list[str]) -> tuple[list[float], str]:
+    """Parse the three header lines of a MALLET state file.
+
+    Args:
+        lines (list[str]): The header lines (column names, alpha, beta)
+
+    Returns:
+        tuple[list[float], str]: Alpha parameters and the raw beta value, or
+            no parameters and "" when the header is missing
+    """
+    if len(lines) < 3:
+        return [], ""
+    alpha_line = lines[1].strip().split(" ")[2:]
+    alpha = list(map(float, alpha_line))
+    beta = lines[2].strip().split(" ")[2]
+    return alpha, beta
+
+
+def parse_state_line(line: str) -> tuple[int, int, str, int] | None:
+    """Parse one token line of a MALLET state file.
+
+    Fields are read from the right, because the last fields (pos, typeindex,
+    type, topic) are always the "stable" ones, while the source may contain
+    spaces.
+
+    Args:
+        line (str): A token line
+
+    Returns:
+        tuple[int, int, str, int] | None: (doc_idx, type_index, word, topic), or
+            None if the line does not have enough fields
+    """
+    parts = line.strip().split()
+    if len(parts) < 6:
+        return None
+    return int(parts[0]), int(parts[-3]), parts[-2], int(parts[-1])
+
+
+def _parse_int_fields(
+    buf: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """Parse ASCII decimal fields buf[starts[i]:ends[i]] into integers.
+
+    Args:
+        buf (np.ndarray): Block bytes as a uint8 array
+        starts (np.ndarray): Start offset of each field
+        ends (np.ndarray): End offset (exclusive) of each field
+
+    Returns:
+        np.ndarray: Parsed int64 values
+    """
+    lengths = ends - starts
+    values = np.zeros(len(starts), dtype=np.int64)
+    if len(starts) == 0:
+        return values
+    if lengths.min() < 1:
+        raise ValueError("invalid literal for int() with base 10: ''")
+    # Horner's rule, one digit column at a time across all fields
+    for offset in range(int(lengths.max())):
+        active = lengths > offset
+        digits = buf[np.where(active, starts + offset, 0)].astype(np.int64) - 48
+        if np.any(active & ((digits < 0) | (digits > 9))):
+            bad = np.flatnonzero(active & ((digits < 0) | (digits > 9)))[0]
+            text = bytes(buf[starts[bad] : ends[bad]]).decode("utf-8", "replace")
+            raise ValueError(f"invalid literal for int() with base 10: {text!r}")
+        values = np.where(active, values * 10 + digits, values)
+    return values
+
+
+def _split_state_lines(buf: np.ndarray) -> tuple:
+    """Locate the token lines of a block and the spaces between their fields.
+
+    Args:
+        buf (np.ndarray): Block bytes, ending with a newline, as a uint8 array
+
+    Returns:
+        tuple: (starts, ends, spaces, first, last, line_count), where `starts`
+            and `ends` delimit each line with at least six fields (without
+            its line ending), `spaces` holds the offset of every space, and
+            `first` and `last` index the first and last space of each line
+    """
+    newlines = np.flatnonzero(buf == 10)
+    line_count = len(newlines)
+    starts = np.empty(line_count, dtype=np.int64)
+    starts[:1] = 0
+    starts[1:] = newlines[:-1] + 1
+    ends = newlines.astype(np.int64)
+    # Tolerate CRLF line endings
+    has_cr = (ends > starts) & (buf[np.maximum(ends - 1, 0)] == 13)
+    ends = ends - has_cr
+
+    spaces = np.flatnonzero(buf == 32)
+    first = np.searchsorted(spaces, starts)
+    last = np.searchsorted(spaces, ends) - 1
+    keep = (last - first) >= 4
+    return starts[keep], ends[keep], spaces, first[keep], last[keep], line_count
+
+
+def parse_state_block(
+    block: bytes, step: int = 1
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]:
+    """Parse a block of complete MALLET state token lines in bulk.
+
+    Lines are split on single spaces, as MALLET writes them. As in
+    `parse_state_line`, the doc index is the first field and the typeindex,
+    type and topic are the last three, so sources containing spaces are
+    handled. Lines with fewer than six fields are skipped.
+
+    Args:
+        block (bytes): Decompressed state bytes ending with a newline
+        step (int): Parse only the tokens whose position in their document
+            is a multiple of `step`, a sample of every document
+
+    Returns:
+        tuple: (docs, types, topics, word_starts, word_ends, line_count), where
+            the first three are int64 arrays with one entry per token and the
+            word offsets locate each token's type string within the block
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    starts, ends, spaces, first, last, line_count = _split_state_lines(buf)
+    if step > 1:
+        # The position is the fourth field from the end
+        positions = _parse_int_fields(buf, spaces[last - 3] + 1, spaces[last - 2])
+        keep = positions % step == 0
+        starts, ends, first, last = starts[keep], ends[keep], first[keep], last[keep]
+    docs = _parse_int_fields(buf, starts, spaces[first])
+    topics = _parse_int_fields(buf, spaces[last] + 1, ends)
+    word_starts = spaces[last - 1] + 1
+    word_ends = spaces[last]
+    types = _parse_int_fields(buf, spaces[last - 2] + 1, spaces[last - 1])
+    return docs, types, topics, word_starts, word_ends, line_count
+
+
+def iter_state_blocks(f, block_size: int | None = None):
+    """Yield blocks of complete lines from a binary state stream.
+
+    Args:
+        f: Binary file object positioned after the header
+        block_size (int | None): Approximate number of bytes per block
+            (default: STATE_BLOCK_SIZE)
+
+    Yields:
+        bytes: Decompressed bytes ending with a newline
+    """
+    block_size = block_size or STATE_BLOCK_SIZE
+    remainder = b""
+    while True:
+        chunk = f.read(block_size)
+        if not chunk:
+            break
+        data = remainder + chunk
+        cut = data.rfind(b"\n") + 1
+        if cut == 0:
+            remainder = data
+            continue
+        remainder = data[cut:]
+        yield data[:cut]
+    if remainder:
+        yield remainder + b"\n"
+
+
+@dataclass
+class StateCounts:
+    """Aggregated counts from a MALLET state file.
+
+    Attributes:
+        doc_topic (np.ndarray): Doc-topic counts (num_docs x num_topics)
+        topic_word (np.ndarray | sparse.csr_matrix): Topic-word counts
+            (num_topics x vocab_size), sparse when the dense matrix would
+            exceed DENSE_TOPIC_WORD_LIMIT cells
+        vocab (list[str]): Word string for each type index
+        alpha (list[float]): Alpha parameters from the state header
+        beta (str): Raw beta value from the state header
+        line_count (int): Number of token lines read
+        doc_ids (np.ndarray | None): Doc index of each row of `doc_topic`,
+            when known (not for counts loaded from the cache)
+        sampled_docs (np.ndarray | None): Whether each document was read,
+            for samples that skip whole documents (None when all were)
+    """
+
+    doc_topic: np.ndarray
+    topic_word: "np.ndarray | sparse.csr_matrix"
+    vocab: list[str]
+    alpha: list[float]
+    beta: str
+    line_count: int = 0
+    doc_ids: np.ndarray | None = None
+    sampled_docs: np.ndarray | None = None
+
+    @property
+    def num_docs(self) -> int:
+        """Number of documents."""
+        return self.doc_topic.shape[0]
+
+    @property
+    def num_topics(self) -> int:
+        """Number of topics."""
+        return self.doc_topic.shape[1]
+
+    def topic_word_counts(self, topic: int) -> np.ndarray:
+        """Return the dense word counts for one topic.
+
+        Args:
+            topic (int): Topic number
+
+        Returns:
+            np.ndarray: Word counts indexed by type index
+        """
+        from scipy import sparse
+
+        if sparse.issparse(self.topic_word):
+            return self.topic_word[topic].toarray().ravel()
+        return self.topic_word[topic]
+
+
+class _KeyedCounter:
+    """Accumulates counts for int64 keys as sorted (key, count) arrays.
+
+    Pending blocks are merged once they outgrow the merged totals, so memory
+    stays proportional to the number of distinct keys.
+    """
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def add(self, keys: np.ndarray, counts: np.ndarray | None = None) -> None:
+        """Add counts (default: one per key) for an array of keys."""
+        if counts is None:
+            keys, counts = np.unique(keys, return_counts=True)
+        self._pending.append((keys, counts))
+        self._pending_size += len(keys)
+        if self._pending_size > max(len(self.keys), 1 << 20):
+            self._merge()
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [k for k, _ in self._pending])
+        counts = np.concatenate([self.counts] + [c for _, c in self._pending])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        self._pending = []
+        self._pending_size = 0
+
+    def result(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the sorted distinct keys and their total counts."""
+        self._merge()
+        return self.keys, self.counts
+
+
+def topic_word_matrix(
+    topics: np.ndarray,
+    types: np.ndarray,
+    counts: np.ndarray,
+    num_topics: int,
+    vocab_size: int,
+) -> "np.ndarray | sparse.csr_matrix":
+    """Build the topic-word count matrix from (topic, type, count) triples.
+
+    Args:
+        topics (np.ndarray): Topic of each entry
+        types (np.ndarray): Type index of each entry
+        counts (np.ndarray): Count of each entry
+        num_topics (int): Number of topics
+        vocab_size (int): Number of word types
+
+    Returns:
+        np.ndarray | sparse.csr_matrix: Dense int64 matrix, or CSR when
+            num_topics * vocab_size exceeds DENSE_TOPIC_WORD_LIMIT
+    """
+    from scipy import sparse
+
+    if num_topics * vocab_size > DENSE_TOPIC_WORD_LIMIT:
+        return sparse.csr_matrix(
+            (counts.astype(np.int64), (topics, types)),
+            shape=(num_topics, vocab_size),
+        )
+    mat = np.zeros((num_topics, vocab_size), dtype=np.int64)
+    np.add.at(mat, (topics, types), counts)
+    return mat
+
+
+def _vocab_list(vocab: dict, vocab_size: int) -> list[str]:
+    """Convert a type index -> word mapping to a list indexed by type index."""
+    words = [""] * vocab_size
+    for type_index, word in vocab.items():
+        words[type_index] = word
+    return words
+
+
+def _read_state_python(state_file: str) -> StateCounts:
+    """Read a state file line by line with the reference parser.
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file,
+            or "-" for standard input (see `open_state_file`)
+
+    Returns:
+        StateCounts: Aggregated counts
+    """
+    doc_topic_counts = []  # list of dicts: doc_idx -> {topic: count}
+    topic_word_counts = defaultdict(int)  # (topic, word_idx) -> count
+    vocab = dict()  # word_idx -> word_string
+
+    doc_ids = []  # Doc index of each entry of doc_topic_counts
+    last_doc_idx = 0
+    current_doc_counts = defaultdict(int)
+    max_topic = 0
+    line_count = 0
+
+    with open_state_file(state_file) as raw:
+        alpha, beta = read_state_header(read_state_header_lines(raw))
+        f = io.TextIOWrapper(raw, encoding="utf-8")
+        print(f"Found alpha parameters: {len(alpha)} topics")
+        print(f"Beta value: {beta}")
+
+        # Process each token line
+        for line in f:
+            line_count += 1
             if line_count % 100000 == 0:
                 print(f"Processed {line_count:,} tokens...")
 
-            parts = line.strip().split()
-            if len(parts) < 6:
-                continue
+            parsed = parse_state_line(line)
+            if parsed is None:
+                continue
+            doc_idx, type_index, word, topic = parsed
+            max_topic = max(max_topic, topic)
+
+            # Handle document transition
+            if last_doc_idx != doc_idx:
+                if current_doc_counts:  # Save previous document
+                    doc_topic_counts.append(current_doc_counts)
+                    doc_ids.append(last_doc_idx)
+                current_doc_counts = defaultdict(int)
+
+            # Update counts
+            current_doc_counts[topic] += 1
+            topic_word_counts[topic, type_index] += 1
+
+            # Update vocabulary
+            if type_index not in vocab:
+                vocab[type_index] = word
+
+            last_doc_idx = doc_idx
+
+        # Add the last document
+        if current_doc_counts:
+            doc_topic_counts.append(current_doc_counts)
+            doc_ids.append(last_doc_idx)
+
+    num_topics = max_topic + 1
+    vocab_size = max(vocab, default=-1) + 1
+    doc_topic = np.zeros((len(doc_topic_counts), num_topics), dtype=np.int32)
+    for doc_idx, doc_counts in enumerate(doc_topic_counts):
+        doc_topic[doc_idx, list(doc_counts)] = list(doc_counts.values())
+    pairs = np.array(list(topic_word_counts), dtype=np.int64).reshape(-1, 2)
+    counts = np.fromiter(topic_word_counts.values(), dtype=np.int64)
+    topic_word = topic_word_matrix(
+        pairs[:, 0], pairs[:, 1], counts, num_topics, vocab_size
+    )
+    return StateCounts(
+        doc_topic,
+        topic_word,
+        _vocab_list(vocab, vocab_size),
+        alpha,
+        beta,
+        line_count,
+        np.array(doc_ids, dtype=np.int64),
+    )
+
+
+@dataclass
+class _BlockCounts:
+    """Partial counts for one block of state lines.
+
+    Row 0 of `doc_topic` holds the counts of `first_doc`, which may continue
+    the last document of the previous block.
+    """
+
+    line_count: int
+    first_doc: int = -1
+    last_doc: int = -1
+    doc_topic: np.ndarray | None = None
+    topic_word_keys: np.ndarray | None = None
+    topic_word_counts: np.ndarray | None = None
+    types: np.ndarray | None = None
+    words: list[str] | None = None
+    doc_ids: np.ndarray | None = None
+
+
+def _aggregate_state_block(block: bytes, step: int = 1) -> _BlockCounts:
+    """Parse a block of state lines and aggregate its counts.
+
+    Args:
+        block (bytes): Decompressed state bytes ending with a newline
+        step (int): Aggregate every `step`-th token of each document and
+            scale the counts by `step` (see `parse_state_block`)
+
+    Returns:
+        _BlockCounts: Partial counts for the block
+    """
+    docs, types, topics, word_starts, word_ends, line_count = parse_state_block(
+        block, step
+    )
+    if len(docs) == 0:
+        return _BlockCounts(line_count)
+
+    # A run of consecutive tokens with the same doc index is one document
+    new_doc = docs[1:] != docs[:-1]
+    runs = np.zeros(len(docs), dtype=np.int64)
+    np.cumsum(new_doc, out=runs[1:])
+    width = int(topics.max()) + 1
+    doc_topic = np.bincount(
+        runs * width + topics, minlength=(int(runs[-1]) + 1) * width
+    ).reshape(-1, width)
+
+    # Topic-word counts keyed by (topic << 32 | type_index)
+    keys, counts = np.unique((topics << 32) | types, return_counts=True)
+    if step > 1:
+        doc_topic *= step
+        counts *= step
+
+    # First spelling of each type index in the block
+    unique_types, first_pos = np.unique(types, return_index=True)
+    words = [
+        block[start:end].decode("utf-8")
+        for start, end in zip(word_starts[first_pos], word_ends[first_pos])
+    ]
+    return _BlockCounts(
+        line_count,
+        int(docs[0]),
+        int(docs[-1]),
+        doc_topic.astype(np.int32),
+        keys,
+        counts,
+        unique_types,
+        words,
+        docs[np.r_[0, np.flatnonzero(new_doc) + 1]],
+    )
+
+
+class _StateCountsBuilder:
+    """Merges block counts, in state file order, into StateCounts.
+
+    With a `doc_topic_file`, finished doc-topic rows are written to it as
+    int32 rows `num_topics` wide instead of being kept in memory, and the
+    result memory-maps the file. The rows written are widened in place if a
+    later block has a higher topic, as in a shard without the state header.
+    Either way the result has as many topics as the highest topic with
+    tokens, plus one.
+    """
+
+    def __init__(self, doc_topic_file=None, num_topics: int = 1):
+        self.doc_blocks = []  # doc-topic count rows for each block
+        self.doc_ids = []  # Doc index of each row, for each block
+        self.doc_topic_file = doc_topic_file
+        self.spilled_docs = 0
+        self.topic_word = _KeyedCounter()
+        self.vocab = {}
+        self.seen_types = np.zeros(0, dtype=bool)
+        self.last_doc = None
+        self.num_topics = num_topics
+        self.topics_seen = 1  # Highest topic with tokens, plus one
+        self.line_count = 0
+
+    def _spill(self) -> None:
+        """Write the held doc-topic rows to the doc-topic file."""
+        for rows in self.doc_blocks:
+            padded = np.zeros((len(rows), self.num_topics), dtype=np.int32)
+            padded[:, : rows.shape[1]] = rows
+            self.doc_topic_file.write(padded.tobytes())
+            self.spilled_docs += len(rows)
+        self.doc_blocks = []
+
+    def _widen(self, num_topics: int) -> None:
+        """Rewrite the rows in the doc-topic file `num_topics` wide."""
+        if self.spilled_docs:
+            self.doc_topic_file.flush()
+            os.truncate(self.doc_topic_file.name, self.spilled_docs * num_topics * 4)
+            cells = np.memmap(self.doc_topic_file.name, dtype=np.int32, mode="r+")
+            # From the last rows, so no row is overwritten before it is moved
+            for end in range(self.spilled_docs, 0, -CHUNK_ROWS):
+                start = max(0, end - CHUNK_ROWS)
+                rows = np.array(
+                    cells[start * self.num_topics : end * self.num_topics]
+                ).reshape(-1, self.num_topics)
+                widened = cells[start * num_topics : end * num_topics]
+                widened = widened.reshape(-1, num_topics)
+                widened[:, : self.num_topics] = rows
+                widened[:, self.num_topics :] = 0
+            cells.flush()
+            del cells
+            self.doc_topic_file.seek(0, os.SEEK_END)
+        self.num_topics = num_topics
+
+    def add(self, counts: _BlockCounts) -> None:
+        """Merge the counts of the next block."""
+        self.line_count += counts.line_count
+        if counts.doc_topic is None:
+            return
+        rows = counts.doc_topic
+        if self.doc_topic_file is not None and rows.shape[1] > self.num_topics:
+            self._widen(rows.shape[1])
+        self.num_topics = max(self.num_topics, rows.shape[1])
+        self.topics_seen = max(self.topics_seen, rows.shape[1])
+
+        # Run 0 continues the last document of the previous block
+        if counts.first_doc == self.last_doc:
+            previous = self.doc_blocks[-1]
+            if previous.shape[1] < rows.shape[1]:
+                previous = np.pad(
+                    previous, ((0, 0), (0, rows.shape[1] - previous.shape[1]))
+                )
+                self.doc_blocks[-1] = previous
+            previous[-1, : rows.shape[1]] += rows[0]
+            rows = rows[1:]
+            self.doc_ids.append(counts.doc_ids[1:])
+        else:
+            self.doc_ids.append(counts.doc_ids)
+        if len(rows):
+            # Only the last held row can still be continued by later blocks
+            if self.doc_topic_file is not None:
+                self._spill()
+            self.doc_blocks.append(rows)
+        self.last_doc = counts.last_doc
+
+        self.topic_word.add(counts.topic_word_keys, counts.topic_word_counts)
+
+        # Record the first spelling of each new type index
+        if counts.types[-1] >= len(self.seen_types):
+            grown = np.zeros(int(counts.types[-1]) + 1, dtype=bool)
+            grown[: len(self.seen_types)] = self.seen_types
+            self.seen_types = grown
+        for i in np.flatnonzero(~self.seen_types[counts.types]).tolist():
+            self.vocab[int(counts.types[i])] = counts.words[i]
+        self.seen_types[counts.types] = True
+
+    def result(self, alpha: list[float], beta: str) -> StateCounts:
+        """Return the merged counts."""
+        num_topics = self.topics_seen
+        vocab_size = len(self.seen_types)
+        if self.doc_topic_file is not None:
+            self._spill()
+            self.doc_topic_file.flush()
+            if self.spilled_docs:
+                # Rows are as wide as the header's topics; unused ones at
+                # the end are left out
+                doc_topic = np.memmap(
+                    self.doc_topic_file.name,
+                    dtype=np.int32,
+                    mode="r",
+                    shape=(self.spilled_docs, self.num_topics),
+                )[:, :num_topics]
+            else:
+                doc_topic = np.zeros((0, num_topics), dtype=np.int32)
+        else:
+            doc_topic = np.zeros(
+                (sum(len(rows) for rows in self.doc_blocks), num_topics),
+                dtype=np.int32,
+            )
+            offset = 0
+            for rows in self.doc_blocks:
+                doc_topic[offset : offset + len(rows), : rows.shape[1]] = rows
+                offset += len(rows)
+        keys, counts = self.topic_word.result()
+        topic_word = topic_word_matrix(
+            keys >> 32, keys & 0xFFFFFFFF, counts, num_topics, vocab_size
+        )
+        vocab = _vocab_list(self.vocab, vocab_size)
+        doc_ids = np.concatenate([np.zeros(0, dtype=np.int64), *self.doc_ids])
+        return StateCounts(
+            doc_topic, topic_word, vocab, alpha, beta, self.line_count, doc_ids
+        )
+
+
+def _map_state_blocks(blocks, workers: int = 1, step: int = 1):
+    """Aggregate state blocks, in order, optionally in worker processes.
+
+    Args:
+        blocks: Iterable of state blocks
+        workers (int): Number of worker processes; 1 aggregates in this process
+        step (int): Sampling step of `_aggregate_state_block`
+
+    Yields:
+        _BlockCounts: Partial counts for each block, in input order
+    """
+    aggregate = partial(_aggregate_state_block, step=step)
+    if workers <= 1:
+        for block in blocks:
+            yield aggregate(block)
+        return
+
+    # Keep a bounded window of blocks in flight so decompressed data
+    # never piles up ahead of the workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(aggregate, block))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+_worker_state = None  # Seekable state file of a worker process reading ranges
+
+
+def _open_worker_state(state_file: str, index_path: str) -> None:
+    """Open the state file in a worker process of `_map_state_ranges`."""
+    global _worker_state
+    _worker_state = open_state_seekable(
+        state_file, load_state_seek_index(index_path, state_file)
+    )
+
+
+def _aggregate_state_range(begin: int, end: int, step: int = 1) -> _BlockCounts:
+    """Read and aggregate the state bytes from `begin` to `end` in a worker."""
+    _worker_state.seek(begin)
+    return _aggregate_state_block(_worker_state.read(end - begin), step)
+
+
+def _map_state_ranges(
+    state_file: str, index_path: str, ranges, workers: int = 1, step: int = 1
+):
+    """Aggregate ranges of documents, in order, optionally in worker processes.
+
+    Unlike `_map_state_blocks`, each worker decompresses its own ranges
+    through the seek index, so decompression runs in parallel too.
+
+    Args:
+        state_file (str): Path to a plain or gzip MALLET state file
+        index_path (str): Path of its seek index
+        ranges: Decompressed (start, end) offsets of the ranges, at document
+            boundaries (see `state_byte_ranges`)
+        workers (int): Number of worker processes; 1 reads and aggregates in
+            this process
+        step (int): Sampling step of `_aggregate_state_block`
+
+    Yields:
+        _BlockCounts: Partial counts for each range, in input order
+    """
+    if workers <= 1:
+        index = load_state_seek_index(index_path, state_file)
+        with open_state_seekable(state_file, index) as f:
+            for begin, end in ranges:
+                f.seek(begin)
+                yield _aggregate_state_block(f.read(end - begin), step)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_open_worker_state,
+        initargs=(state_file, index_path),
+    ) as pool:
+        pending = deque()
+        for begin, end in ranges:
+            pending.append(pool.submit(_aggregate_state_range, begin, end, step))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _read_state_numpy(
+    state_file: str,
+    workers: int = 1,
+    doc_topic_path: str | None = None,
+    block_size: int | None = None,
+    profile: "PipelineProfile | None" = None,
+    step: int = 1,
+    num_docs: int | None = None,
+    seek_index: str | None = None,
+) -> StateCounts:
+    """Read a state file in large blocks with the vectorized parser.
+
+    Each block is parsed and aggregated independently (doc-topic rows with
+    `np.bincount`, topic-word counts as (topic, type) keys), in worker
+    processes when `workers` > 1, and the partial counts are merged in file
+    order. Produces the same counts as `_read_state_python`.
+
+    With workers and a current seek index, the documents are split into
+    ranges instead, and each worker decompresses its own ranges.
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file,
+            or "-" for standard input (see `open_state_file`)
+        workers (int): Number of worker processes
+        doc_topic_path (str | None): File to write the doc-topic counts to;
+            the returned counts memory-map it
+        block_size (int | None): Bytes of decompressed state per block
+            (default: STATE_BLOCK_SIZE)
+        profile (PipelineProfile | None): Profile recording the "decompress",
+            "parse" and "aggregate" stages of the blocks
+        step (int): Aggregate only every `step`-th token of each document,
+            scaling the counts by `step` (see `read_state_sample`)
+        num_docs (int | None): Stop reading after this many documents
+        seek_index (str | None): Path of a seek index of the state file (see
+            `build_state_seek_index`), used when `workers` > 1 and the index
+            is current
+
+    Returns:
+        StateCounts: Aggregated counts
+    """
+    index = None
+    if seek_index is not None and workers > 1 and num_docs is None:
+        index = load_state_seek_index(seek_index, state_file)
+    # The workers read the documents themselves, so only the header is
+    # read here, without decompressing ahead
+    with open_state_file(state_file, pipelined=index is None) as f:
+        alpha, beta = read_state_header(read_state_header_lines(f))
+        print(f"Found alpha parameters: {len(alpha)} topics")
+        print(f"Beta value: {beta}")
+
+        if index is not None:
+            ranges = state_byte_ranges(index, state_doc_ranges(index, block_size))
+            parsed = _map_state_ranges(state_file, seek_index, ranges, workers, step)
+        else:
+            # Waiting for a parsed block includes decompressing it (and the
+            # blocks sent ahead to workers)
+            blocks = iter_state_blocks(f, block_size)
+            if num_docs is not None:
+                blocks = _first_doc_blocks(blocks, num_docs)
+            blocks = profile_iter(profile, "decompress", blocks)
+            parsed = _map_state_blocks(blocks, workers, step)
+        parsed = profile_iter(profile, "parse", parsed)
+        if doc_topic_path is None:
+            builder = _StateCountsBuilder()
+            for counts in parsed:
+                with profile_stage(profile, "aggregate"):
+                    builder.add(counts)
+                print(f"Processed {builder.line_count:,} tokens...")
+            with profile_stage(profile, "aggregate"):
+                return builder.result(alpha, beta)
+
+        with open(doc_topic_path, "wb") as doc_topic_file:
+            builder = _StateCountsBuilder(doc_topic_file, max(len(alpha), 1))
+            for counts in parsed:
+                with profile_stage(profile, "aggregate"):
+                    builder.add(counts)
+                print(f"Processed {builder.line_count:,} tokens...")
+            with profile_stage(profile, "aggregate"):
+                return builder.result(alpha, beta)
+
+
+BINARY_STATE_FORMAT = "mallet-state"  # "format" header field of binary states
+BINARY_STATE_VERSION = 1
+BINARY_STATE_CHUNK_TOKENS = 1 << 21  # Tokens of a binary state aggregated at a time
+SAMPLE_RANGES = 64  # Ranges of documents a fractional sample is spread over, at least
+
+
+def is_binary_state(state_file: str) -> bool:
+    """Return whether a file is a binary state written by `write_binary_state`."""
+    if state_file == STDIN_STATE_FILE:
+        return False
+    with open(state_file, "rb") as f:
+        if f.read(4) != DOC_TOPIC_BINARY_MAGIC:
+            return False
+        f.seek(0)
+        return _read_binary_header(f, state_file).get("format") == BINARY_STATE_FORMAT
+
+
+def _column_chunks(filepath: str, dtype: str):
+    """Yield the values of a raw column file in chunks."""
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = np.fromfile(f, dtype=dtype, count=BINARY_STATE_CHUNK_TOKENS)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+
+def _string_column(strings: list[bytes], name: str) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenate byte strings into (offsets, data) arrays."""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    if offsets[-1] > np.iinfo(np.uint32).max:
+        raise ValueError(f"Binary state {name} exceed 4 GiB")
+    return offsets, np.frombuffer(b"".join(strings), dtype=np.uint8)
+
+
+def write_binary_state(
+    state_file: str, filepath: str, block_size: int | None = None
+) -> dict:
+    """Convert a MALLET state file to the compact binary state format.
+
+    The binary state holds the token assignments of the state file in
+    columns, in the layout of doc-topic.bin (see `write_binary_arrays`):
+
+    - docIds and docLengths (uint32): doc index and number of tokens of each
+      document, in state file order
+    - types (uint32) and topics (uint16): type index and topic of each token
+    - vocabOffsets (uint32) and vocab (uint8): UTF-8 word of each type
+      index; word i is vocab[vocabOffsets[i]:vocabOffsets[i + 1]]
+    - sourceOffsets (uint32) and sources (uint8): UTF-8 source of each
+      document, stored likewise
+
+    The header holds the alpha and beta parameters. Token positions are not
+    stored, as MALLET numbers the tokens of each document from 0 in order.
+    The token columns are written to temporary files next to `filepath`
+    while the state file is read, so only the vocabulary and sources are
+    held in memory.
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file,
+            or "-" for standard input (see `open_state_file`)
+        filepath (str): Path of the binary state to write
+        block_size (int | None): Bytes of decompressed state per block
+            (default: STATE_BLOCK_SIZE)
+
+    Returns:
+        dict: Header of the binary state
+    """
+    column_paths = {
+        "types": filepath + ".types.tmp",
+        "topics": filepath + ".topics.tmp",
+    }
+    doc_ids, doc_lengths, sources = [], [], []
+    vocab = {}
+    seen_types = np.zeros(0, dtype=bool)
+    last_doc = -1
+    max_topic = 0
+    num_tokens = 0
+    try:
+        with (
+            open_state_file(state_file) as f,
+            open(column_paths["types"], "wb") as types_file,
+            open(column_paths["topics"], "wb") as topics_file,
+        ):
+            alpha, beta = read_state_header(read_state_header_lines(f))
+            for block in iter_state_blocks(f, block_size):
+                buf = np.frombuffer(block, dtype=np.uint8)
+                starts, ends, spaces, first, last, _ = _split_state_lines(buf)
+                if len(starts) == 0:
+                    continue
+                docs = _parse_int_fields(buf, starts, spaces[first])
+                types = _parse_int_fields(buf, spaces[last - 2] + 1, spaces[last - 1])
+                topics = _parse_int_fields(buf, spaces[last] + 1, ends)
+                if topics.max() > np.iinfo(np.uint16).max:
+                    raise ValueError(
+                        f"Topic {topics.max()} does not fit a binary state (uint16)"
+                    )
+                if max(docs.max(), types.max()) > np.iinfo(np.uint32).max:
+                    raise ValueError("Doc or type index does not fit a binary state")
+                max_topic = max(max_topic, int(topics.max()))
+                num_tokens += len(docs)
+                types.astype("<u4").tofile(types_file)
+                topics.astype("<u2").tofile(topics_file)
+
+                # A run of consecutive tokens with the same doc index is one
+                # document, which may continue from the previous block
+                new_doc = np.r_[docs[0] != last_doc, docs[1:] != docs[:-1]]
+                run_starts = np.flatnonzero(new_doc)
+                lengths = np.diff(np.r_[run_starts, len(docs)])
+                continued = run_starts[0] if len(run_starts) else len(docs)
+                if continued:
+                    doc_lengths[-1][-1] += continued
+                if len(run_starts):
+                    doc_ids.append(docs[run_starts])
+                    doc_lengths.append(lengths)
+                sources += [
+                    block[start:end]
+                    for start, end in zip(
+                        (spaces[first[run_starts]] + 1).tolist(),
+                        spaces[last[run_starts] - 3].tolist(),
+                    )
+                ]
+                last_doc = int(docs[-1])
+
+                # Record the first spelling of each new type index
+                unique_types, first_pos = np.unique(types, return_index=True)
+                if unique_types[-1] >= len(seen_types):
+                    grown = np.zeros(int(unique_types[-1]) + 1, dtype=bool)
+                    grown[: len(seen_types)] = seen_types
+                    seen_types = grown
+                new = np.flatnonzero(~seen_types[unique_types])
+                word_starts = spaces[last[first_pos[new]] - 1] + 1
+                word_ends = spaces[last[first_pos[new]]]
+                for type_index, start, end in zip(
+                    unique_types[new].tolist(), word_starts.tolist(), word_ends.tolist()
+                ):
+                    vocab[type_index] = block[start:end]
+                seen_types[unique_types] = True
+
+        doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, np.int64)
+        doc_lengths = (
+            np.concatenate(doc_lengths) if doc_lengths else np.zeros(0, np.int64)
+        )
+        words = [vocab.get(type_index, b"") for type_index in range(len(seen_types))]
+        vocab_offsets, vocab_data = _string_column(words, "vocabulary")
+        source_offsets, source_data = _string_column(sources, "sources")
+        header = {
+            "format": BINARY_STATE_FORMAT,
+            "version": BINARY_STATE_VERSION,
+            "alpha": alpha,
+            "beta": beta,
+            "numDocs": len(doc_ids),
+            "numTokens": num_tokens,
+            "numTopics": max_topic + 1,
+            "vocabSize": len(words),
+        }
+        temp_path = filepath + ".tmp"
+        write_binary_arrays(
+            temp_path,
+            header,
+            [
+                ("docIds", "uint32", len(doc_ids), [doc_ids]),
+                ("docLengths", "uint32", len(doc_lengths), [doc_lengths]),
+                (
+                    "types",
+                    "uint32",
+                    num_tokens,
+                    _column_chunks(column_paths["types"], "<u4"),
+                ),
+                (
+                    "topics",
+                    "uint16",
+                    num_tokens,
+                    _column_chunks(column_paths["topics"], "<u2"),
+                ),
+                ("vocabOffsets", "uint32", len(vocab_offsets), [vocab_offsets]),
+                ("vocab", "uint8", len(vocab_data), [vocab_data]),
+                ("sourceOffsets", "uint32", len(source_offsets), [source_offsets]),
+                ("sources", "uint8", len(source_data), [source_data]),
+            ],
+        )
+        os.replace(temp_path, filepath)
+    finally:
+        for path in column_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+    print(
+        f"Wrote binary state {os.path.basename(filepath)} with {num_tokens:,} tokens "
+        f"({os.path.getsize(filepath):,} bytes)"
+    )
+    return header
+
+
+@dataclass
+class BinaryState:
+    """A binary state file with its columns memory-mapped.
+
+    Attributes:
+        header (dict): Header of the file (see `write_binary_state`)
+        doc_ids (np.ndarray): Doc index of each document
+        doc_lengths (np.ndarray): Number of tokens of each document
+        types (np.ndarray): Type index of each token
+        topics (np.ndarray): Topic of each token
+        vocab (list[str]): Word string for each type index
+        source_offsets (np.ndarray): Start of each document's source in
+            `sources`, and the end of the last
+        sources (np.ndarray): UTF-8 sources of all documents
+    """
+
+    header: dict
+    doc_ids: np.ndarray
+    doc_lengths: np.ndarray
+    types: np.ndarray
+    topics: np.ndarray
+    vocab: list[str]
+    source_offsets: np.ndarray
+    sources: np.ndarray
+
+    @property
+    def alpha(self) -> list[float]:
+        """Alpha parameters from the state header."""
+        return self.header["alpha"]
+
+    @property
+    def beta(self) -> str:
+        """Raw beta value from the state header."""
+        return self.header["beta"]
+
+    def source(self, doc: int) -> str:
+        """Return the source of a document.
+
+        Args:
+            doc (int): Document number (row of doc-topic.txt)
+
+        Returns:
+            str: Source field of the document's token lines
+        """
+        start, end = self.source_offsets[doc : doc + 2]
+        return bytes(self.sources[start:end]).decode("utf-8")
+
+
+def open_binary_state(filepath: str) -> BinaryState:
+    """Open a binary state written by `write_binary_state`.
+
+    Args:
+        filepath (str): Path of the binary state
+
+    Returns:
+        BinaryState: The state, with read-only memory-mapped columns
+    """
+    with open(filepath, "rb") as f:
+        header = _read_binary_header(f, filepath)
+        data_start = f.tell()
+    if header.get("format") != BINARY_STATE_FORMAT:
+        raise ValueError(f"Not a binary state file: {filepath}")
+    if header["version"] != BINARY_STATE_VERSION:
+        raise ValueError(f"Unsupported binary state version: {header['version']}")
+
+    def column(name):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"]).newbyteorder("<")
+        if spec["length"] == 0:
+            # np.memmap cannot map an empty range
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(
+            filepath,
+            dtype=dtype,
+            mode="r",
+            offset=data_start + spec["offset"],
+            shape=(spec["length"],),
+        )
+
+    vocab_data = column("vocab").tobytes()
+    vocab = [
+        vocab_data[start:end].decode("utf-8")
+        for start, end in pairwise(column("vocabOffsets").tolist())
+    ]
+    return BinaryState(
+        header,
+        column("docIds"),
+        column("docLengths"),
+        column("types"),
+        column("topics"),
+        vocab,
+        column("sourceOffsets"),
+        column("sources"),
+    )
+
+
+def _binary_state_chunks(state: BinaryState, chunk_tokens: int | None = None):
+    """Split a binary state into chunks of whole documents.
+
+    A chunk holds documents up to about `chunk_tokens` tokens, and at least
+    one document.
+
+    Yields:
+        tuple[int, int, int, int]: First and end document, first and end token
+    """
+    chunk_tokens = chunk_tokens or BINARY_STATE_CHUNK_TOKENS
+    doc_ends = np.cumsum(state.doc_lengths, dtype=np.int64)
+    doc = token = 0
+    while doc < len(doc_ends):
+        end = max(
+            doc + 1, int(np.searchsorted(doc_ends, token + chunk_tokens, "right"))
+        )
+        yield doc, end, token, int(doc_ends[end - 1])
+        doc, token = end, int(doc_ends[end - 1])
+
+
+def _read_state_binary(
+    state_file: str,
+    doc_topic_path: str | None = None,
+    profile: "PipelineProfile | None" = None,
+    step: int = 1,
+) -> StateCounts:
+    """Aggregate the counts of a binary state.
+
+    Documents are counted in chunks of whole documents with `np.bincount`,
+    straight from the memory-mapped columns. Produces the same counts as
+    reading the text state file it was converted from.
+
+    With a `step`, only every `step`-th chunk is counted and the topic-word
+    counts are multiplied by `step`. The other documents keep all-zero rows.
+
+    Args:
+        state_file (str): Path of a binary state (see `write_binary_state`)
+        doc_topic_path (str | None): File to write the doc-topic counts to;
+            the returned counts memory-map it
+        profile (PipelineProfile | None): Profile recording the "aggregate"
+            stage of each chunk
+        step (int): Count every `step`-th chunk of documents (see
+            `read_state_sample`)
+
+    Returns:
+        StateCounts: Aggregated counts
+    """
+    state = open_binary_state(state_file)
+    header = state.header
+    print(f"Found alpha parameters: {len(state.alpha)} topics")
+    print(f"Beta value: {state.beta}")
+    num_topics = header["numTopics"]
+    vocab_size = header["vocabSize"]
+    # Dense topic-word counts when a bincount of them costs no more than a
+    # chunk, otherwise (topic, type) keys as in the numpy engine
+    dense = num_topics * vocab_size <= BINARY_STATE_CHUNK_TOKENS
+    if dense:
+        topic_word = np.zeros(num_topics * vocab_size, dtype=np.int64)
+    keyed = _KeyedCounter()
+
+    with ExitStack() as stack:
+        doc_topic = None
+        if doc_topic_path is None:
+            doc_topic = np.zeros((header["numDocs"], num_topics), dtype=np.int32)
+        else:
+            doc_topic_file = stack.enter_context(open(doc_topic_path, "wb"))
+        tokens = 0
+        chunk_tokens = sampled_docs = None
+        if step > 1:
+            # Small enough chunks that the sample is spread over the state
+            chunk_tokens = min(
+                BINARY_STATE_CHUNK_TOKENS,
+                max(1, header["numTokens"] // (SAMPLE_RANGES * step)),
+            )
+            sampled_docs = np.zeros(header["numDocs"], dtype=bool)
+        chunks = _binary_state_chunks(state, chunk_tokens)
+        for n, (first_doc, end_doc, start, end) in enumerate(chunks):
+            if n % step:
+                if doc_topic is None:
+                    doc_topic_file.write(bytes((end_doc - first_doc) * num_topics * 4))
+                continue
+            if sampled_docs is not None:
+                sampled_docs[first_doc:end_doc] = True
+            tokens += end - start
+            with profile_stage(profile, "aggregate"):
+                topics = state.topics[start:end].astype(np.int64)
+                types = state.types[start:end].astype(np.int64)
+                runs = np.repeat(
+                    np.arange(end_doc - first_doc), state.doc_lengths[first_doc:end_doc]
+                )
+                rows = np.bincount(
+                    runs * num_topics + topics,
+                    minlength=(end_doc - first_doc) * num_topics,
+                ).reshape(-1, num_topics)
+                if doc_topic is None:
+                    doc_topic_file.write(rows.astype(np.int32).tobytes())
+                else:
+                    doc_topic[first_doc:end_doc] = rows
+                if dense:
+                    topic_word += np.bincount(
+                        topics * vocab_size + types, minlength=len(topic_word)
+                    )
+                else:
+                    keyed.add((topics << 32) | types)
+            print(f"Processed {tokens:,} tokens...")
+
+    with profile_stage(profile, "aggregate"):
+        if doc_topic is None:
+            if header["numDocs"]:
+                doc_topic = np.memmap(
+                    doc_topic_path,
+                    dtype=np.int32,
+                    mode="r",
+                    shape=(header["numDocs"], num_topics),
+                )
+            else:
+                doc_topic = np.zeros((0, num_topics), dtype=np.int32)
+        if dense:
+            topic_word = topic_word.reshape(num_topics, vocab_size) * step
+        else:
+            keys, counts = keyed.result()
+            topic_word = topic_word_matrix(
+                keys >> 32, keys & 0xFFFFFFFF, counts * step, num_topics, vocab_size
+            )
+    return StateCounts(
+        doc_topic,
+        topic_word,
+        state.vocab,
+        state.alpha,
+        state.beta,
+        tokens,
+        state.doc_ids.astype(np.int64),
+        sampled_docs,
+    )
+
+
+def iter_state_tokens(state_file: str, block_size: int | None = None):
+    """Yield the tokens of a text or binary state file in blocks.
+
+    Args:
+        state_file (str): Path to a MALLET state file, plain, compressed or
+            binary (see `write_binary_state`), or "-" for standard input
+        block_size (int | None): Bytes of decompressed text state per block
+            (default: STATE_BLOCK_SIZE)
+
+    Yields:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Doc index, type index and
+            topic of consecutive tokens
+    """
+    if is_binary_state(state_file):
+        state = open_binary_state(state_file)
+        for first_doc, end_doc, start, end in _binary_state_chunks(state):
+            docs = np.repeat(
+                state.doc_ids[first_doc:end_doc].astype(np.int64),
+                state.doc_lengths[first_doc:end_doc],
+            )
+            yield (
+                docs,
+                state.types[start:end].astype(np.int64),
+                state.topics[start:end].astype(np.int64),
+            )
+        return
+    with open_state_file(state_file) as f:
+        read_state_header_lines(f)
+        for block in iter_state_blocks(f, block_size):
+            yield parse_state_block(block)[:3]
+
+
+def read_state_counts(
+    state_file: str,
+    engine: str = "python",
+    workers: int = 1,
+    doc_topic_path: str | None = None,
+    block_size: int | None = None,
+    profile: "PipelineProfile | None" = None,
+    seek_index: str | None = None,
+) -> StateCounts:
+    """Read a MALLET state file and aggregate its counts.
+
+    A binary state (see `write_binary_state`) is aggregated straight from
+    its memory-mapped columns, whatever the engine and workers.
+
+    Args:
+        state_file (str): Path to a plain, compressed or binary MALLET state
+            file, or "-" for standard input (see `open_state_file`)
+        engine (str): State parser to use: "python" reads line by line, "numpy"
+            parses large blocks in bulk. Both produce identical counts.
+        workers (int): Number of processes parsing blocks in parallel
+            (numpy engine only)
+        doc_topic_path (str | None): File to hold the doc-topic counts out of
+            core; the returned `doc_topic` is a read-only np.memmap of it
+            (numpy engine only)
+        block_size (int | None): Bytes of decompressed state per block
+            (numpy engine only, default: STATE_BLOCK_SIZE)
+        profile (PipelineProfile | None): Profile recording the reader's
+            stages (numpy engine only; the python engine decompresses,
+            parses and aggregates line by line)
+        seek_index (str | None): Path of a seek index of the state file; with
+            workers, each worker reads its own ranges of documents through it
+            (see `build_state_seek_index`)
+
+    Returns:
+        StateCounts: Aggregated counts
+    """
+    if engine not in PARSE_ENGINES:
+        raise ValueError(f"Unknown parse engine: {engine!r}")
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if is_binary_state(state_file):
+        return _read_state_binary(state_file, doc_topic_path, profile)
+    if engine == "numpy":
+        return _read_state_numpy(
+            state_file,
+            workers,
+            doc_topic_path,
+            block_size,
+            profile,
+            seek_index=seek_index,
+        )
+    if workers > 1:
+        raise ValueError("Parallel parsing requires the numpy engine")
+    if doc_topic_path is not None:
+        raise ValueError("Out-of-core aggregation requires the numpy engine")
+    return _read_state_python(state_file)
+
+
+def _first_doc_blocks(blocks, num_docs: int):
+    """Yield state blocks up to the end of the first `num_docs` documents.
+
+    Args:
+        blocks: Iterable of state blocks (see `iter_state_blocks`)
+        num_docs (int): Number of documents to keep
+
+    Yields:
+        bytes: Blocks, the last one cut before the next document
+    """
+    seen = 0
+    previous_doc = -1
+    for block in blocks:
+        starts, previous_doc = _doc_starts(block, previous_doc)
+        if seen + len(starts) > num_docs:
+            cut = int(starts[num_docs - seen])
+            if cut:
+                yield block[:cut]
+            return
+        seen += len(starts)
+        yield block
+
+
+def _read_state_doc_sample(
+    state_file: str,
+    index_path: str,
+    step: int,
+    workers: int = 1,
+    doc_topic_path: str | None = None,
+    block_size: int | None = None,
+    profile: "PipelineProfile | None" = None,
+) -> StateCounts:
+    """Count every `step`-th range of documents, seeking through the index.
+
+    The documents are split into ranges (see `state_doc_ranges`), and only
+    every `step`-th range, from the first, is decompressed and parsed.
+    Ranges are small enough for SAMPLE_RANGES of them to be read, but no
+    smaller than the gap between gzip seek points, since each read
+    decompresses from the seek point before it. Documents outside them keep
+    all-zero rows, and the topic-word counts are multiplied by `step`.
+
+    Args:
+        state_file (str): Path to a plain or gzip MALLET state file
+        index_path (str): Path of its current seek index
+        step (int): Read one range of documents in `step`
+        workers (int): Number of processes reading ranges in parallel
+        doc_topic_path (str | None): File to hold the doc-topic counts out of
+            core (see `read_state_counts`)
+        block_size (int | None): Most bytes of decompressed state per range
+        profile (PipelineProfile | None): Profile recording the "parse" and
+            "aggregate" stages of the ranges
+
+    Returns:
+        StateCounts: Estimated counts, without doc indices
+    """
+    index = load_state_seek_index(index_path, state_file)
+    offsets, points = index[1]["docOffsets"], index[1]["pointsOut"]
+    range_size = int(offsets[-1] - offsets[0]) // (SAMPLE_RANGES * step)
+    if len(points) > 1:
+        range_size = max(range_size, int(np.diff(points).mean()))
+    range_size = max(1, min(block_size or STATE_BLOCK_SIZE, range_size))
+    doc_ranges = state_doc_ranges(index, range_size)[::step]
+    with open_state_file(state_file, pipelined=False) as f:
+        alpha, beta = read_state_header(read_state_header_lines(f))
+    print(f"Found alpha parameters: {len(alpha)} topics")
+    print(f"Beta value: {beta}")
+    print(f"Reading {len(doc_ranges)} ranges of documents through {index_path}")
+
+    parsed = _map_state_ranges(
+        state_file, index_path, state_byte_ranges(index, doc_ranges), workers
+    )
+    with ExitStack() as stack:
+        spill = None
+        if doc_topic_path is not None:
+            # The sampled rows go to a file of their own, and are then
+            # spread over the rows of all documents
+            spill = stack.enter_context(open(doc_topic_path + ".sample", "wb"))
+            stack.callback(os.remove, spill.name)
+        builder = _StateCountsBuilder(spill, max(len(alpha), 1))
+        for counts in profile_iter(profile, "parse", parsed):
+            with profile_stage(profile, "aggregate"):
+                builder.add(counts)
+            print(f"Processed {builder.line_count:,} tokens...")
+
+        with profile_stage(profile, "aggregate"):
+            sampled = builder.result(alpha, beta)
+            if len(sampled.doc_topic) != sum(end - first for first, end in doc_ranges):
+                raise ValueError(
+                    f"Seek index {index_path} does not match the documents "
+                    f"of {state_file}"
+                )
+            # A sample can miss topics, so it keeps every topic of the header
+            num_topics = max(len(alpha), sampled.num_topics)
+            shape = (index[0]["numDocs"], num_topics)
+            if doc_topic_path is not None and shape[0]:
+                doc_topic = np.memmap(
+                    doc_topic_path, dtype=np.int32, mode="w+", shape=shape
+                )
+            else:
+                doc_topic = np.zeros(shape, dtype=np.int32)
+            sampled_docs = np.zeros(shape[0], dtype=bool)
+            row = 0
+            for first, end in doc_ranges:
+                sampled_docs[first:end] = True
+                doc_topic[first:end, : sampled.num_topics] = sampled.doc_topic[
+                    row : row + end - first
+                ]
+                row += end - first
+            if isinstance(doc_topic, np.memmap):
+                doc_topic.flush()
+                doc_topic = np.memmap(
+                    doc_topic_path, dtype=np.int32, mode="r", shape=shape
+                )
+            keys, values = _topic_word_keys(sampled.topic_word)
+            topic_word = topic_word_matrix(
+                keys >> 32,
+                keys & 0xFFFFFFFF,
+                values * step,
+                num_topics,
+                len(sampled.vocab),
+            )
+    return StateCounts(
+        doc_topic,
+        topic_word,
+        sampled.vocab,
+        alpha,
+        beta,
+        sampled.line_count,
+        sampled_docs=sampled_docs,
+    )
+
+
+def read_state_sample(
+    state_file: str,
+    sample: float | int,  # noqa: PYI041 - an int is a number of documents
+    workers: int = 1,
+    doc_topic_path: str | None = None,
+    block_size: int | None = None,
+    profile: "PipelineProfile | None" = None,
+    seek_index: str | None = None,
+) -> tuple[StateCounts, dict | None]:
+    """Estimate the counts of a state file from a sample of it.
+
+    With a fraction, n is 1 / `sample`, rounded, and the topic-word counts
+    are multiplied by n. How the sample is drawn depends on what can be
+    read without reading everything:
+
+    - A binary state, or a text state with a current seek index (see
+      `build_state_seek_index`): one range of whole documents in n, spread
+      evenly over the file, is read by seeking to it and counted exactly.
+      The other documents keep all-zero rows, so the files still line up
+      with the metadata. Only about 1 / n of the state is decompressed.
+    - Any other text state: every n-th token of each document is counted,
+      from its first, and the doc-topic counts are multiplied by n too, so
+      every document has proportions estimated from its own tokens. The
+      whole file is still decompressed, so this saves parsing only.
+
+    With a number of documents, reading stops after the first `sample`
+    documents, whose counts are exact. A binary state is then read in
+    full, as that is already fast.
+
+    Text states are read with the numpy engine.
+
+    Args:
+        state_file (str): Path to a plain, compressed or binary MALLET state
+            file, or "-" for standard input (see `open_state_file`)
+        sample (float | int): Fraction of the state (float) or number of first
+            documents (int) to read, as returned by `parse_sample`
+        workers (int): Number of processes parsing blocks in parallel
+        doc_topic_path (str | None): File to hold the doc-topic counts out of
+            core (see `read_state_counts`)
+        block_size (int | None): Bytes of decompressed state per block
+        profile (PipelineProfile | None): Profile recording the reader's stages
+        seek_index (str | None): Path of a seek index of the state file, used
+            for a fraction when it is current
+
+    Returns:
+        tuple[StateCounts, dict | None]: Estimated counts, and a description
+            of the sample for `mark_config_approximate` (None when the counts
+            are exact)
+    """
+    step = None if isinstance(sample, int) else max(1, round(1 / sample))
+    if is_binary_state(state_file):
+        if step in (None, 1):
+            print("Reading the binary state in full")
+            return read_state_counts(
+                state_file, doc_topic_path=doc_topic_path, profile=profile
+            ), None
+        counts = _read_state_binary(state_file, doc_topic_path, profile, step)
+        return counts, {
+            "method": "documents",
+            "fraction": 1 / step,
+            "tokens": counts.line_count,
+        }
+    if step is None:
+        counts = _read_state_numpy(
+            state_file,
+            workers,
+            doc_topic_path,
+            block_size,
+            profile,
+            num_docs=sample,
+        )
+        return counts, {"method": "first_docs", "documents": counts.num_docs}
+    if (
+        step > 1
+        and seek_index is not None
+        and state_file != STDIN_STATE_FILE
+        and load_state_seek_index(seek_index, state_file) is not None
+    ):
+        counts = _read_state_doc_sample(
+            state_file, seek_index, step, workers, doc_topic_path, block_size, profile
+        )
+        return counts, {
+            "method": "documents",
+            "fraction": 1 / step,
+            "tokens": counts.line_count,
+        }
+    counts = _read_state_numpy(
+        state_file, workers, doc_topic_path, block_size, profile, step=step
+    )
+    if step == 1:
+        return counts, None
+    # Every token was read, but only the scaled topic-word counts were kept
+    return counts, {
+        "method": "tokens",
+        "fraction": 1 / step,
+        "tokens": int(counts.topic_word.sum()) // step,
+    }
+
+
+def find_browser_config(output_dir: str) -> str | None:
+    """Find the config.json the browser loads with the data in `output_dir`.
+
+    The browser loads config.json from the root of the site, the nearest
+    directory holding both index.html and config.json, such as dist/ for
+    data written to dist/data/myproject.
+
+    Args:
+        output_dir (str): Directory of the data files
+
+    Returns:
+        str | None: Path of the site's config.json, or None outside a site
+    """
+    directory = os.path.abspath(output_dir)
+    while True:
+        config_path = os.path.join(directory, CONFIG_FILENAME)
+        if os.path.isfile(config_path) and os.path.isfile(
+            os.path.join(directory, "index.html")
+        ):
+            return config_path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def mark_config_approximate(config_path: str | None, sample: dict | None) -> None:
+    """Mark the browser's config.json as showing approximate data, or unmark it.
+
+    The sample is stored as the "approximate" entry of config.json, which
+    the browser shows as a notice. Without a sample the entry is removed,
+    and a config.json left empty by that, which only an earlier sample
+    created, is deleted. A missing config.json is never created.
+
+    Args:
+        config_path (str | None): Path of config.json, or None if there is none
+        sample (dict | None): Description of the sample from
+            `read_state_sample`, or None for exact data
+    """
+    if config_path is None or not os.path.exists(config_path):
+        if sample is not None:
+            print(
+                f"Warning: {config_path or 'the browser config.json'} not found, "
+                "so the sample is not marked as approximate (see --config)"
+            )
+        return
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+    if sample is None:
+        if APPROXIMATE_CONFIG_KEY not in config:
+            return
+        del config[APPROXIMATE_CONFIG_KEY]
+        if not config:
+            os.remove(config_path)
+            print(
+                f"Removed {os.path.basename(config_path)}, which only marked a sample"
+            )
+            return
+    else:
+        config[APPROXIMATE_CONFIG_KEY] = sample
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    state = "approximate" if sample else "exact"
+    print(f"Marked {os.path.basename(config_path)} as {state}")
+
+
+def state_fingerprint(state_file: str, content_hash: bool = True) -> dict:
+    """Fingerprint a state file by size, modification time and content hash.
+
+    Args:
+        state_file (str): Path to MALLET topic-state.gz file
+        content_hash (bool): Whether to hash the file contents
+
+    Returns:
+        dict: Fingerprint with 'size', 'mtime_ns' and 'hash' keys
+    """
+    stat = os.stat(state_file)
+    digest = ""
+    if content_hash:
+        hasher = hashlib.blake2b(digest_size=20)
+        with open(state_file, "rb") as f:
+            for chunk in iter(lambda: f.read(STATE_BLOCK_SIZE), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+
+
+def _cache_doc_topic_path(filepath: str) -> str:
+    """Return the path of the doc-topic counts kept beside a count cache."""
+    return os.path.splitext(filepath)[0] + "-doc-topic.npy"
+
+
+def save_state_counts(counts: StateCounts, filepath: str, fingerprint: dict) -> None:
+    """Save aggregated state counts to an uncompressed .npz cache.
+
+    The doc-topic counts go to a .npy file beside it, so that they can be
+    loaded memory-mapped.
+
+    Args:
+        counts (StateCounts): Aggregated counts
+        filepath (str): Path of the cache file
+        fingerprint (dict): Fingerprint of the state file, from `state_fingerprint`
+    """
+    from scipy import sparse
+
+    arrays = {
+        "version": np.array(CACHE_VERSION),
+        "fingerprint": np.array(json.dumps(fingerprint)),
+        "vocab": np.array(counts.vocab, dtype=str),
+        "alpha": np.array(counts.alpha, dtype=np.float64),
+        "beta": np.array(counts.beta),
+        "line_count": np.array(counts.line_count),
+    }
+    if sparse.issparse(counts.topic_word):
+        topic_word = sparse.csr_matrix(counts.topic_word)
+        arrays["topic_word_data"] = topic_word.data
+        arrays["topic_word_indices"] = topic_word.indices
+        arrays["topic_word_indptr"] = topic_word.indptr
+        arrays["topic_word_shape"] = np.array(topic_word.shape)
+    else:
+        arrays["topic_word"] = counts.topic_word
+    # Write to temporary files first, and the .npz last, so an interrupted run
+    # leaves no bad cache
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    doc_topic_path = _cache_doc_topic_path(filepath)
+    with open(doc_topic_path + ".tmp", "wb") as f:
+        np.save(f, counts.doc_topic)
+    os.replace(doc_topic_path + ".tmp", doc_topic_path)
+    temp_path = filepath + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, filepath)
+    print(f"Wrote count cache {os.path.basename(filepath)}")
+
+
+def load_state_counts(
+    filepath: str, state_file: str, mmap: bool = False
+) -> StateCounts | None:
+    """Load cached state counts if they were built from this state file.
+
+    The cache is used when the state file's size and modification time match
+    the fingerprint, or when the size matches and the content hash does (e.g.
+    after the file was copied or touched).
+
+    Args:
+        filepath (str): Path of the cache file
+        state_file (str): Path to MALLET topic-state.gz file
+        mmap (bool): Whether to memory-map the doc-topic counts rather than
+            read them into memory
+
+    Returns:
+        StateCounts | None: Cached counts, or None if the cache is missing or stale
+    """
+    from scipy import sparse
+
+    doc_topic_path = _cache_doc_topic_path(filepath)
+    if not (os.path.exists(filepath) and os.path.exists(doc_topic_path)):
+        return None
+    with np.load(filepath) as cache:
+        if int(cache["version"]) != CACHE_VERSION:
+            return None
+        cached = json.loads(str(cache["fingerprint"]))
+        current = state_fingerprint(state_file, content_hash=False)
+        if current["size"] != cached["size"]:
+            return None
+        # A changed mtime alone does not invalidate the cache; the hash decides
+        if (
+            current["mtime_ns"] != cached["mtime_ns"]
+            and state_fingerprint(state_file)["hash"] != cached["hash"]
+        ):
+            return None
+        if "topic_word" in cache:
+            topic_word = cache["topic_word"]
+        else:
+            topic_word = sparse.csr_matrix(
+                (
+                    cache["topic_word_data"],
+                    cache["topic_word_indices"],
+                    cache["topic_word_indptr"],
+                ),
+                shape=tuple(cache["topic_word_shape"]),
+            )
+        counts = StateCounts(
+            np.load(doc_topic_path, mmap_mode="r" if mmap else None),
+            topic_word,
+            cache["vocab"].tolist(),
+            cache["alpha"].tolist(),
+            str(cache["beta"]),
+            int(cache["line_count"]),
+        )
+    print(f"Loaded counts from cache {os.path.basename(filepath)}")
+    return counts
+
+
+PARTIAL_VERSION = 1
+
+
+def _topic_word_keys(topic_word) -> tuple[np.ndarray, np.ndarray]:
+    """Return the nonzero topic-word counts as sorted (topic << 32 | type) keys."""
+    from scipy import sparse
+
+    coo = sparse.coo_matrix(topic_word)
+    keys = (coo.row.astype(np.int64) << 32) | coo.col.astype(np.int64)
+    order = np.argsort(keys)
+    return keys[order], coo.data[order].astype(np.int64)
+
+
+def save_partial_counts(counts: StateCounts, filepath: str) -> None:
+    """Save the counts of a state shard as a partial aggregate (map output).
+
+    A partial holds the doc-topic counts of its documents keyed by doc
+    index, the nonzero topic-word counts as (topic, type) keys, and the
+    vocabulary, in an uncompressed .npz file. Partials are combined with
+    `merge_state_counts`.
+
+    Args:
+        counts (StateCounts): Counts of a state shard, with `doc_ids`
+        filepath (str): Path of the partial file
+    """
+    if counts.doc_ids is None:
+        raise ValueError("Partial counts need the doc index of each document")
+    keys, values = _topic_word_keys(counts.topic_word)
+    arrays = {
+        "version": np.array(PARTIAL_VERSION),
+        "doc_ids": counts.doc_ids,
+        "doc_topic": counts.doc_topic,
+        "topic_word_keys": keys,
+        "topic_word_counts": values,
+        "num_topics": np.array(counts.num_topics),
+        "vocab": np.array(counts.vocab, dtype=str),
+        "alpha": np.array(counts.alpha, dtype=np.float64),
+        "beta": np.array(counts.beta),
+        "line_count": np.array(counts.line_count),
+    }
+    # Write to a temporary file first so an interrupted run leaves no partial
+    temp_path = filepath + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, filepath)
+    print(
+        f"Wrote partial counts {os.path.basename(filepath)} with "
+        f"{len(counts.doc_ids)} documents"
+    )
+
+
+def load_partial_counts(filepath: str) -> StateCounts:
+    """Load a partial aggregate written by `save_partial_counts`.
+
+    Args:
+        filepath (str): Path of the partial file
+
+    Returns:
+        StateCounts: The partial counts, with `doc_ids`
+    """
+    with np.load(filepath) as partial:
+        if int(partial["version"]) != PARTIAL_VERSION:
+            raise ValueError(f"Unsupported partial counts version: {filepath}")
+        keys = partial["topic_word_keys"]
+        vocab = partial["vocab"].tolist()
+        num_topics = int(partial["num_topics"])
+        return StateCounts(
+            partial["doc_topic"],
+            topic_word_matrix(
+                keys >> 32,
+                keys & 0xFFFFFFFF,
+                partial["topic_word_counts"],
+                num_topics,
+                len(vocab),
+            ),
+            vocab,
+            partial["alpha"].tolist(),
+            str(partial["beta"]),
+            int(partial["line_count"]),
+            partial["doc_ids"],
+        )
+
+
+def merge_state_counts(parts: list[StateCounts]) -> StateCounts:
+    """Merge the counts of state shards (reduce).
+
+    Documents are keyed by doc index: the rows of a document split between
+    shards are added up, and the merged rows are in doc index order, as in
+    a whole state file. Topic-word counts are added up and the vocabularies
+    combined. The merge is associative and commutative, so partials can be
+    merged in any grouping and order, for example in a tree across nodes,
+    with the same result.
+
+    Args:
+        parts (list[StateCounts]): Counts of state shards, with `doc_ids`
+
+    Returns:
+        StateCounts: Merged counts, with `doc_ids`
+    """
+    if not parts:
+        raise ValueError("No partial counts to merge")
+    if any(part.doc_ids is None for part in parts):
+        raise ValueError("Partial counts need the doc index of each document")
+    # Shards cut from the middle of a state file have no header
+    headers = {(tuple(part.alpha), part.beta) for part in parts if part.alpha}
+    if len(headers) > 1:
+        raise ValueError("Partial counts come from states with different headers")
+    alpha, beta = headers.pop() if headers else ([], "")
+
+    num_topics = max(part.num_topics for part in parts)
+    vocab_size = max(len(part.vocab) for part in parts)
+
+    doc_ids = np.concatenate([part.doc_ids for part in parts]).astype(np.int64)
+    rows = np.zeros((len(doc_ids), num_topics), dtype=np.int32)
+    offset = 0
+    for part in parts:
+        rows[offset : offset + part.num_docs, : part.num_topics] = part.doc_topic
+        offset += part.num_docs
+    order = np.argsort(doc_ids, kind="stable")
+    doc_ids = doc_ids[order]
+    starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+    if len(doc_ids):
+        doc_topic = np.add.reduceat(rows[order], starts, axis=0)
+    else:
+        doc_topic = rows
+
+    keys, values = zip(*(_topic_word_keys(part.topic_word) for part in parts))
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    values = np.bincount(inverse, weights=np.concatenate(values)).astype(np.int64)
+    topic_word = topic_word_matrix(
+        keys >> 32, keys & 0xFFFFFFFF, values, num_topics, vocab_size
+    )
+
+    # The spelling of the shard with the first documents, so the result
+    # does not depend on the order of `parts`
+    vocab = [""] * vocab_size
+    first_docs = [part.doc_ids.min(initial=np.iinfo(np.int64).max) for part in parts]
+    for i in sorted(range(len(parts)), key=first_docs.__getitem__, reverse=True):
+        for type_index, word in enumerate(parts[i].vocab):
+            if word:
+                vocab[type_index] = word
+
+    return StateCounts(
+        doc_topic,
+        topic_word,
+        vocab,
+        list(alpha),
+        beta,
+        sum(part.line_count for part in parts),
+        doc_ids[starts],
+    )
+
+
+def merge_partial_counts(partial_files: list[str], filepath: str | None = None):
+    """Merge partial aggregate files, optionally into a new partial file.
+
+    Writing the merge of some partials to a new partial allows merging in a
+    tree, with each node merging the partials of its children.
+
+    Args:
+        partial_files (list[str]): Paths of partial files
+        filepath (str | None): Path of the merged partial file to write
+
+    Returns:
+        StateCounts: Merged counts
+    """
+    counts = merge_state_counts([load_partial_counts(p) for p in partial_files])
+    if filepath is not None:
+        save_partial_counts(counts, filepath)
+    return counts
+
+
+SEEK_INDEX_FILENAME = "state-seek.bin"
+SEEK_INDEX_VERSION = 1
+SEEK_POINT_SPACING = 1 << 22  # Compressed bytes between gzip seek points
+SEEK_WINDOW_SIZE = 1 << 15  # Bytes of output saved at each gzip seek point
+
+
+def seek_backend():
+    """Return the `indexed_gzip` module, or None if it is not installed.
+
+    indexed_gzip (`pip install indexed_gzip`) implements zlib's zran
+    technique: each seek point saves a compressed offset and the 32 KiB
+    window of output before it, from which decompression can resume. The
+    zlib module cannot do this itself, as it does not report where deflate
+    blocks end.
+
+    Returns:
+        module | None: `indexed_gzip`, or None
+    """
+    try:
+        return importlib.import_module("indexed_gzip")
+    except ImportError:
+        return None
+
+
+def check_state_seekable(state_file: str) -> str | None:
+    """Check that documents of a state file can be read by seeking.
+
+    Plain files can be read from any offset, and gzip files from the seek
+    points of indexed_gzip. Other compressed files can only be read from
+    the start, so an index of them would save nothing.
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file
+
+    Returns:
+        str | None: Compression of the state file (see `state_compression`)
+
+    Raises:
+        ValueError: If the state file cannot be read by seeking
+    """
+    with open(state_file, "rb") as f:
+        compression = state_compression(f.read(6))
+    if compression == "gzip" and seek_backend() is None:
+        raise ValueError(
+            "A seek index of a gzip state file requires indexed_gzip "
+            "(pip install indexed_gzip)"
+        )
+    if compression not in (None, "gzip"):
+        raise ValueError(
+            f"A seek index needs a plain or gzip state file, not {compression}"
+        )
+    return compression
+
+
+def _doc_starts(block: bytes, previous_doc: int) -> tuple[np.ndarray, int]:
+    """Find the token lines of a block that start a new document.
+
+    Args:
+        block (bytes): Decompressed state bytes ending with a newline
+        previous_doc (int): Doc index of the last token before the block
+
+    Returns:
+        tuple[np.ndarray, int]: Offsets within the block of the first line of
+            each new document, and the doc index of the last token
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    starts, _, spaces, first, _, _ = _split_state_lines(buf)
+    if len(starts) == 0:
+        return starts, previous_doc
+    docs = _parse_int_fields(buf, starts, spaces[first])
+    new_doc = np.r_[docs[0] != previous_doc, docs[1:] != docs[:-1]]
+    return starts[new_doc], int(docs[-1])
+
+
+def build_state_seek_index(
+    state_file: str, filepath: str, spacing: int | None = None
+) -> dict:
+    """Build a seek index for reading single documents of a state file.
+
+    Reads the state file once and records the decompressed offset of the
+    first token line of each document, numbered as the rows of
+    doc-topic.txt. For gzip files, seek points about `spacing` compressed
+    bytes apart are saved as well, so `read_state_docs` decompresses from
+    the seek point before a document rather than from the start of the file.
+    They need indexed_gzip (see `seek_backend`); other compressed files
+    have no seek points and get no index (see `check_state_seekable`).
+
+    The index has the layout of doc-topic.bin (see `write_binary_arrays`),
+    with the arrays:
+
+    - docOffsets (uint64): Decompressed offset of each document, and of the
+      end of the state, num_docs + 1 values
+    - pointsIn and pointsOut (uint64): Compressed and decompressed offset of
+      each seek point
+    - zran (uint8): The seek points and their windows, as exported by
+      indexed_gzip
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file
+        filepath (str): Path of the index file
+        spacing (int | None): Compressed bytes between seek points, more
+            than the SEEK_WINDOW_SIZE saved at each (default:
+            SEEK_POINT_SPACING)
+
+    Returns:
+        dict: Header of the index
+    """
+    spacing = spacing or SEEK_POINT_SPACING
+    if spacing <= SEEK_WINDOW_SIZE:
+        raise ValueError(
+            f"Seek points must be more than {SEEK_WINDOW_SIZE} bytes apart, "
+            f"not {spacing}"
+        )
+    compression = check_state_seekable(state_file)
+    doc_starts = []
+    points = np.zeros((0, 2), dtype=np.uint64)
+    zran = b""
+    with ExitStack() as stack:
+        if compression == "gzip":
+            stream = stack.enter_context(
+                seek_backend().IndexedGzipFile(state_file, spacing=spacing)
+            )
+        else:
+            stream = stack.enter_context(open(state_file, "rb"))
+        header_lines = read_state_header_lines(stream)
+        position = sum(len(line.encode("utf-8")) for line in header_lines)
+        previous_doc = -1
+        for block in iter_state_blocks(stream):
+            starts, previous_doc = _doc_starts(block, previous_doc)
+            doc_starts.append(starts + position)
+            position += len(block)
+        if compression == "gzip":
+            # (decompressed, compressed) offset pairs
+            points = np.array(list(stream.seek_points()), dtype=np.uint64)
+            points = points.reshape(-1, 2)
+            exported = io.BytesIO()
+            stream.export_index(fileobj=exported)
+            zran = exported.getvalue()
+
+    doc_starts.append(np.array([position], dtype=np.int64))
+    num_docs = sum(map(len, doc_starts)) - 1
+    header = {
+        "version": SEEK_INDEX_VERSION,
+        "state": state_fingerprint(state_file, content_hash=False),
+        "compression": compression,
+        "spacing": spacing,
+        "numDocs": num_docs,
+    }
+    # Write to a temporary file first so an interrupted run leaves no bad index
+    temp_path = filepath + ".tmp"
+    write_binary_arrays(
+        temp_path,
+        header,
+        [
+            ("docOffsets", "uint64", num_docs + 1, doc_starts),
+            ("pointsIn", "uint64", len(points), [points[:, 1]]),
+            ("pointsOut", "uint64", len(points), [points[:, 0]]),
+            ("zran", "uint8", len(zran), [np.frombuffer(zran, dtype=np.uint8)]),
+        ],
+    )
+    os.replace(temp_path, filepath)
+    print(
+        f"Wrote seek index {os.path.basename(filepath)} with {num_docs} documents "
+        f"and {len(points)} seek points"
+    )
+    return header
+
+
+def load_state_seek_index(
+    filepath: str, state_file: str
+) -> tuple[dict, dict[str, np.ndarray]] | None:
+    """Load a seek index if it was built from this state file.
+
+    Args:
+        filepath (str): Path of the index file
+        state_file (str): Path to the MALLET state file
+
+    Returns:
+        tuple[dict, dict[str, np.ndarray]] | None: Header and arrays, or None
+            if the index is missing or the state file's size or modification
+            time has changed
+    """
+    if not os.path.exists(filepath):
+        return None
+    # Check the header before reading the windows
+    with open(filepath, "rb") as f:
+        header = _read_binary_header(f, filepath)
+    if header.get("version") != SEEK_INDEX_VERSION:
+        return None
+    if header["state"] != state_fingerprint(state_file, content_hash=False):
+        return None
+    return read_binary_arrays(filepath)
+
+
+class StateDocReader:
+    """Reads documents of a state file through its seek index.
+
+    The index is loaded and the state file opened once, so each `read`
+    only seeks: plain files are read from the first document's offset, and
+    gzip files are decompressed from the seek point before it. Use it as a
+    context manager, or call `close`.
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file
+        index_path (str): Path of its seek index, from `build_state_seek_index`
+    """
+
+    def __init__(self, state_file: str, index_path: str):
+        index = load_state_seek_index(index_path, state_file)
+        if index is None:
+            raise ValueError(f"Seek index {index_path} does not match {state_file}")
+        header, arrays = index
+        self.num_docs = header["numDocs"]
+        self.offsets = arrays["docOffsets"]
+        self.file = open_state_seekable(state_file, index)
+
+    def read(self, start: int, stop: int | None = None) -> bytes:
+        """Read the token lines of documents `start` to `stop` - 1.
+
+        Args:
+            start (int): First document (row of doc-topic.txt)
+            stop (int | None): Document after the last one (default: start + 1)
+
+        Returns:
+            bytes: The decompressed token lines
+        """
+        stop = start + 1 if stop is None else stop
+        if not 0 <= start <= stop <= self.num_docs:
+            raise IndexError(
+                f"Documents {start}:{stop} out of range for {self.num_docs} documents"
+            )
+        begin, end = (int(offset) for offset in self.offsets[[start, stop]])
+        self.file.seek(begin)
+        return self.file.read(end - begin)
+
+    def close(self) -> None:
+        """Close the state file."""
+        self.file.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_state_docs(
+    state_file: str, index_path: str, start: int, stop: int | None = None
+) -> bytes:
+    """Read the token lines of documents `start` to `stop` - 1 of a state file.
+
+    This loads the index and opens the state file for one read; to read
+    many documents, keep a `StateDocReader` open instead.
+
+    Args:
+        state_file (str): Path to a plain or compressed MALLET state file
+        index_path (str): Path of its seek index, from `build_state_seek_index`
+        start (int): First document (row of doc-topic.txt)
+        stop (int | None): Document after the last one (default: start + 1)
+
+    Returns:
+        bytes: The decompressed token lines
+    """
+    with StateDocReader(state_file, index_path) as reader:
+        return reader.read(start, stop)
+
+
+def open_state_seekable(state_file: str, index: tuple[dict, dict[str, np.ndarray]]):
+    """Open a state file for reading at the decompressed offsets of its index.
+
+    Args:
+        state_file (str): Path to a plain or gzip MALLET state file
+        index (tuple[dict, dict[str, np.ndarray]]): Its seek index, from
+            `load_state_seek_index`
+
+    Returns:
+        io.BufferedReader | indexed_gzip.IndexedGzipFile: Seekable stream of
+            the decompressed state
+    """
+    header, arrays = index
+    with ExitStack() as stack:
+        if header["compression"] is None:
+            f = stack.enter_context(open(state_file, "rb"))
+        else:
+            backend = seek_backend()
+            if backend is None:
+                raise ValueError(
+                    "Reading a gzip state file through its seek index requires "
+                    "indexed_gzip (pip install indexed_gzip)"
+                )
+            f = stack.enter_context(backend.IndexedGzipFile(state_file))
+            f.import_index(fileobj=io.BytesIO(arrays["zran"].tobytes()))
+        # From here the caller closes the file
+        stack.pop_all()
+    return f
+
+
+def state_doc_ranges(
+    index: tuple[dict, dict[str, np.ndarray]], block_size: int | None = None
+) -> list[tuple[int, int]]:
+    """Split the documents of a seek index into ranges of about equal size.
+
+    Args:
+        index (tuple[dict, dict[str, np.ndarray]]): Seek index, from
+            `load_state_seek_index`
+        block_size (int | None): Approximate decompressed bytes per range
+            (default: STATE_BLOCK_SIZE)
+
+    Returns:
+        list[tuple[int, int]]: First and end document of each range, in file
+            order (see `state_byte_ranges`)
+    """
+    offsets = index[1]["docOffsets"]
+    targets = np.arange(
+        int(offsets[0]), int(offsets[-1]), block_size or STATE_BLOCK_SIZE
+    )
+    cuts = np.unique(np.r_[np.searchsorted(offsets, targets), len(offsets) - 1])
+    return list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+
+
+def state_byte_ranges(
+    index: tuple[dict, dict[str, np.ndarray]], doc_ranges: list[tuple[int, int]]
+) -> list[tuple[int, int]]:
+    """Convert ranges of documents to decompressed offsets in the state file.
+
+    Args:
+        index (tuple[dict, dict[str, np.ndarray]]): Seek index, from
+            `load_state_seek_index`
+        doc_ranges (list[tuple[int, int]]): First and end document of each
+            range
+
+    Returns:
+        list[tuple[int, int]]: Decompressed offsets of the start and end of
+            each range
+    """
+    offsets = index[1]["docOffsets"]
+    return [(int(offsets[first]), int(offsets[end])) for first, end in doc_ranges]
+
+
+WORD_INDEX_DIR = "word-docs"
+INDEX_SHARD_TOKENS = 1 << 18  # Max postings in a word-doc index shard of several words
+INDEX_BUFFER_POSTINGS = 1 << 22  # Postings buffered before spilling to shard runs
+POSTING_DTYPE = np.dtype(
+    [("word", "<u4"), ("doc", "<u4"), ("topic", "<u4"), ("count", "<u4")]
+)
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """Encode unsigned integers as LEB128 varints (7 bits per byte).
+
+    Args:
+        values (np.ndarray): Unsigned integers below 2**35
+
+    Returns:
+        np.ndarray: Encoded bytes (uint8)
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 35, 7):
+        lengths += values >= (1 << shift)
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max(initial=0))):
+        mask = lengths > k
+        low_bits = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        continues = (lengths[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[mask] + k] = low_bits | continues
+    return encoded
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Decode LEB128 varints written by `encode_varints`.
+
+    Args:
+        data (np.ndarray): Encoded bytes (uint8)
+
+    Returns:
+        np.ndarray: Decoded values (uint64)
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    is_last = data < 0x80
+    value_index = np.cumsum(is_last) - is_last
+    value_starts = np.flatnonzero(np.r_[True, is_last[:-1]])
+    shifts = (np.arange(len(data)) - value_starts[value_index]) * 7
+    parts = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    values = np.zeros(int(is_last.sum()), dtype=np.uint64)
+    np.add.at(values, value_index, parts)
+    return values
+
+
+def _encode_postings(postings: np.ndarray, previous_doc: int = 0):
+    """Delta/varint-encode postings sorted by word, doc and topic.
+
+    Each posting becomes three varints: the doc number minus the previous
+    doc number of the same word (0 for a further topic in the same doc), the
+    topic and the count.
+
+    Args:
+        postings (np.ndarray): Postings (POSTING_DTYPE) of consecutive words
+        previous_doc (int): Previous doc number of the first word, when its
+            postings continue an earlier chunk
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Encoded bytes, and the byte length of
+            each posting
+    """
+    words = postings["word"].astype(np.int64)
+    docs = postings["doc"].astype(np.int64)
+    previous = np.empty_like(docs)
+    previous[:1] = previous_doc
+    previous[1:] = docs[:-1]
+    previous[1:][words[1:] != words[:-1]] = 0
+    triples = np.column_stack([docs - previous, postings["topic"], postings["count"]])
+    encoded = encode_varints(triples.ravel())
+    # Every third varint ends a posting
+    posting_ends = (np.flatnonzero(encoded < 0x80) + 1)[2::3]
+    return encoded, np.diff(np.r_[0, posting_ends])
+
+
+def _aggregate_postings(docs, types, topics, word_ids: np.ndarray) -> np.ndarray:
+    """Count (word, doc, topic) postings for a run of whole documents."""
+    words = word_ids[types]
+    order = np.lexsort((topics, docs, words))
+    words, docs, topics = words[order], docs[order], topics[order]
+    starts = np.flatnonzero(
+        np.r_[
+            True,
+            (words[1:] != words[:-1])
+            | (docs[1:] != docs[:-1])
+            | (topics[1:] != topics[:-1]),
+        ]
+    )
+    postings = np.empty(len(starts), dtype=POSTING_DTYPE)
+    postings["word"] = words[starts]
+    postings["doc"] = docs[starts]
+    postings["topic"] = topics[starts]
+    postings["count"] = np.diff(np.r_[starts, len(words)])
+    return postings
+
+
+def _index_shards(frequencies: np.ndarray, shard_tokens: int) -> np.ndarray:
+    """Split word ids into contiguous shards of at most `shard_tokens` tokens.
+
+    A word with more tokens than that gets a shard of its own.
+
+    Returns:
+        np.ndarray: First word id of each shard
+    """
+    first_words = [0]
+    size = 0
+    for word, frequency in enumerate(frequencies.tolist()):
+        if size and size + frequency > shard_tokens:
+            first_words.append(word)
+            size = 0
+        size += frequency
+    return np.array(first_words, dtype=np.int64)
+
+
+def _write_index_shard(
+    filepath: str, run_path: str, first_word: int, num_words: int
+) -> None:
+    """Encode the spilled postings of one shard into its shard file."""
+    offsets = np.zeros(num_words + 1, dtype=np.int64)
+    num_postings = 0
+    if os.path.exists(run_path):
+        num_postings = os.path.getsize(run_path) // POSTING_DTYPE.itemsize
+
+    if num_words > 1 or num_postings <= INDEX_SHARD_TOKENS:
+        postings = np.fromfile(run_path, dtype=POSTING_DTYPE) if num_postings else None
+        if postings is not None:
+            # Spilled in doc order, so a stable sort by word keeps docs sorted
+            postings = postings[np.argsort(postings["word"], kind="stable")]
+            encoded, lengths = _encode_postings(postings)
+            np.add.at(offsets, postings["word"] - first_word + 1, lengths)
+            chunks = [encoded]
+        else:
+            chunks = []
+    else:
+        # A single word too large to hold: encode it in chunks, twice, to
+        # learn the encoded size before writing
+        def encoded_chunks():
+            previous_doc = 0
+            with open(run_path, "rb") as f:
+                while True:
+                    postings = np.fromfile(
+                        f, dtype=POSTING_DTYPE, count=INDEX_SHARD_TOKENS
+                    )
+                    if len(postings) == 0:
+                        return
+                    yield _encode_postings(postings, previous_doc)[0]
+                    previous_doc = int(postings["doc"][-1])
+
+        offsets[1] = sum(len(chunk) for chunk in encoded_chunks())
+        chunks = encoded_chunks()
+
+    np.cumsum(offsets, out=offsets)
+    total_bytes = int(offsets[-1])
+    if total_bytes > np.iinfo(np.uint32).max:
+        raise ValueError(f"Word-doc index shard too large: {filepath}")
+    write_binary_arrays(
+        filepath,
+        {"firstWord": first_word, "numWords": num_words, "numPostings": num_postings},
+        [
+            ("offsets", "uint32", num_words + 1, [offsets]),
+            ("postings", "uint8", total_bytes, chunks),
+        ],
+    )
+
+
+def write_word_doc_index(
+    state_file: str,
+    topic_word,
+    output_dir: str,
+    block_size: int | None = None,
+    buffer_postings: int | None = None,
+) -> list[str]:
+    """Build a sharded word-document inverted index from a state file.
+
+    Reads the state file again in one streaming pass and writes
+    `output_dir`/word-docs/. Words are numbered as in vocab.txt. For each
+    word the index holds its (doc, topic, count) postings, sorted by doc
+    and topic and delta/varint-encoded (see `_encode_postings`). Words are
+    split by id range into shard files of about INDEX_SHARD_TOKENS tokens,
+    listed in index.json, so looking up a word fetches one shard.
+
+    Postings are spilled to per-shard run files as they are counted, so
+    memory use is bounded by the block size, `buffer_postings` and the
+    shard size rather than by the size of the corpus.
+
+    Args:
+        state_file (str): Path to a plain, compressed or binary MALLET state
+            file, or "-" for standard input (see `iter_state_tokens`)
+        topic_word (np.ndarray | sparse.csr_matrix): Topic-word counts
+            (num_topics x vocab_size) from the same state file
+        output_dir (str): Directory to write the word-docs directory in
+        block_size (int | None): Bytes of decompressed state per block
+            (default: STATE_BLOCK_SIZE)
+        buffer_postings (int | None): Postings buffered in memory before
+            spilling (default: INDEX_BUFFER_POSTINGS)
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    buffer_postings = buffer_postings or INDEX_BUFFER_POSTINGS
+    order, frequencies = vocabulary_order(topic_word)
+    word_ids = np.empty(len(order), dtype=np.int64)
+    word_ids[order] = np.arange(len(order))
+    first_words = _index_shards(frequencies[order], INDEX_SHARD_TOKENS)
+
+    index_dir = os.path.join(output_dir, WORD_INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+
+    def run_path(shard):
+        return os.path.join(index_dir, f"shard-{shard:05d}.run")
+
+    buffered = []
+    num_buffered = 0
+
+    def spill():
+        if not buffered:
+            return
+        postings = np.concatenate(buffered)
+        shards = np.searchsorted(first_words, postings["word"], side="right") - 1
+        order = np.argsort(shards, kind="stable")
+        postings, shards = postings[order], shards[order]
+        bounds = np.flatnonzero(np.r_[True, shards[1:] != shards[:-1], True])
+        for start, end in pairwise(bounds.tolist()):
+            with open(run_path(int(shards[start])), "ab") as f:
+                postings[start:end].tofile(f)
+        buffered.clear()
+
+    empty = np.zeros(0, dtype=np.int64)
+    carry = (empty, empty, empty)  # Tokens of a document that may continue
+    next_doc = 0
+    for tokens in iter_state_tokens(state_file, block_size):
+        docs, types, topics = (
+            np.concatenate([held, new]) for held, new in zip(carry, tokens)
+        )
+        if len(docs) == 0:
+            continue
+        # Hold back the last document so no document spans two batches
+        new_doc = np.r_[True, docs[1:] != docs[:-1]]
+        cut = int(np.flatnonzero(new_doc)[-1])
+        carry = (docs[cut:], types[cut:], topics[cut:])
+        if cut == 0:
+            continue
+        runs = np.cumsum(new_doc[:cut]) - 1 + next_doc
+        next_doc = int(runs[-1]) + 1
+        postings = _aggregate_postings(runs, types[:cut], topics[:cut], word_ids)
+        buffered.append(postings)
+        num_buffered += len(postings)
+        if num_buffered >= buffer_postings:
+            spill()
+            num_buffered = 0
+    if len(carry[0]):
+        runs = np.full(len(carry[0]), next_doc, dtype=np.int64)
+        buffered.append(_aggregate_postings(runs, carry[1], carry[2], word_ids))
+    spill()
+
+    shard_files = []
+    bounds = np.r_[first_words, len(order)].tolist()
+    for shard, (first_word, end) in enumerate(pairwise(bounds)):
+        shard_file = f"shard-{shard:05d}.bin"
+        _write_index_shard(
+            os.path.join(index_dir, shard_file),
+            run_path(shard),
+            first_word,
+            end - first_word,
+        )
+        if os.path.exists(run_path(shard)):
+            os.remove(run_path(shard))
+        shard_files.append(shard_file)
+
+    manifest = {
+        "numWords": len(order),
+        "firstWords": first_words.tolist(),
+        "shards": shard_files,
+    }
+    with open(os.path.join(index_dir, "index.json"), "w") as f:
+        json.dump(manifest, f)
+    print(f"Wrote word-doc index with {len(shard_files)} shards")
+    return [os.path.join(index_dir, name) for name in [*shard_files, "index.json"]]
+
+
+def read_word_postings(output_dir: str, word_id: int) -> np.ndarray:
+    """Look up the postings of one word in a word-doc index.
+
+    Args:
+        output_dir (str): Directory containing the word-docs directory
+        word_id (int): Word id (line number in vocab.txt)
+
+    Returns:
+        np.ndarray: (doc, topic, count) rows, sorted by doc and topic
+    """
+    index_dir = os.path.join(output_dir, WORD_INDEX_DIR)
+    with open(os.path.join(index_dir, "index.json")) as f:
+        manifest = json.load(f)
+    shard = int(np.searchsorted(manifest["firstWords"], word_id, side="right")) - 1
+    header, arrays = read_binary_arrays(
+        os.path.join(index_dir, manifest["shards"][shard])
+    )
+    local = word_id - header["firstWord"]
+    start, end = arrays["offsets"][local : local + 2]
+    values = decode_varints(arrays["postings"][start:end]).astype(np.int64)
+    postings = values.reshape(-1, 3)
+    postings[:, 0] = np.cumsum(postings[:, 0])
+    return postings
 
-            doc_idx, source, pos, type_index, word, topic = parts
-            doc_idx = int(doc_idx)
-            type_index = int(type_index)
-            topic = int(topic)
-            max_topic = max(max_topic, topic)
 
-            # Handle document transition
-            if last_doc_idx != doc_idx:
-                if current_doc_counts:  # Save previous document
-                    doc_topic_counts.append(current_doc_counts)
-                current_doc_counts = defaultdict(int)
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+COMPRESSIBLE_SUFFIXES = (".txt", ".csv", ".json", ".bin")
+COMPRESS_CHUNK_SIZE = 1 << 20
 
-            # Update counts
-            current_doc_counts[topic] += 1
-            topic_word_counts[topic][type_index] += 1
-            # doc_lengths[doc_idx] += 1
 
-            # Update vocabulary
-            if type_index not in vocab:
-                vocab[type_index] = word
+def compress_file(filepath: str, encoding: str) -> str | None:
+    """Write a gzip or brotli compressed sibling of a file at maximum compression.
 
-            last_doc_idx = doc_idx
+    The sibling is `filepath` plus ".gz" or ".br". It is not written, and
+    any older sibling is removed, when compression does not make the file
+    smaller.
 
-        # Add the last document
-        if current_doc_counts:
-            doc_topic_counts.append(current_doc_counts)
+    Args:
+        filepath (str): Path of the file to compress
+        encoding (str): "gzip" or "br"
 
-    num_topics = max_topic + 1
-    num_docs = len(doc_topic_counts)
-    print(
-        f"Processed {line_count:,} tokens from {num_docs} documents with {num_topics} topics"
-    )
+    Returns:
+        str | None: Path of the sibling, or None if none was written
+    """
+    target = filepath + COMPRESSED_SUFFIXES[encoding]
+    temp_path = target + ".tmp"
+    with open(filepath, "rb") as src, open(temp_path, "wb") as dst:
+        if encoding == "gzip":
+            # mtime=0 so identical inputs give identical files
+            with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=9, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, COMPRESS_CHUNK_SIZE)
+        else:
+            compressor = brotli.Compressor(quality=11)
+            while chunk := src.read(COMPRESS_CHUNK_SIZE):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+    if os.path.getsize(temp_path) >= os.path.getsize(filepath):
+        os.remove(temp_path)
+        if os.path.exists(target):
+            os.remove(target)
+        return None
+    os.replace(temp_path, target)
+    return target
+
+
+def compressible_outputs(paths: list[str]) -> list[str]:
+    """Select the text, JSON and binary data files among written files."""
+    return sorted(path for path in paths if path.endswith(COMPRESSIBLE_SUFFIXES))
+
+
+def write_compressed_siblings(
+    paths: list[str], encodings=None, workers: int | None = None
+) -> list[str]:
+    """Write .gz and .br siblings of files in parallel.
+
+    server.py sends a sibling instead of the file to browsers that accept
+    its encoding (see `compress_file`).
+
+    Args:
+        paths (list[str]): Files to compress
+        encodings (Iterable[str] | None): Encodings to write, "gzip" and/or
+            "br" (default: both, or gzip only when brotli is not installed)
+        workers (int | None): Number of threads compressing files
+            (default: number of CPUs)
+
+    Returns:
+        list[str]: Paths of the siblings written
+    """
+    if encodings is None:
+        encodings = ("gzip", "br") if BROTLI_AVAILABLE else ("gzip",)
+    encodings = tuple(encodings)
+    if "br" in encodings and not BROTLI_AVAILABLE:
+        print("WARNING: brotli is not installed, skipping .br files")
+        print("To write them, install brotli with: pip install brotli")
+        encodings = tuple(e for e in encodings if e != "br")
+    # Largest files first, so the pool finishes together
+    jobs = [
+        (path, encoding)
+        for path in sorted(paths, key=os.path.getsize, reverse=True)
+        for encoding in encodings
+    ]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        written = pool.map(lambda job: compress_file(*job), jobs)
+        written = [path for path in written if path]
+    print(f"Wrote {len(written)} compressed files ({', '.join(encodings)})")
+    return written
+
+
+# --- Pipeline profiling ---
+
+PROFILE_FILENAME = "profile.json"
+CPROFILE_DIR = "profile"  # Per-stage cProfile statistics in the output directory
+
+
+def _cpu_seconds() -> float:
+    """Return the CPU time of this process and its finished child processes."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _peak_rss() -> int | None:
+    """Return the peak resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak resident memory of this process (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+class PipelineProfile:
+    """Wall time, CPU time and peak memory of the stages of a run.
+
+    Stages with the same name, such as the per-block steps of the reader,
+    add up into one record. Stages may nest, and the peak memory is only
+    reset (on Linux) when no other stage is running, so a nested stage
+    reports the peak since its outermost stage began. CPU time and memory
+    are those of the whole process, plus finished child processes for CPU
+    time, so stages running concurrently share them.
+
+    With a `cprofile_dir`, stages also run under cProfile and their
+    statistics are written to `<cprofile_dir>/<stage>.prof`. Only one
+    profiler can be active at a time, so stages nested in (or concurrent
+    with) a profiled stage are covered by its statistics instead.
+    """
+
+    def __init__(self, cprofile_dir: str | None = None):
+        self.cprofile_dir = cprofile_dir
+        self.stages = {}  # Stage name -> record, in the order stages began
+        self.tokens = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _record(self, name: str) -> dict:
+        return self.stages.setdefault(
+            name,
+            {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "peak_rss_bytes": None,
+                "cprofile": None,
+            },
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the body of a `with` block as the stage `name`."""
+        with self._lock:
+            if self._active == 0:
+                _reset_peak_rss()
+            self._active += 1
+            self._record(name)
+        profiler = None
+        if self.cprofile_dir is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # Another stage is being profiled
+                profiler = None
+        start, start_cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = _cpu_seconds() - start_cpu
+            peak = _peak_rss()
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                cprofile_path = os.path.join(self.cprofile_dir, f"{name}.prof")
+                profiler.dump_stats(cprofile_path)
+            with self._lock:
+                self._active -= 1
+                record = self._record(name)
+                record["calls"] += 1
+                record["wall_seconds"] += wall
+                record["cpu_seconds"] += cpu
+                if peak is not None:
+                    record["peak_rss_bytes"] = max(record["peak_rss_bytes"] or 0, peak)
+                if profiler is not None:
+                    record["cprofile"] = cprofile_path
+
+    def run(self, name: str, writer) -> tuple:
+        """Run a writer as the stage `name`.
+
+        Returns:
+            tuple: What the writer returned, and the stage records, for
+                merging into the parent's profile when the writer runs in a
+                separate process
+        """
+        with self.stage(name):
+            result = writer()
+        return result, self.stages
+
+    def merge(self, stages: dict) -> None:
+        """Add stage records from another profile."""
+        for name, other in stages.items():
+            with self._lock:
+                record = self._record(name)
+                for key in ("calls", "wall_seconds", "cpu_seconds"):
+                    record[key] += other[key]
+                if other["peak_rss_bytes"] is not None:
+                    record["peak_rss_bytes"] = max(
+                        record["peak_rss_bytes"] or 0, other["peak_rss_bytes"]
+                    )
+                record["cprofile"] = record["cprofile"] or other["cprofile"]
+
+    def report(self, **info) -> dict:
+        """Return the profile as a JSON-serializable report.
+
+        Args:
+            **info: Run settings to include in the report
+
+        Returns:
+            dict: Totals for the run and a list of stage records, each with
+                the tokens processed per second of its wall time
+        """
+        wall = time.perf_counter() - self._start
+        peaks = [r["peak_rss_bytes"] for r in self.stages.values()] + [_peak_rss()]
+        peaks = [peak for peak in peaks if peak is not None]
+        children_peak = None
+        if resource is not None:
+            children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            children_peak *= 1 if sys.platform == "darwin" else 1024
+
+        def per_second(seconds: float) -> float | None:
+            return self.tokens / seconds if self.tokens and seconds > 0 else None
+
+        return {
+            **info,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "tokens": self.tokens,
+            "wall_seconds": wall,
+            "cpu_seconds": _cpu_seconds() - self._start_cpu,
+            "tokens_per_second": per_second(wall),
+            "peak_rss_bytes": max(peaks, default=None),
+            "children_peak_rss_bytes": children_peak or None,
+            "stages": [
+                {
+                    "name": name,
+                    **record,
+                    "tokens_per_second": per_second(record["wall_seconds"]),
+                }
+                for name, record in self.stages.items()
+            ],
+        }
+
+    def write(self, filepath: str, **info) -> None:
+        """Write the report to a JSON file."""
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(self.report(**info), f, indent=2)
+        print(f"Wrote {os.path.basename(filepath)} with {len(self.stages)} stages")
+
+
+def profile_stage(profile: PipelineProfile | None, name: str):
+    """Return `profile.stage(name)`, or a no-op context without a profile."""
+    return nullcontext() if profile is None else profile.stage(name)
+
+
+def profile_iter(profile: PipelineProfile | None, name: str, iterable):
+    """Yield from `iterable`, timing each step as the stage `name`."""
+    if profile is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with profile.stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def run_writers(jobs: list, writers: int = 1) -> list:
+    """Run output writers, concurrently when `writers` > 1.
+
+    Jobs are (writer, in_process) pairs, where each writer is a callable
+    taking no arguments (a `functools.partial` of a write function). With
+    one writer they run in order. Otherwise writers marked `in_process`,
+    which are CPU-bound, each run in a spawned process of their own, and the
+    rest share `writers` threads, overlapping their formatting, compression
+    and file I/O. Errors are re-raised once all writers have finished.
+
+    Args:
+        jobs (list[tuple[Callable, bool]]): Writers, and whether each runs in
+            a separate process
+        writers (int): Number of threads running writers
+
+    Returns:
+        list: What each writer returned, in job order
+    """
+    if writers <= 1:
+        return [writer() for writer, _ in jobs]
+
+    num_processes = max(1, sum(in_process for _, in_process in jobs))
+    # Forking once the writer threads are running could copy a lock they hold
+    context = multiprocessing.get_context("spawn")
+    with (
+        ProcessPoolExecutor(max_workers=num_processes, mp_context=context) as processes,
+        ThreadPoolExecutor(max_workers=writers) as threads,
+    ):
+        futures = [
+            (processes if in_process else threads).submit(writer)
+            for writer, in_process in jobs
+        ]
+    return [future.result() for future in futures]
+
+
+def _write_doc_topics_zip_from_counts(
+    doc_topic_counts,
+    output_dir: str,
+    chunk_rows: int | None = None,
+    compresslevel: int = DT_ZIP_LEVEL,
+) -> list[str]:
+    """Build the sparse doc-topic matrix from the counts and write dt.zip.
+
+    Memory-mapped counts get memory-mapped sparse arrays, next to their file.
+    """
+    if not isinstance(doc_topic_counts, np.memmap):
+        sparse_matrix = doc_topic_csc(doc_topic_counts, chunk_rows)
+        return write_doc_topics_zip(sparse_matrix, output_dir, compresslevel)
+
+    spill_path = f"{doc_topic_counts.filename}.csc"
+    try:
+        sparse_matrix = doc_topic_csc(doc_topic_counts, chunk_rows, spill_path)
+        return write_doc_topics_zip(sparse_matrix, output_dir, compresslevel)
+    finally:
+        sparse_matrix = None
+        for path in (spill_path + ".i", spill_path + ".x"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_browser_files(
+    counts: StateCounts,
+    output_dir: str = ".",
+    n_top_words: int = 30,
+    generate_all: bool = False,
+    full_jsd: bool = False,
+    threads: int = 1,
+    layout: str = "smacof",
+    mds_jobs: int | None = None,
+    previous_coords: str | None = None,
+    topic_alignment: dict[int, int] | None = None,
+    chunk_rows: int | None = None,
+    doc_topic_binary: str | None = None,
+    top_docs: int = TOP_DOCS,
+    facets=FACET_FIELDS,
+    writers: int = 1,
+    zip_level: int = DT_ZIP_LEVEL,
+    profile: PipelineProfile | None = None,
+) -> list[str]:
+    """Write the dfr-browser files for aggregated state counts.
+
+    Args:
+        counts (StateCounts): Aggregated counts from a state file
+        output_dir (str): Directory to write output files
+        n_top_words (int): Number of top words per topic to save
+        generate_all (bool): Whether to generate additional files beyond core requirements
+        full_jsd (bool): Whether topic coordinates use the full smoothed
+            topic-word distributions rather than the top 15 words
+        threads (int): Number of threads computing topic distances
+        layout (str): Topic layout engine: "smacof" or "classical"
+        mds_jobs (int | None): Number of SMACOF initializations run in parallel
+        previous_coords (str | None): Previous topic_coords.csv to warm-start
+            the topic layout from
+        topic_alignment (dict[int, int] | None): Mapping of topic numbers to
+            topic numbers in `previous_coords` (default: identity)
+        chunk_rows (int | None): Number of documents normalized and formatted
+            at a time (default: CHUNK_ROWS)
+        doc_topic_binary (str | None): Also write doc-topic.bin with this
+            value encoding ("float32" or "uint16")
+        top_docs (int): Documents ranked per topic in topic-docs/
+            (0 skips them)
+        facets (Iterable[str]): Metadata fields to aggregate topics by in
+            facets/ (see `facet_buckets`)
+        writers (int): Number of threads writing files concurrently; the
+            topic layout then runs in a separate process (see `run_writers`)
+        zip_level (int): DEFLATE level of dt.zip
+        profile (PipelineProfile | None): Profile recording the "top_words"
+            stage and a stage for each writer
+
+    Returns:
+        list[str]: Paths of the files written
+    """
+    num_topics = counts.num_topics
+    num_docs = counts.num_docs
 
     # Create output directory if needed
     os.makedirs(output_dir, exist_ok=True)
 
     # Generate topic words data
-    topic_words = []
-    for t in range(num_topics):
-        word_counts = [topic_word_counts[t][i] for i in range(len(vocab))]
-        topic_words.append(get_top_words_and_weights(word_counts, vocab, n_top_words))
+    with profile_stage(profile, "top_words"):
+        topic_words = [
+            get_top_words_and_weights(
+                counts.topic_word_counts(t), counts.vocab, n_top_words
+            )
+            for t in range(num_topics)
+        ]
+
+    # Facets read metadata.csv, so it is written before the other files
+    with profile_stage(profile, "write_basic_metadata_csv"):
+        paths = write_basic_metadata_csv(num_docs, output_dir)
 
-    # Generate normalized proportions for dfr-browser
-    doc_proportions = normalize_doc_topic_proportions(doc_topic_counts)
+    # The layout may run in a process of its own, so it records its stages
+    # in a profile of its own that is merged back afterwards
+    layout_profile = None
+    if profile is not None:
+        layout_profile = PipelineProfile(profile.cprofile_dir)
+
+    # Write core dfr-browser files (always generated). Each job is a writer
+    # and whether it runs in a process of its own when writing concurrently.
+    jobs = [
+        (partial(write_topic_keys_txt, topic_words, output_dir), False),
+        (
+            partial(
+                write_doc_topic_txt,
+                iter_doc_proportions(counts.doc_topic, chunk_rows),
+                output_dir,
+            ),
+            False,
+        ),
+    ]
+    if doc_topic_binary:
+        jobs.append(
+            (
+                partial(
+                    write_doc_topic_bin,
+                    iter_doc_proportions(counts.doc_topic, chunk_rows),
+                    num_docs,
+                    num_topics,
+                    output_dir,
+                    dtype=doc_topic_binary,
+                ),
+                False,
+            )
+        )
+    jobs.append(
+        (
+            partial(
+                write_topic_coords_csv,
+                topic_words,
+                output_dir,
+                top_n=15,
+                topic_word=counts.topic_word if full_jsd else None,
+                beta=float(counts.beta),
+                n_jobs=threads,
+                layout=layout,
+                mds_jobs=mds_jobs,
+                previous_coords=previous_coords,
+                topic_alignment=topic_alignment,
+                profile=layout_profile,
+            ),
+            True,
+        )
+    )
 
-    # Write core dfr-browser files (always generated)
-    write_topic_keys_txt(topic_words, output_dir)
-    write_doc_topic_txt(doc_proportions, output_dir)
-    write_topic_coords_csv(topic_words, output_dir, top_n=15)
-    write_basic_metadata_csv(num_docs, output_dir)
+    # Compact per-document counts, so the browser need not read the state file
+    jobs += [
+        (
+            partial(write_doc_lengths_bin, counts.doc_topic, output_dir, chunk_rows),
+            False,
+        ),
+        (
+            partial(
+                write_doc_topic_counts_bin, counts.doc_topic, output_dir, chunk_rows
+            ),
+            False,
+        ),
+        (
+            partial(write_word_topics, counts.topic_word, counts.vocab, output_dir),
+            False,
+        ),
+    ]
+    if top_docs:
+        jobs.append(
+            (
+                partial(
+                    write_topic_docs, counts.doc_topic, output_dir, top_docs, chunk_rows
+                ),
+                False,
+            )
+        )
+    if facets:
+        jobs.append(
+            (
+                partial(
+                    write_metadata_facets,
+                    counts.doc_topic,
+                    os.path.join(output_dir, "metadata.csv"),
+                    output_dir,
+                    facets,
+                    chunk_rows,
+                    counts.sampled_docs,
+                ),
+                False,
+            )
+        )
 
     # Write additional files if requested with --all flag
     if generate_all:
-        write_doc_topic_counts_csv(doc_topic_counts, num_topics, output_dir)
-        write_topic_words_json(alpha, topic_words, output_dir)
-
-        # Generate sparse matrix for dt.zip
-        dense_doc_topic = [
-            [doc_topic_counts[d].get(t, 0) for d in range(num_docs)]
-            for t in range(num_topics)
+        jobs += [
+            (
+                partial(
+                    write_doc_topic_counts_csv,
+                    counts.doc_topic,
+                    num_topics,
+                    output_dir,
+                    chunk_rows=chunk_rows,
+                ),
+                False,
+            ),
+            (
+                partial(write_topic_words_json, counts.alpha, topic_words, output_dir),
+                False,
+            ),
+            # Generate sparse matrix for dt.zip
+            (
+                partial(
+                    _write_doc_topics_zip_from_counts,
+                    counts.doc_topic,
+                    output_dir,
+                    chunk_rows,
+                    zip_level,
+                ),
+                False,
+            ),
         ]
-        sparse_matrix = sparse_doc_topic_matrix(dense_doc_topic)
-        write_doc_topics_zip(sparse_matrix, output_dir)
+
+    if profile is None:
+        for written in run_writers(jobs, writers):
+            paths += written
+        return paths
+    # Each writer is a stage named after its write function
+    jobs = [
+        (
+            partial(
+                (layout_profile if in_process else profile).run,
+                writer.func.__name__.lstrip("_"),
+                writer,
+            ),
+            in_process,
+        )
+        for writer, in_process in jobs
+    ]
+    for (_, in_process), (written, stages) in zip(jobs, run_writers(jobs, writers)):
+        paths += written
+        if in_process:
+            profile.merge(stages)
+    return paths
+
+
+def process_mallet_state_file(
+    state_file: str,
+    output_dir: str = ".",
+    n_top_words: int = 30,
+    generate_all: bool = False,
+    engine: str = "python",
+    workers: int = 1,
+    full_jsd: bool = False,
+    threads: int = 1,
+    layout: str = "smacof",
+    mds_jobs: int | None = None,
+    previous_coords: str | None = None,
+    topic_alignment: dict[int, int] | None = None,
+    cache: bool = False,
+    max_memory: int | None = None,
+    doc_topic_binary: str | None = None,
+    word_index: bool = False,
+    top_docs: int = TOP_DOCS,
+    facets=FACET_FIELDS,
+    compress: bool = False,
+    writers: int = 1,
+    zip_level: int = DT_ZIP_LEVEL,
+    profile: bool = False,
+    cprofile: bool = False,
+    seek_index: bool = False,
+    sample: float | int | None = None,  # noqa: PYI041 - an int is a number of documents
+    config_file: str | None = None,
+) -> None:
+    """
+    Process MALLET topic-state file and generate dfr-browser files.
+
+    Args:
+        state_file (str): Path to a MALLET topic-state file, plain,
+            compressed with gzip, bz2, xz or zstd, or converted with
+            `write_binary_state`, or "-" to read standard input
+        output_dir (str): Directory to write output files
+        n_top_words (int): Number of top words per topic to save
+        generate_all (bool): Whether to generate additional files beyond core requirements
+        engine (str): State parser to use: "python" reads line by line, "numpy"
+            parses large blocks in bulk. Both produce identical output files.
+        workers (int): Number of processes parsing blocks in parallel
+            (numpy engine only). Output is identical to a single process.
+        full_jsd (bool): Whether topic coordinates use the full smoothed
+            topic-word distributions rather than the top 15 words
+        threads (int): Number of threads computing topic distances
+        layout (str): Topic layout engine: "smacof" (iterative, sklearn) or
+            "classical" (one eigen-decomposition, no sklearn needed)
+        mds_jobs (int | None): Number of SMACOF initializations run in parallel
+        previous_coords (str | None): topic_coords.csv of a previous model
+            version; the layout starts from it (one SMACOF run) and is rotated
+            onto it, so topics keep their places
+        topic_alignment (dict[int, int] | None): Mapping of topic numbers to
+            topic numbers in `previous_coords` (default: identity)
+        cache (bool): Whether to keep the aggregated counts in
+            `output_dir`/state-counts.npz (and state-counts-doc-topic.npy)
+            and reuse them on later runs with the same state file
+        max_memory (int | None): Memory budget in bytes. When set, doc-topic
+            counts are kept in a memory-mapped file in `output_dir` and
+            parse blocks and output rows are sized to fit the budget
+            (numpy engine or binary state only)
+        doc_topic_binary (str | None): Also write doc-topic.bin, a binary
+            proportion matrix the browser loads without parsing, encoded as
+            "float32" or "uint16" fixed point
+        word_index (bool): Whether to build the word-document inverted index
+            in `output_dir`/word-docs (reads the state file a second time)
+        top_docs (int): Documents ranked per topic in `output_dir`/topic-docs
+            (0 skips them)
+        facets (Iterable[str]): Metadata fields to aggregate topics by in
+            `output_dir`/facets, such as "year", "journal" or "date:month"
+        compress (bool): Whether to write .gz and .br siblings of the data
+            files in `output_dir` for server.py to send to browsers
+        writers (int): Number of threads writing output files concurrently,
+            with the topic layout in a separate process. With `max_memory`,
+            each writer formats proportionally fewer documents at a time.
+        zip_level (int): DEFLATE level of dt.zip, from 0 (fastest) to 9
+            (smallest)
+        profile (bool): Whether to write `output_dir`/profile.json with the
+            wall time, CPU time, tokens per second and peak memory of each
+            stage (see `PipelineProfile`)
+        cprofile (bool): Whether to also write cProfile statistics of each
+            stage to `output_dir`/profile/ (implies `profile`)
+        seek_index (bool): Whether to write `output_dir`/state-seek.bin, from
+            which `read_state_docs` reads single documents of the state file
+            (see `build_state_seek_index`). It is built before the counts are
+            read, with a pass of its own, so that `workers` can each read
+            their own documents through it, and rebuilt only when the state
+            file changes. Needs a plain state file, or gzip with indexed_gzip;
+            a binary state needs none.
+        sample (float | int | None): Read only a fraction of the state (float)
+            or the first documents (int) for an approximate preview (see
+            `read_state_sample`). A fraction seeks to its documents through
+            a current `output_dir`/state-seek.bin, or in a binary state. No
+            seek index is written.
+        config_file (str | None): The browser's config.json, which is marked
+            as approximate for a sample and unmarked otherwise (default:
+            the site's config.json, from `find_browser_config`)
+    """
+    if engine not in PARSE_ENGINES:
+        raise ValueError(f"Unknown parse engine: {engine!r}")
+    if layout not in LAYOUT_ENGINES:
+        raise ValueError(f"Unknown layout engine: {layout!r}")
+    if state_file == STDIN_STATE_FILE and (cache or word_index or seek_index):
+        # All need the state file again after it has been read
+        raise ValueError(
+            "cache, word_index and seek_index need a state file, not standard input"
+        )
+    if sample is not None and (cache or word_index):
+        # Both would hold or index the whole state file
+        raise ValueError("sample cannot be combined with cache or word_index")
+
+    print(f"Processing MALLET state file: {state_file}")
+    print(f"Output directory: {output_dir}")
+
+    # A binary state needs no seek index to read single documents, and a
+    # sample should not read the whole state file for one
+    index_path = None
+    if seek_index and sample is None and not is_binary_state(state_file):
+        # Fail before the long read rather than after it
+        check_state_seekable(state_file)
+        index_path = os.path.join(output_dir, SEEK_INDEX_FILENAME)
+
+    stages = None
+    if profile or cprofile:
+        stages = PipelineProfile(
+            os.path.join(output_dir, CPROFILE_DIR) if cprofile else None
+        )
+
+    doc_topic_path = block_size = None
+    if max_memory is not None:
+        if engine != "numpy" and sample is None and not is_binary_state(state_file):
+            raise ValueError("max_memory requires the numpy engine")
+        os.makedirs(output_dir, exist_ok=True)
+        doc_topic_path = os.path.join(output_dir, DOC_TOPIC_SPILL_FILENAME)
+        block_size = memory_block_size(max_memory, workers)
+
+    try:
+        # Process the state file, or reuse the counts cached by an earlier run
+        cache_path = os.path.join(output_dir, CACHE_FILENAME)
+        counts = approximate = None
+        if index_path is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            with profile_stage(stages, "seek_index"):
+                if load_state_seek_index(index_path, state_file) is None:
+                    build_state_seek_index(state_file, index_path)
+        if cache:
+            with profile_stage(stages, "load_cache"):
+                counts = load_state_counts(
+                    cache_path, state_file, mmap=max_memory is not None
+                )
+        if sample is not None:
+            with profile_stage(stages, "read"):
+                counts, approximate = read_state_sample(
+                    state_file,
+                    sample,
+                    workers,
+                    doc_topic_path,
+                    block_size,
+                    stages,
+                    seek_index=os.path.join(output_dir, SEEK_INDEX_FILENAME),
+                )
+        elif counts is None:
+            with profile_stage(stages, "read"):
+                counts = read_state_counts(
+                    state_file,
+                    engine,
+                    workers,
+                    doc_topic_path,
+                    block_size,
+                    stages,
+                    seek_index=index_path,
+                )
+            if cache:
+                os.makedirs(output_dir, exist_ok=True)
+                with profile_stage(stages, "save_cache"):
+                    save_state_counts(counts, cache_path, state_fingerprint(state_file))
+        if stages is not None:
+            stages.tokens = counts.line_count
+        print(
+            f"Processed {counts.line_count:,} tokens from {counts.num_docs} documents "
+            f"with {counts.num_topics} topics"
+        )
+
+        chunk_rows = None
+        if max_memory is not None:
+            chunk_rows = max(
+                1, max_memory // (DOC_CELL_MEMORY * counts.num_topics * max(1, writers))
+            )
+        outputs = write_browser_files(
+            counts,
+            output_dir,
+            n_top_words,
+            generate_all,
+            full_jsd=full_jsd,
+            threads=threads,
+            layout=layout,
+            mds_jobs=mds_jobs,
+            previous_coords=previous_coords,
+            topic_alignment=topic_alignment,
+            chunk_rows=chunk_rows,
+            doc_topic_binary=doc_topic_binary,
+            top_docs=top_docs,
+            facets=facets,
+            writers=writers,
+            zip_level=zip_level,
+            profile=stages,
+        )
+        if word_index:
+            with profile_stage(stages, "word_index"):
+                outputs += write_word_doc_index(
+                    state_file,
+                    counts.topic_word,
+                    output_dir,
+                    block_size=block_size,
+                    buffer_postings=max_memory // 64 if max_memory else None,
+                )
+        if compress:
+            with profile_stage(stages, "compress"):
+                write_compressed_siblings(compressible_outputs(outputs))
+        mark_config_approximate(
+            config_file or find_browser_config(output_dir), approximate
+        )
+    finally:
+        if doc_topic_path is not None and os.path.exists(doc_topic_path):
+            os.remove(doc_topic_path)
+
+    if stages is not None:
+        stages.write(
+            os.path.join(output_dir, PROFILE_FILENAME),
+            state_file=state_file,
+            engine=engine,
+            workers=workers,
+            writers=writers,
+            max_memory=max_memory,
+            sample=sample,
+            cached=bool(cache) and "read" not in stages.stages,
+        )
+
+    print("\n✅ All files generated successfully!")
+    print(f"Your dfr-browser data is ready in: {output_dir}")
+
+
+def process_partial_counts(
+    partial_files: list[str],
+    output_dir: str = ".",
+    n_top_words: int = 30,
+    generate_all: bool = False,
+    compress: bool = False,
+    **writer_options,
+) -> None:
+    """Merge partial aggregates of state shards and write dfr-browser files.
+
+    This is the reduce step of processing a state file split by documents:
+    each shard is read into a partial file with `save_partial_counts` (the
+    map step, `--partial` on the command line), on whichever machine holds
+    it, and the partials are merged here (see `merge_state_counts`). The
+    files are the same as for the whole state file, except state-seek.bin
+    and word-docs/, which need the state file.
+
+    Args:
+        partial_files (list[str]): Paths of partial files
+        output_dir (str): Directory to write output files
+        n_top_words (int): Number of top words per topic to save
+        generate_all (bool): Whether to generate additional files beyond core requirements
+        compress (bool): Whether to write .gz and .br siblings of the data
+            files in `output_dir` for server.py to send to browsers
+        **writer_options: Further options of `write_browser_files`, such as
+            `layout`, `writers` or `top_docs`
+    """
+    print(f"Merging {len(partial_files)} partial counts")
+    print(f"Output directory: {output_dir}")
+    counts = merge_partial_counts(partial_files)
+    if not counts.alpha:
+        raise ValueError("None of the partial counts has the state file header")
+    print(
+        f"Merged {counts.line_count:,} tokens from {counts.num_docs} documents "
+        f"with {counts.num_topics} topics"
+    )
+    outputs = write_browser_files(
+        counts, output_dir, n_top_words, generate_all, **writer_options
+    )
+    if compress:
+        write_compressed_siblings(compressible_outputs(outputs))
 
     print("\n✅ All files generated successfully!")
     print(f"Your dfr-browser data is ready in: {output_dir}")
 
 
+def _reject_options(
+    parser: argparse.ArgumentParser, args: argparse.Namespace, mode: str, options
+) -> None:
+    """Exit with a usage error if any of `options` was given with `mode`."""
+    given = [
+        option
+        for option in options
+        if getattr(args, option[2:].replace("-", "_"))
+        != parser.get_default(option[2:].replace("-", "_"))
+    ]
+    if given:
+        parser.error(f"{', '.join(given)} cannot be combined with {mode}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Process MALLET topic-state file for dfr-browser",
@@ -452,6 +5177,27 @@ Examples:
   %(prog)s topic-state.gz -o sample_data    # Generate core files in sample_data/ directory
   %(prog)s topic-state.gz --all             # Generate all files including advanced features
   %(prog)s topic-state.gz --top-words 50    # Include 50 top words per topic (default: 30)
+  %(prog)s topic-state.gz --engine numpy    # Parse the state file in bulk with NumPy
+  %(prog)s topic-state.gz --workers 8       # Parse with 8 processes (numpy engine)
+  %(prog)s topic-state.gz --layout classical  # Fast classical MDS topic layout
+  %(prog)s topic-state.gz --previous-coords old/topic_coords.csv  # Stable layout
+  %(prog)s topic-state.gz --cache           # Reuse counts on later runs
+  %(prog)s topic-state.gz --max-memory 2G   # Keep doc-topic counts on disk
+  %(prog)s topic-state.gz --doc-topic-binary float32  # Also write doc-topic.bin
+  %(prog)s topic-state.gz --word-index      # Which documents use each word
+  %(prog)s topic-state.gz --facets year,journal,date:month  # Topics by metadata
+  %(prog)s topic-state.gz --compress        # Also write .gz and .br files
+  %(prog)s topic-state.gz --all --writers 4 # Write output files concurrently
+  %(prog)s topic-state.gz --profile         # Time each stage in profile.json
+  %(prog)s topic-state.gz --seek-index --workers 8  # Each worker reads its own documents
+  zcat topic-state.gz | %(prog)s -          # Read the state from standard input
+  %(prog)s topic-state.gz --binary-state topic-state.bin  # Convert, then process
+  %(prog)s topic-state.bin                  # Process a binary state
+  %(prog)s topic-state.bin --sample 0.05    # Preview from 5%% of the documents
+  %(prog)s topic-state.gz --sample 1000     # Quick preview of the first 1000 documents
+  %(prog)s shard-1.gz --partial shard-1.npz # Map: partial counts of a state shard
+  %(prog)s --merge shard-*.npz -o out       # Reduce: merge partials, write files
+  %(prog)s --merge a.npz b.npz --partial ab.npz  # Merge partials into a partial
 
 Generated files:
   Core files (always created):
@@ -459,16 +5205,33 @@ Generated files:
     - doc-topic.txt       (document-topic proportions)
     - topic_coords.csv    (2D topic coordinates for browser)
     - metadata.csv        (basic metadata if missing)
+    - doc-lengths.bin     (tokens per document)
+    - doc-topic-counts.bin (sparse raw topic counts per document)
+    - vocab.txt           (words by corpus frequency)
+    - word-topics.bin     (sparse topic counts per word)
+    - topic-docs/         (top documents of each topic)
+    - facets/             (topic totals by metadata field, see --facets)
+    - doc-topic.bin       (binary proportions, with --doc-topic-binary)
+    - word-docs/          (word-document index, with --word-index)
+    - state-seek.bin      (document offsets in the state file, with --seek-index)
 
   Additional files (with --all flag):
     - doc-topic-counts.csv (raw topic counts per document)
     - tw.json             (topic-words JSON for advanced features)
     - dt.zip              (sparse doc-topic matrix)
+
+  With --compress, .txt, .csv, .json and .bin files also get .gz and .br
+  siblings at maximum compression.
+
+  With --profile, profile.json reports the time and memory of each stage,
+  and with --cprofile, profile/ holds cProfile statistics of each stage.
         """,
     )
 
     parser.add_argument(
-        "statefile", help="Path to MALLET topic-state file (gzipped or plain)"
+        "statefile",
+        nargs="?",
+        help="Path to MALLET topic-state file (plain, .gz, .bz2, .xz, .zst or binary), or - to read standard input",
     )
     parser.add_argument(
         "-o",
@@ -487,13 +5250,323 @@ Generated files:
         action="store_true",
         help="Generate all files including advanced features (default: core files only)",
     )
+    parser.add_argument(
+        "--engine",
+        choices=PARSE_ENGINES,
+        default=None,
+        help="State file parser: 'python' reads line by line, 'numpy' parses large blocks in bulk (default: python, or numpy with --workers)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes parsing the state file in parallel (default: 1)",
+    )
+
+    parser.add_argument(
+        "--full-jsd",
+        action="store_true",
+        help="Compute topic coordinates from the full smoothed topic-word distributions instead of the top 15 words",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads computing topic distances (default: 1)",
+    )
+
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUT_ENGINES,
+        default="smacof",
+        help="Topic layout engine: 'smacof' (iterative MDS) or 'classical' (fast classical MDS) (default: smacof)",
+    )
+    parser.add_argument(
+        "--mds-jobs",
+        type=int,
+        default=None,
+        help="Number of SMACOF initializations run in parallel (default: 1)",
+    )
+
+    parser.add_argument(
+        "--previous-coords",
+        default=None,
+        help="topic_coords.csv of a previous model version to warm-start the topic layout from",
+    )
+    parser.add_argument(
+        "--topic-alignment",
+        default=None,
+        help="CSV with 'topic' and 'previous_topic' columns matching topics to --previous-coords (default: same topic numbers)",
+    )
+
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache the aggregated counts in the output directory (state-counts.npz) and reuse them while the state file is unchanged",
+    )
+
+    parser.add_argument(
+        "--max-memory",
+        type=parse_memory_size,
+        default=None,
+        help="Memory budget such as 512M or 4G; keeps doc-topic counts in a memory-mapped file and writes documents in chunks (numpy engine)",
+    )
+
+    parser.add_argument(
+        "--doc-topic-binary",
+        choices=DOC_TOPIC_BINARY_FORMATS,
+        default=None,
+        help="Also write doc-topic.bin, a binary proportion matrix the browser loads without parsing, as float32 or uint16 fixed point",
+    )
+
+    parser.add_argument(
+        "--word-index",
+        action="store_true",
+        help="Build a sharded word-document inverted index in word-docs/ (reads the state file a second time)",
+    )
+
+    parser.add_argument(
+        "--topic-docs",
+        type=int,
+        default=TOP_DOCS,
+        metavar="N",
+        help=f"Number of top documents stored per topic in topic-docs/, 0 to skip (default: {TOP_DOCS})",
+    )
+
+    parser.add_argument(
+        "--facets",
+        type=lambda value: tuple(field for field in value.split(",") if field),
+        default=FACET_FIELDS,
+        metavar="FIELDS",
+        help='Comma-separated metadata fields to aggregate topics by in facets/; "column:year" or "column:month" buckets a date column (default: year)',
+    )
+
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Also write .gz and .br (with brotli installed) siblings of the data files for server.py",
+    )
+
+    parser.add_argument(
+        "--writers",
+        type=int,
+        default=1,
+        help="Number of threads writing output files concurrently, with the topic layout in its own process (default: 1)",
+    )
+
+    parser.add_argument(
+        "--zip-level",
+        type=int,
+        choices=range(10),
+        default=DT_ZIP_LEVEL,
+        metavar="{0-9}",
+        help=f"DEFLATE compression level of dt.zip (default: {DT_ZIP_LEVEL})",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write profile.json with the wall time, CPU time, tokens/sec and peak memory of each stage",
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="Also write cProfile statistics of each stage to profile/ (implies --profile)",
+    )
+
+    parser.add_argument(
+        "--binary-state",
+        default=None,
+        metavar="PATH",
+        help="Convert the state file to the compact binary state format at PATH and process that; later runs can read PATH directly",
+    )
+
+    parser.add_argument(
+        "--seek-index",
+        action="store_true",
+        help="Write state-seek.bin, the index for reading single documents of the state file; with --workers, each worker then reads its own documents (plain state files, or gzip with indexed_gzip installed)",
+    )
+
+    parser.add_argument(
+        "--sample",
+        type=parse_sample,
+        default=None,
+        metavar="SIZE",
+        help="Approximate preview: read a fraction of the state such as 0.05 or 5%%, or only the first SIZE documents such as 1000, and mark config.json as approximate. A fraction seeks to its documents in a binary state or through a current state-seek.bin; otherwise it samples the tokens of every document and still decompresses the whole file",
+    )
+    parser.add_argument(
+        "--config",
+        default=None,
+        metavar="PATH",
+        help="The browser's config.json to mark as approximate with --sample, and unmark otherwise (default: config.json at the root of the site holding the output directory, next to index.html)",
+    )
+
+    parser.add_argument(
+        "--partial",
+        default=None,
+        metavar="PATH",
+        help="Write the counts of the state file (a shard of documents) or of the --merge partials to the partial file PATH instead of writing dfr-browser files",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        default=None,
+        metavar="PARTIAL",
+        help="Merge partial files written with --partial instead of reading a state file, and write dfr-browser files (or a partial file with --partial)",
+    )
 
     args = parser.parse_args()
 
-    if not os.path.exists(args.statefile):
+    if args.merge is not None:
+        if args.statefile is not None:
+            parser.error("--merge takes partial files instead of a state file")
+        # Options of reading a state file
+        _reject_options(
+            parser,
+            args,
+            "--merge",
+            [
+                "--engine",
+                "--workers",
+                "--cache",
+                "--max-memory",
+                "--word-index",
+                "--seek-index",
+                "--profile",
+                "--cprofile",
+                "--binary-state",
+                "--sample",
+                "--config",
+            ],
+        )
+        missing = [path for path in args.merge if not os.path.exists(path)]
+        if missing:
+            print(f"Error: Partial file not found: {missing[0]}")
+            sys.exit(1)
+        if args.partial is not None:
+            merge_partial_counts(args.merge, args.partial)
+        else:
+            process_partial_counts(
+                args.merge,
+                args.output_dir,
+                args.top_words,
+                generate_all=args.all,
+                compress=args.compress,
+                full_jsd=args.full_jsd,
+                threads=args.threads,
+                layout=args.layout,
+                mds_jobs=args.mds_jobs,
+                previous_coords=args.previous_coords,
+                topic_alignment=(
+                    read_topic_alignment(args.topic_alignment)
+                    if args.topic_alignment
+                    else None
+                ),
+                doc_topic_binary=args.doc_topic_binary,
+                top_docs=args.topic_docs,
+                facets=args.facets,
+                writers=args.writers,
+                zip_level=args.zip_level,
+            )
+        sys.exit(0)
+    if args.statefile is None:
+        parser.error("the following arguments are required: statefile")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.engine is None:
+        use_numpy = args.workers > 1 or args.max_memory is not None
+        args.engine = "numpy" if use_numpy else "python"
+    elif args.engine == "python" and args.workers > 1:
+        parser.error("--workers requires the numpy engine")
+    elif args.engine == "python" and args.max_memory is not None:
+        parser.error("--max-memory requires the numpy engine")
+    if (
+        args.statefile == STDIN_STATE_FILE
+        and args.binary_state is None
+        and (args.cache or args.word_index or args.seek_index)
+    ):
+        parser.error(
+            "--cache, --word-index and --seek-index need a state file, "
+            "not standard input"
+        )
+    if args.sample is not None and (args.cache or args.word_index):
+        parser.error("--sample cannot be combined with --cache or --word-index")
+    if args.partial is not None:
+        # Partials hold exact counts, and no browser files are written
+        _reject_options(
+            parser,
+            args,
+            "--partial",
+            [
+                "--sample",
+                "--cache",
+                "--word-index",
+                "--seek-index",
+                "--profile",
+                "--cprofile",
+                "--config",
+            ],
+        )
+
+    if args.statefile != STDIN_STATE_FILE and not os.path.exists(args.statefile):
         print(f"Error: State file not found: {args.statefile}")
         exit(1)
 
+    if args.binary_state is not None:
+        if is_binary_state(args.statefile):
+            parser.error("--binary-state needs a text state file")
+        write_binary_state(args.statefile, args.binary_state)
+        args.statefile = args.binary_state
+
+    if args.partial is not None:
+        doc_topic_path = block_size = None
+        if args.max_memory is not None:
+            doc_topic_path = args.partial + ".doc-topic.i32"
+            block_size = memory_block_size(args.max_memory, args.workers)
+        try:
+            save_partial_counts(
+                read_state_counts(
+                    args.statefile,
+                    engine=args.engine,
+                    workers=args.workers,
+                    doc_topic_path=doc_topic_path,
+                    block_size=block_size,
+                ),
+                args.partial,
+            )
+        finally:
+            if doc_topic_path is not None and os.path.exists(doc_topic_path):
+                os.remove(doc_topic_path)
+        sys.exit(0)
+
     process_mallet_state_file(
-        args.statefile, args.output_dir, args.top_words, generate_all=args.all
+        args.statefile,
+        args.output_dir,
+        args.top_words,
+        generate_all=args.all,
+        engine=args.engine,
+        workers=args.workers,
+        full_jsd=args.full_jsd,
+        threads=args.threads,
+        layout=args.layout,
+        mds_jobs=args.mds_jobs,
+        previous_coords=args.previous_coords,
+        topic_alignment=(
+            read_topic_alignment(args.topic_alignment) if args.topic_alignment else None
+        ),
+        cache=args.cache,
+        max_memory=args.max_memory,
+        doc_topic_binary=args.doc_topic_binary,
+        word_index=args.word_index,
+        top_docs=args.topic_docs,
+        facets=args.facets,
+        compress=args.compress,
+        writers=args.writers,
+        zip_level=args.zip_level,
+        profile=args.profile,
+        cprofile=args.cprofile,
+        seek_index=args.seek_index,
+        sample=args.sample,
+        config_file=args.config,
     )
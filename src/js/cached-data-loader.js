@@ -137,8 +137,10 @@ const CachedDataLoader = {
 
   /**
    * Load doc-topics with caching
+   * With binary: true the file is fetched as an ArrayBuffer; the raw buffer
+   * is cached and parsed on every load, since wrapping it is cheap
    */
-  async loadDocTopics(url, parser) {
+  async loadDocTopics(url, parser, { binary = false } = {}) {
     const cacheKey = this.buildCacheKey(url);
     const fileInfo = await this.getFileInfo(url);
     const version = fileInfo ? fileInfo.version : null;
@@ -148,7 +150,7 @@ const CachedDataLoader = {
       const cached = await CacheManager.get(CacheManager.stores.DOC_TOPICS, cacheKey, version);
       if (cached && cached.data) {
         console.log('[CachedLoader] Using cached doc-topics');
-        return cached.data;
+        return binary ? parser(cached.data) : cached.data;
       }
     } catch (err) {
       console.warn('[CachedLoader] Cache retrieval failed:', err);
@@ -157,8 +159,8 @@ const CachedDataLoader = {
     // Load from file
     console.log('[CachedLoader] Loading doc-topics from file');
     const response = await fetch(url, { cache: 'no-store' });
-    const text = await response.text();
-    const data = parser(text);
+    const raw = binary ? await response.arrayBuffer() : await response.text();
+    const data = parser(raw);
 
     // Cache
     if (fileInfo) {
@@ -166,7 +168,7 @@ const CachedDataLoader = {
         await CacheManager.set(
           CacheManager.stores.DOC_TOPICS,
           cacheKey,
-          data,
+          binary ? raw : data,
           { version: version, size: fileInfo.size }
         );
       } catch (err) {
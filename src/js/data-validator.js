@@ -93,7 +93,7 @@ const DataValidator = {
 
     // Validate structure
     docTopics.forEach((doc, index) => {
-      if (!Array.isArray(doc)) {
+      if (!Array.isArray(doc) && !ArrayBuffer.isView(doc)) {
         errors.push(`Document ${index} is not an array of topic proportions`);
       }
       if (doc.length === 0) {
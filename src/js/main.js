@@ -60,6 +60,42 @@ function parseDocTopics(text) {
   });
 }
 
+// Utility: Parse doc-topic.bin written by prepare_data.py --doc-topic-binary
+// Layout: "DFRT", uint32 header length, JSON header, then a little-endian
+// float32 (or uint16 fixed-point) matrix with one row per document
+function parseDocTopicsBinary(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'DFRT') throw new Error('Not a doc-topic binary file');
+  const headerLength = view.getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  const { numDocs, numTopics } = header;
+  const offset = 8 + headerLength;
+  const size = numDocs * numTopics;
+  const littleEndian = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+  let values;
+  if (header.dtype === 'float32' && littleEndian) {
+    // Zero-copy view on the fetched buffer
+    values = new Float32Array(buffer, offset, size);
+  } else if (header.dtype === 'float32') {
+    values = new Float32Array(size);
+    for (let i = 0; i < size; i++) values[i] = view.getFloat32(offset + 4 * i, true);
+  } else if (header.dtype === 'uint16') {
+    values = new Float32Array(size);
+    for (let i = 0; i < size; i++) values[i] = view.getUint16(offset + 2 * i, true) / header.scale;
+  } else {
+    throw new Error(`Unknown doc-topic binary format: ${header.dtype}`);
+  }
+
+  // One row view per document, sharing the underlying buffer
+  const docs = new Array(numDocs);
+  for (let d = 0; d < numDocs; d++) {
+    docs[d] = values.subarray(d * numTopics, (d + 1) * numTopics);
+  }
+  return docs;
+}
+
 // Utility: Parse metadata.csv (properly handles quoted fields with commas)
 function parseMetadata(text) {
   const lines = text.trim().split(/\r?\n/).filter(l => l.trim());
@@ -421,12 +457,32 @@ function ensureAbsolutePath(path) {
   return path;
 }
 
+// Load doc lengths and doc-topic counts from the compact files written by
+// prepare_data.py, falling back to parsing the whole state file
+async function loadDocCounts(config) {
+  const stateUtils = await import('./state-utils.js');
+  const dataDir = (config.doc_topic_file || 'data/doc-topic.txt').replace(/[^/]*$/, '');
+  const docLengthsPath = ensureAbsolutePath(config.doc_lengths_file || dataDir + 'doc-lengths.bin');
+  const docTopicCountsPath = ensureAbsolutePath(config.doc_topic_counts_file || dataDir + 'doc-topic-counts.bin');
+
+  const [docLengths, docTopicCounts] = await Promise.all([
+    stateUtils.loadDocLengths(docLengthsPath),
+    stateUtils.loadDocTopicCounts(docTopicCountsPath)
+  ]);
+  window.dfrState.docLengths = docLengths || await stateUtils.extractDocLengths();
+  window.dfrState.docTopicCounts = docTopicCounts ||
+    await stateUtils.extractDocTopicCounts(window.dfrState.topicKeys.length);
+  return Boolean(docLengths && docTopicCounts);
+}
+
 // Auto-load files from config paths
 async function autoLoadData() {
   try {
     const config = window.dfrState.config;
     const topicKeysPath = ensureAbsolutePath(config.topic_keys_file || 'data/topic-keys.txt');
     const docTopicPath = ensureAbsolutePath(config.doc_topic_file || 'data/doc-topic.txt');
+    const docTopicBinaryPath = config.doc_topic_binary_file ?
+      ensureAbsolutePath(config.doc_topic_binary_file) : null;
     const metadataPath = ensureAbsolutePath(config.metadata_file || 'data/metadata.csv');
     const coordsPath = ensureAbsolutePath(config.topic_coords_file || 'data/topic_coords.csv');
 
@@ -441,8 +497,12 @@ async function autoLoadData() {
           ErrorHandler.handleFileError(topicKeysPath, err, 'topic keys file');
           throw err;
         }),
-        CachedDataLoader.loadDocTopics(docTopicPath, parseDocTopics).catch(err => {
-          ErrorHandler.handleFileError(docTopicPath, err, 'doc-topics file');
+        (docTopicBinaryPath ?
+          CachedDataLoader.loadDocTopics(docTopicBinaryPath, parseDocTopicsBinary, { binary: true }) :
+          CachedDataLoader.loadDocTopics(docTopicPath, parseDocTopics)
+        ).catch(err => {
+          const path = docTopicBinaryPath || docTopicPath;
+          ErrorHandler.handleFileError(path, err, 'doc-topics file');
           throw err;
         }),
         CachedDataLoader.loadMetadata(metadataPath, parseMetadata).catch(err => {
@@ -487,12 +547,12 @@ async function autoLoadData() {
       return;
     }
 
-    // Derive docLengths and docTopicCounts from state file if available
+    // Load docLengths and docTopicCounts, from the state file if necessary
     try {
-      const stateUtils = await import('./state-utils.js');
-      window.dfrState.docLengths = await stateUtils.extractDocLengths();
-      window.dfrState.docTopicCounts = await stateUtils.extractDocTopicCounts(window.dfrState.topicKeys.length);
-      console.log('[DFR] Successfully extracted data from state file');
+      const precomputed = await loadDocCounts(config);
+      console.log(precomputed ?
+        '[DFR] Loaded precomputed doc lengths and topic counts' :
+        '[DFR] Successfully extracted data from state file');
     } catch (e) {
       console.warn('[DFR] Warning: Could not extract doc lengths or topic counts from state file. Some features may be missing.');
     }
@@ -531,12 +591,35 @@ async function autoLoadData() {
     if (footer) {
       footer.style.display = 'block';
     }
+
+    // Files written by prepare_data.py --sample are a preview
+    if (config.approximate) {
+      showApproximateNotice(config.approximate);
+    }
   } catch (e) {
     console.error('[DFR] Sample data not loaded:', e);
     throw e; // Re-throw so ensureDataLoaded can catch it
   }
 }
 
+// Show that the data was estimated from a sample of the state file
+function showApproximateNotice(approximate) {
+  const percent = `${Math.round(approximate.fraction * 1000) / 10}%`;
+  const sample = approximate.method === 'first_docs' ?
+    `the first ${approximate.documents.toLocaleString()} documents` :
+    approximate.method === 'documents' ?
+      `${percent} of the documents` :
+      `${percent} of the tokens`;
+  const alertDiv = document.createElement('div');
+  alertDiv.className = 'alert alert-warning alert-dismissible fade show position-fixed bottom-0 start-50 translate-middle-x mb-3';
+  alertDiv.style.zIndex = '9999';
+  alertDiv.innerHTML = `
+    <i class="bi bi-exclamation-triangle"></i> Preview: topic proportions are estimated from ${sample} of the model.
+    <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
+  `;
+  document.body.appendChild(alertDiv);
+}
+
 // Show upload form or auto-load data from config paths
 async function showUploadFormOrAutoLoad() {
   try {
@@ -583,7 +666,10 @@ function setupFileUploadHandler() {
     // All data loaded here is from the files selected in the upload form
     const readerPromises = [];
     readerPromises.push(topicKeysFile ? topicKeysFile.text() : Promise.reject('Topic keys file is required.'));
-    readerPromises.push(docTopicFile ? docTopicFile.text() : Promise.reject('Doc-topic file is required.'));
+    const docTopicIsBinary = docTopicFile && docTopicFile.name.endsWith('.bin');
+    readerPromises.push(docTopicFile ?
+      (docTopicIsBinary ? docTopicFile.arrayBuffer() : docTopicFile.text()) :
+      Promise.reject('Doc-topic file is required.'));
     readerPromises.push(metadataFile ? metadataFile.text() : Promise.reject('Metadata file is required.'));
     readerPromises.push(coordsFile ? coordsFile.text() : null);
 
@@ -598,7 +684,7 @@ function setupFileUploadHandler() {
         return;
       }
       try {
-        window.dfrState.docTopic = parseDocTopics(dtText);
+        window.dfrState.docTopic = docTopicIsBinary ? parseDocTopicsBinary(dtText) : parseDocTopics(dtText);
         if (!window.dfrState.docTopic.length) throw new Error('No doc-topics found in doc-topic file.');
       } catch (e) {
         showError('Failed to parse doc-topic file: ' + e.message);
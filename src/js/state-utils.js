@@ -11,12 +11,298 @@ function ensureAbsolutePath(path) {
 // Global cache for parsed state data
 let parsedStateData = null;
 let stateFileConfig = null;
+let wordTopicIndex;  // undefined until loaded, null if unavailable
+let wordDocManifest;  // word-docs/index.json, same convention
+const facetCache = new Map();  // Field -> facet promise
+const wordDocShards = new Map();  // Shard file path -> parsed shard
+
+// Parse a binary file written by prepare_data.py: "DFRT", uint32 header
+// length, JSON header, then the arrays listed in header.arrays
+const BINARY_ARRAY_TYPES = {
+  uint8: Uint8Array, uint16: Uint16Array, uint32: Uint32Array, float32: Float32Array
+};
+
+export function parseBinaryArrays(buffer) {
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'DFRT') throw new Error('Not a dfr-browser binary file');
+  const headerLength = new DataView(buffer).getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  const dataStart = 8 + headerLength;
+  const arrays = {};
+  for (const [name, spec] of Object.entries(header.arrays)) {
+    const ArrayType = BINARY_ARRAY_TYPES[spec.dtype];
+    if (!ArrayType) throw new Error(`Unsupported array type: ${spec.dtype}`);
+    arrays[name] = new ArrayType(buffer, dataStart + spec.offset, spec.length);
+  }
+  return { header, arrays };
+}
+
+async function fetchBinaryArrays(path) {
+  try {
+    const response = await fetch(path);
+    if (!response.ok) return null;
+    return parseBinaryArrays(await response.arrayBuffer());
+  } catch (error) {
+    console.warn('⚠️ Could not load binary file:', path, error);
+    return null;
+  }
+}
+
+// Load doc lengths from doc-lengths.bin: docLengths[doc] = token count
+export async function loadDocLengths(path) {
+  const file = await fetchBinaryArrays(path);
+  if (!file) return null;
+  console.log(`✅ Loaded doc lengths for ${file.header.numDocs} documents`);
+  return file.arrays.lengths;
+}
+
+// Load the doc-topic counts matrix from the sparse doc-topic-counts.bin:
+// docTopicCounts[doc][topic] = count
+export async function loadDocTopicCounts(path) {
+  const file = await fetchBinaryArrays(path);
+  if (!file) return null;
+  const { numDocs, numTopics } = file.header;
+  const { indptr, indices, data } = file.arrays;
+
+  // Dense rows as views on one buffer
+  const values = new Uint32Array(numDocs * numTopics);
+  const docTopicCounts = new Array(numDocs);
+  for (let d = 0; d < numDocs; d++) {
+    const row = values.subarray(d * numTopics, (d + 1) * numTopics);
+    for (let j = indptr[d]; j < indptr[d + 1]; j++) row[indices[j]] = data[j];
+    docTopicCounts[d] = row;
+  }
+
+  console.log(`✅ Loaded doc-topic counts: ${numDocs} documents, ${numTopics} topics`);
+  return docTopicCounts;
+}
+
+// Load one topic's top documents from topic-docs/topic-NNNNN.bin:
+// { docs, counts, proportions, docsWithTopic }, ranked by proportion.
+// Returns null when the file is not available.
+export async function loadTopicDocs(topic) {
+  const config = await getStateFileConfig();
+  const file = await fetchBinaryArrays(`${config.topicDocsDir}topic-${String(topic).padStart(5, '0')}.bin`);
+  if (!file) return null;
+  return { ...file.arrays, docsWithTopic: file.header.docsWithTopic };
+}
+
+// Load a metadata facet from facets/<field>.bin (cached): bucket labels,
+// docCounts, topic x bucket topicTokens and proportionSums, and the
+// documents of bucket b as docs[offsets[b]:offsets[b + 1]].
+// Returns null when the file is not available.
+export async function loadFacet(field) {
+  if (!facetCache.has(field)) {
+    facetCache.set(field, (async () => {
+      const config = await getStateFileConfig();
+      const file = await fetchBinaryArrays(`${config.facetsDir}${field.replace(':', '-')}.bin`);
+      if (!file) return null;
+      return { buckets: file.header.buckets, numTopics: file.header.numTopics, ...file.arrays };
+    })());
+  }
+  return facetCache.get(field);
+}
+
+// Load vocab.txt and word-topics.bin written by prepare_data.py (cached).
+// Returns null when the files are not available.
+export async function loadWordTopicIndex() {
+  if (wordTopicIndex !== undefined) return wordTopicIndex;
+
+  const config = await getStateFileConfig();
+  const [vocabResponse, file] = await Promise.all([
+    fetch(config.vocabPath).catch(() => null),
+    fetchBinaryArrays(config.wordTopicsPath)
+  ]);
+  if (!vocabResponse || !vocabResponse.ok || !file) {
+    wordTopicIndex = null;
+    return null;
+  }
+
+  const words = [];
+  const frequencies = [];
+  for (const line of (await vocabResponse.text()).split('\n')) {
+    if (!line) continue;
+    const tab = line.lastIndexOf('\t');
+    words.push(line.slice(0, tab));
+    frequencies.push(Number(line.slice(tab + 1)));
+  }
+
+  // Words are sorted by frequency, so the first spelling wins
+  const wordIds = new Map();
+  words.forEach((word, id) => {
+    const key = word.toLowerCase();
+    if (!wordIds.has(key)) wordIds.set(key, id);
+  });
+
+  wordTopicIndex = { words, frequencies, wordIds, numTopics: file.header.numTopics, ...file.arrays };
+  console.log(`✅ Loaded word-topic index for ${words.length} words`);
+  return wordTopicIndex;
+}
+
+// Topic counts of one word, most frequent topic first: [{ topic, count }]
+// Returns null when no word-topic index is available
+export async function getWordTopics(word) {
+  const index = await loadWordTopicIndex();
+  if (!index) return null;
+  const id = index.wordIds.get(word.toLowerCase());
+  if (id === undefined) return [];
+  const topics = [];
+  for (let j = index.indptr[id]; j < index.indptr[id + 1]; j++) {
+    topics.push({ topic: index.indices[j], count: index.data[j] });
+  }
+  return topics.sort((a, b) => b.count - a.count);
+}
+
+// Load word-docs/index.json, the manifest of the word-doc index shards
+async function loadWordDocManifest() {
+  if (wordDocManifest !== undefined) return wordDocManifest;
+  const config = await getStateFileConfig();
+  try {
+    const response = await fetch(config.wordDocsDir + 'index.json');
+    wordDocManifest = response.ok ? await response.json() : null;
+  } catch (error) {
+    wordDocManifest = null;
+  }
+  return wordDocManifest;
+}
+
+// Documents containing one word: [{ doc, topic, count }] sorted by doc and
+// topic, decoded from the word's shard of the word-doc index. Postings are
+// varint triples (doc delta, topic, count). Returns null when no index is
+// available.
+export async function getWordDocuments(word) {
+  const [index, manifest] = await Promise.all([loadWordTopicIndex(), loadWordDocManifest()]);
+  if (!index || !manifest) return null;
+  const id = index.wordIds.get(word.toLowerCase());
+  if (id === undefined) return [];
+
+  // Last shard starting at or before the word
+  let lo = 0;
+  let hi = manifest.firstWords.length - 1;
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1;
+    if (manifest.firstWords[mid] <= id) lo = mid; else hi = mid - 1;
+  }
+  const config = await getStateFileConfig();
+  const path = config.wordDocsDir + manifest.shards[lo];
+  if (!wordDocShards.has(path)) wordDocShards.set(path, fetchBinaryArrays(path));
+  const shard = await wordDocShards.get(path);
+  if (!shard) return null;
+
+  const local = id - shard.header.firstWord;
+  const { offsets, postings } = shard.arrays;
+  const values = [];
+  let value = 0;
+  let shift = 0;
+  for (let i = offsets[local]; i < offsets[local + 1]; i++) {
+    const byte = postings[i];
+    value += (byte & 0x7f) * 2 ** shift;
+    if (byte < 0x80) {
+      values.push(value);
+      value = 0;
+      shift = 0;
+    } else {
+      shift += 7;
+    }
+  }
+
+  const result = [];
+  let doc = 0;
+  for (let i = 0; i < values.length; i += 3) {
+    doc += values[i];
+    result.push({ doc, topic: values[i + 1], count: values[i + 2] });
+  }
+  return result;
+}
+
+// Top words of each topic from the word-topic index
+function topWordsFromIndex(index, topicCount, wordsCount) {
+  const topicWords = Array(topicCount).fill(null).map(() => []);
+  for (let id = 0; id < index.words.length; id++) {
+    for (let j = index.indptr[id]; j < index.indptr[id + 1]; j++) {
+      const topic = index.indices[j];
+      if (topic < topicCount) topicWords[topic].push([id, index.data[j]]);
+    }
+  }
+  return topicWords.map(entries => entries
+    .sort((a, b) => b[1] - a[1] || a[0] - b[0])
+    .slice(0, wordsCount)
+    .map(([id]) => index.words[id]));
+}
+
+// Decode the strings of a binary state column: string i is
+// bytes[offsets[i]:offsets[i+1]]
+function decodeStrings(bytes, offsets) {
+  const decoder = new TextDecoder();
+  const strings = new Array(offsets.length - 1);
+  for (let i = 0; i < strings.length; i++) {
+    strings[i] = decoder.decode(bytes.subarray(offsets[i], offsets[i + 1]));
+  }
+  return strings;
+}
+
+// Call visit(docId, type, topic) for every token of a binary state
+function forEachBinaryToken(state, visit) {
+  const { docIds, docLengths, types, topics } = state.arrays;
+  let token = 0;
+  for (let doc = 0; doc < docIds.length; doc++) {
+    const end = token + docLengths[doc];
+    for (; token < end; token++) visit(docIds[doc], types[token], topics[token]);
+  }
+}
+
+// Read the first `length` bytes of a stream without losing them: returns
+// those bytes and a stream that still yields everything from the start
+async function peekStream(body, length) {
+  const reader = body.getReader();
+  const chunks = [];
+  let size = 0;
+  while (size < length) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    chunks.push(value);
+    size += value.byteLength;
+  }
+  const head = new Uint8Array(Math.min(size, length));
+  let offset = 0;
+  for (const chunk of chunks) {
+    if (offset >= head.length) break;
+    const part = chunk.subarray(0, head.length - offset);
+    head.set(part, offset);
+    offset += part.length;
+  }
+  const stream = new ReadableStream({
+    start(controller) {
+      for (const chunk of chunks) controller.enqueue(chunk);
+    },
+    async pull(controller) {
+      const { done, value } = await reader.read();
+      if (done) controller.close();
+      else controller.enqueue(value);
+    },
+    cancel(reason) {
+      return reader.cancel(reason);
+    }
+  });
+  return { head, stream };
+}
 
 // Extract doc-topic counts matrix: docTopicCounts[doc][topic] = count
 export async function extractDocTopicCounts(topicCount) {
   const stateData = await loadStateFile();
   if (!stateData) return [];
 
+  if (stateData.binary) {
+    const { docIds } = stateData.binary.arrays;
+    const docCount = docIds.reduce((max, id) => Math.max(max, id + 1), 0);
+    const docTopicCounts = Array(docCount).fill(null).map(() => Array(topicCount).fill(0));
+    forEachBinaryToken(stateData.binary, (docId, type, topic) => {
+      if (topic < topicCount) docTopicCounts[docId][topic]++;
+    });
+    console.log(`✅ Extracted doc-topic counts: ${docCount} documents, ${topicCount} topics`);
+    return docTopicCounts;
+  }
+
   // First, determine the number of documents
   let maxDoc = -1;
   for (const line of stateData.lines) {
@@ -54,6 +340,15 @@ export async function extractDocLengths() {
   if (!stateData) return {};
 
   const docLengths = {};
+  if (stateData.binary) {
+    const { docIds, docLengths: lengths } = stateData.binary.arrays;
+    for (let doc = 0; doc < docIds.length; doc++) {
+      docLengths[docIds[doc]] = (docLengths[docIds[doc]] || 0) + lengths[doc];
+    }
+    console.log(`✅ Extracted doc lengths for ${Object.keys(docLengths).length} documents`);
+    return docLengths;
+  }
+
   for (const line of stateData.lines) {
     if (line.startsWith('#') || line.trim() === '') continue;
     const parts = line.trim().split(/\s+/);
@@ -76,14 +371,26 @@ async function getStateFileConfig() {
   try {
     const response = await fetch('config.json');
     const config = await response.json();
+    // Files written by prepare_data.py live next to doc-topic.txt
+    const dataDir = (config.doc_topic_file || 'data/doc-topic.txt').replace(/[^/]*$/, '');
     stateFileConfig = {
       path: ensureAbsolutePath(config.topic_state_file || 'sample_data/topic-state.gz'),
+      vocabPath: ensureAbsolutePath(config.vocab_file || dataDir + 'vocab.txt'),
+      wordTopicsPath: ensureAbsolutePath(config.word_topics_file || dataDir + 'word-topics.bin'),
+      wordDocsDir: ensureAbsolutePath((config.word_index_dir || dataDir + 'word-docs').replace(/\/?$/, '/')),
+      topicDocsDir: ensureAbsolutePath((config.topic_docs_dir || dataDir + 'topic-docs').replace(/\/?$/, '/')),
+      facetsDir: ensureAbsolutePath((config.facets_dir || dataDir + 'facets').replace(/\/?$/, '/')),
       available: true
     };
   } catch (error) {
     console.warn('Could not load config, using default state file path');
     stateFileConfig = {
       path: ensureAbsolutePath('sample_data/topic-state.gz'),
+      vocabPath: ensureAbsolutePath('sample_data/vocab.txt'),
+      wordTopicsPath: ensureAbsolutePath('sample_data/word-topics.bin'),
+      wordDocsDir: ensureAbsolutePath('sample_data/word-docs/'),
+      topicDocsDir: ensureAbsolutePath('sample_data/topic-docs/'),
+      facetsDir: ensureAbsolutePath('sample_data/facets/'),
       available: true
     };
   }
@@ -109,8 +416,19 @@ export async function loadStateFile() {
 
     console.log('📊 State file found, parsing...');
 
+    // A binary state from prepare_data.py --binary-state is used as is
+    const { head, stream: body } = await peekStream(response.body, 4);
+    if (String.fromCharCode(...head) === 'DFRT') {
+      const binary = parseBinaryArrays(await new Response(body).arrayBuffer());
+      if (binary.header.format !== 'mallet-state') throw new Error('Not a binary state file');
+      binary.vocab = decodeStrings(binary.arrays.vocab, binary.arrays.vocabOffsets);
+      parsedStateData = { binary, lines: [], parsed: true };
+      console.log(`✅ Binary state loaded: ${binary.header.numTokens} tokens`);
+      return parsedStateData;
+    }
+
     // Handle compressed file
-    const stream = response.body.pipeThrough(new DecompressionStream('gzip'));
+    const stream = body.pipeThrough(new DecompressionStream('gzip'));
     const text = await new Response(stream).text();
 
     const lines = text.split('\n').filter(line => line.trim());
@@ -135,6 +453,9 @@ export async function loadStateFile() {
 export async function extractTopicWords(topicCount, wordsCount = 50) {
   console.log(`🔍 Extracting ${wordsCount} words for ${topicCount} topics`);
 
+  const index = await loadWordTopicIndex();
+  if (index) return topWordsFromIndex(index, topicCount, wordsCount);
+
   const stateData = await loadStateFile();
   if (!stateData) {
     console.log('⚠️ No state data available, falling back to keys file');
@@ -147,6 +468,17 @@ export async function extractTopicWords(topicCount, wordsCount = 50) {
   // Parse each line: doc source pos typeindex type topic
   let validLines = 0;
 
+  if (stateData.binary) {
+    const { vocab } = stateData.binary;
+    forEachBinaryToken(stateData.binary, (docId, type, topicId) => {
+      const word = vocab[type];
+      if (topicId < topicCount && word && word !== 'NA') {
+        topicWordCounts[topicId][word] = (topicWordCounts[topicId][word] || 0) + 1;
+        validLines++;
+      }
+    });
+  }
+
   for (const line of stateData.lines) {
     // Skip header and comment lines
     if (line.startsWith('#') || line.trim() === '') continue;
@@ -179,6 +511,9 @@ export async function extractTopicWords(topicCount, wordsCount = 50) {
 }
 
 export async function extractFullVocabulary() {
+  const index = await loadWordTopicIndex();
+  if (index) return index.words.filter(word => word && word !== 'NA').sort();
+
   console.log('📚 Extracting full vocabulary from state file...');
 
   const stateData = await loadStateFile();
@@ -188,6 +523,12 @@ export async function extractFullVocabulary() {
   }
 
   const vocabulary = new Set();
+  if (stateData.binary) {
+    const { vocab, arrays } = stateData.binary;
+    for (const type of new Set(arrays.types)) {
+      if (vocab[type] && vocab[type] !== 'NA') vocabulary.add(vocab[type]);
+    }
+  }
 
   // Parse each line to collect all unique words
   for (const line of stateData.lines) {
@@ -210,4 +551,8 @@ export async function extractFullVocabulary() {
 export function clearStateCache() {
   parsedStateData = null;
   stateFileConfig = null;
+  wordTopicIndex = undefined;
+  wordDocManifest = undefined;
+  wordDocShards.clear();
+  facetCache.clear();
 }
@@ -1,5 +1,5 @@
 // Topic view - Shows detailed information about a specific topic
-import { extractTopicWords } from './state-utils.js';
+import { extractTopicWords, loadFacet, loadTopicDocs } from './state-utils.js';
 import { getTopicLabel } from './topic-config.js';
 
 // Store current topic data for filtering
@@ -78,6 +78,12 @@ async function loadConfig() {
     console.log('[Topic] Bibliography not available, will use metadata citations');
   }
 
+  // Top documents and year totals precomputed by prepare_data.py, if available
+  const [rankedDocs, yearFacet] = await Promise.all([
+    loadTopicDocs(topicId).catch(() => null),
+    loadFacet('year').catch(() => null)
+  ]);
+
   // Try to get enhanced word list from state file
   const enhancedWordLists = await extractTopicWords(topicKeys.length, wordsCount);
   const topic = topicKeys[topicId];
@@ -94,14 +100,17 @@ async function loadConfig() {
     topicNumber: topicId,
     docTopicCounts,
     settings,
-    bibliographyData
+    bibliographyData,
+    yearFacet
   };
 
   // Reset any existing year filter
   currentSelectedYear = null;
 
   // Calculate topic proportions over time
-  const timeSeriesData = calculateTopicTimeSeries(docTopic, metadata, topicId);
+  const timeSeriesData = yearFacet
+    ? facetTimeSeries(yearFacet, topicId)
+    : calculateTopicTimeSeries(docTopic, metadata, topicId);
 
   let html = `
     <div class="container-fluid">
@@ -156,7 +165,7 @@ async function loadConfig() {
               <h5 class="mb-0">Top Documents</h5>
             </div>
             <div class="card-body" id="top-documents-container">
-              ${generateTopDocumentsHTML(docTopic, metadata, topicId, docTopicCounts, settings, bibliographyData)}
+              ${generateTopDocumentsHTML(docTopic, metadata, topicId, docTopicCounts, settings, bibliographyData, rankedDocs)}
             </div>
           </div>
         </div>
@@ -241,6 +250,20 @@ function generateWordDistributionHTML(topicWords, topicNumber, settings = {}) {
   return html;
 }
 
+// Topic proportions over time from the precomputed year facet
+function facetTimeSeries(facet, topicNumber) {
+  const { buckets, docCounts, proportionSums } = facet;
+  return buckets.map((year, b) => {
+    const topicSum = proportionSums[topicNumber * buckets.length + b];
+    return {
+      year,
+      totalDocs: docCounts[b],
+      topicSum,
+      avgProportion: docCounts[b] > 0 ? topicSum / docCounts[b] : 0
+    };
+  });
+}
+
 function calculateTopicTimeSeries(docTopic, metadata, topicNumber) {
   const yearData = {};
 
@@ -427,11 +450,42 @@ function generateTopicStatsHTML(docTopic, topicNumber, timeSeriesData) {
   `;
 }
 
-function generateTopDocumentsHTML(docTopic, metadata, topicNumber, docTopicCounts = null, settings = {}, bibliographyData = null) {
-  if (!docTopic || !metadata || docTopic.length === 0) {
-    return `<p class="text-muted">No document data available for Topic ${topicNumber + 1}</p>`;
+// Citation of a document from the bibliography, or else its metadata
+function documentCitation(docIndex, metadataDoc, bibliographyData) {
+  let citation = null;
+  if (bibliographyData && bibliographyData[docIndex]) {
+    // Direct array access since bibliography should be in same order as metadata
+    citation = bibliographyData[docIndex]['formatted-citation'] || bibliographyData[docIndex]._formattedCitation;
+  }
+  return citation || metadataDoc['formatted-citation'] ||
+    `${metadataDoc.title || 'Untitled'}. ${metadataDoc.author || 'Unknown author'}. ${metadataDoc.year || metadataDoc.pubdate || 'Unknown date'}.`;
+}
+
+// Top documents from the topic's precomputed ranking, or null when it
+// holds fewer documents than requested
+function precomputedTopDocuments(rankedDocs, metadata, docsToShow, bibliographyData) {
+  if (!rankedDocs) return null;
+  const { docs, counts, proportions, docsWithTopic } = rankedDocs;
+  if (docs.length < docsToShow && docs.length < docsWithTopic) return null;
+
+  const topDocs = [];
+  for (let i = 0; i < docs.length && topDocs.length < docsToShow; i++) {
+    const docIndex = docs[i];
+    const metadataDoc = metadata[docIndex];
+    if (!metadataDoc) continue;
+    topDocs.push({
+      docIndex,
+      proportion: proportions[i],
+      topicTokens: counts[i],
+      citation: documentCitation(docIndex, metadataDoc, bibliographyData),
+      id: metadataDoc.id || `doc_${docIndex}`
+    });
   }
+  return topDocs;
+}
 
+// All documents with tokens in the topic, by decreasing proportion
+function rankTopicDocuments(docTopic, metadata, topicNumber, docTopicCounts, bibliographyData) {
   const documentProportions = [];
 
   docTopic.forEach((doc, docIndex) => {
@@ -444,24 +498,11 @@ function generateTopDocumentsHTML(docTopic, metadata, topicNumber, docTopicCount
           if (docTopicCounts && docTopicCounts[docIndex] && docTopicCounts[docIndex][topicNumber] !== undefined) {
             const topicTokens = parseInt(docTopicCounts[docIndex][topicNumber]) || 0;
 
-            // Get formatted citation from bibliography if available
-            let citation = null;
-            if (bibliographyData && bibliographyData[docIndex]) {
-              // Direct array access since bibliography should be in same order as metadata
-              citation = bibliographyData[docIndex]['formatted-citation'] || bibliographyData[docIndex]._formattedCitation;
-            }
-
-            // Fallback to metadata citation
-            if (!citation) {
-              citation = metadataDoc['formatted-citation'] ||
-                        `${metadataDoc.title || 'Untitled'}. ${metadataDoc.author || 'Unknown author'}. ${metadataDoc.year || metadataDoc.pubdate || 'Unknown date'}.`;
-            }
-
             documentProportions.push({
               docIndex,
               proportion,
               topicTokens,
-              citation,
+              citation: documentCitation(docIndex, metadataDoc, bibliographyData),
               id: metadataDoc.id || `doc_${docIndex}`
             });
           }
@@ -471,8 +512,17 @@ function generateTopDocumentsHTML(docTopic, metadata, topicNumber, docTopicCount
   });
 
   documentProportions.sort((a, b) => b.proportion - a.proportion);
+  return documentProportions;
+}
+
+function generateTopDocumentsHTML(docTopic, metadata, topicNumber, docTopicCounts = null, settings = {}, bibliographyData = null, rankedDocs = null) {
+  if (!docTopic || !metadata || docTopic.length === 0) {
+    return `<p class="text-muted">No document data available for Topic ${topicNumber + 1}</p>`;
+  }
+
   const docsToShow = settings.topicDocs || 20;
-  const topDocs = documentProportions.slice(0, docsToShow);
+  const topDocs = precomputedTopDocuments(rankedDocs, metadata, docsToShow, bibliographyData) ||
+    rankTopicDocuments(docTopic, metadata, topicNumber, docTopicCounts, bibliographyData).slice(0, docsToShow);
 
   if (topDocs.length === 0) {
     return `<p class="text-muted">No documents found with significant presence of Topic ${topicNumber + 1}. Make sure the state file is loaded for token counts.</p>`;
@@ -575,12 +625,21 @@ window.filterDocumentsByYear = function(year, topicNumber) {
 
   currentSelectedYear = year;
 
-  const { docTopic, metadata, docTopicCounts, settings, bibliographyData } = currentTopicData;
-
-  // Filter documents by year
-  const filteredDocs = metadata
-    .map((doc, idx) => ({ doc, idx }))
-    .filter(({ doc }) => doc.year === year);
+  const { docTopic, metadata, docTopicCounts, settings, bibliographyData, yearFacet } = currentTopicData;
+
+  // Filter documents by year, using the year facet's document lists if loaded
+  let filteredDocs;
+  const bucket = yearFacet ? yearFacet.buckets.indexOf(String(year)) : -1;
+  if (bucket >= 0) {
+    filteredDocs = Array.from(
+      yearFacet.docs.subarray(yearFacet.offsets[bucket], yearFacet.offsets[bucket + 1]),
+      idx => ({ doc: metadata[idx], idx })
+    ).filter(({ doc }) => doc);
+  } else {
+    filteredDocs = metadata
+      .map((doc, idx) => ({ doc, idx }))
+      .filter(({ doc }) => doc.year === year);
+  }
 
   // Update the display
   const container = document.getElementById('top-documents-container');
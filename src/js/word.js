@@ -1,8 +1,51 @@
 // Word View
 import { loadWordList } from './wordlist.js';
-import { extractTopicWords } from './state-utils.js';
+import { extractTopicWords, getWordDocuments, getWordTopics } from './state-utils.js';
 import { getTopicLabel } from './topic-config.js';
 
+// Most topics listed for a word when the word-topic index is available
+const MAX_WORD_TOPICS = 10;
+// Most documents listed for a word when the word-doc index is available
+const MAX_WORD_DOCS = 20;
+
+// Documents with the most tokens of a word, from the word-doc index
+async function wordDocumentsHTML(wordValue, metadata) {
+  const postings = await getWordDocuments(wordValue).catch(() => null);
+  if (!postings || postings.length === 0) return '';
+
+  const docs = new Map();
+  for (const { doc, topic, count } of postings) {
+    const entry = docs.get(doc) || { doc, count: 0, topic, topicCount: 0 };
+    entry.count += count;
+    if (count > entry.topicCount) {
+      entry.topic = topic;
+      entry.topicCount = count;
+    }
+    docs.set(doc, entry);
+  }
+  const topDocs = [...docs.values()]
+    .sort((a, b) => b.count - a.count || a.doc - b.doc)
+    .slice(0, MAX_WORD_DOCS);
+
+  let html = `<h3 class="mt-4">Documents using <span class="word">${wordValue}</span></h3>
+    <p class="help">${docs.size} documents use this word; the ${topDocs.length} using it most are listed with the topic most of its tokens there are assigned to.</p>
+    <table class="table table-sm table-hover"><thead><tr>
+      <th>Document</th><th>Topic</th><th style="text-align: right;">Tokens</th>
+    </tr></thead><tbody>`;
+  for (const { doc, count, topic } of topDocs) {
+    const meta = (metadata && metadata[doc]) || {};
+    const title = meta.title || `Document ${doc}`;
+    const topicLabel = getTopicLabel(topic);
+    html += `<tr style="cursor: pointer;" onclick="window.page('/document/${doc}')" title="Click to view document details">
+      <td><small>${title}</small></td>
+      <td><small>${topicLabel}</small></td>
+      <td style="text-align: right;">${count}</td>
+    </tr>`;
+  }
+  html += '</tbody></table>';
+  return html;
+}
+
 // Function to extract enhanced word lists from state file
 async function enhanceTopicKeysWithState(topicKeys, wordsCount) {
   try {
@@ -80,10 +123,22 @@ export async function loadWordView(topicKeys, docTopic, metadata, searchWord = n
   });
 
   // Function to display word search results
-  function displayWordResults(wordValue) {
-    // Check if the word exists in any topic's words and find relevant topics
+  async function displayWordResults(wordValue) {
+    // Topics with the most tokens of the word, from the word-topic index
     let relevantTopics = [];
-    if (topicKeysToUse && topicKeysToUse.length > 0) {
+    const wordTopics = await getWordTopics(wordValue).catch(() => null);
+    if (wordTopics && topicKeysToUse && topicKeysToUse.length > 0) {
+      relevantTopics = wordTopics
+        .filter(({ topic }) => topic < topicKeysToUse.length)
+        .slice(0, MAX_WORD_TOPICS)
+        .map(({ topic, count }) => ({
+          ...topicKeysToUse[topic],
+          topicNumber: topic + 1,
+          topicIndex: topic,
+          wordCount: count
+        }));
+    } else if (topicKeysToUse && topicKeysToUse.length > 0) {
+      // Otherwise check if the word exists in any topic's words
       relevantTopics = topicKeysToUse.map((topic, originalIndex) => ({
         ...topic,
         topicNumber: originalIndex + 1, // 1-based numbering for display
@@ -107,6 +162,7 @@ export async function loadWordView(topicKeys, docTopic, metadata, searchWord = n
     if (wordFound) {
       contentHTML += `<div id="word-topics-visualization"></div>`;
     }
+    contentHTML += await wordDocumentsHTML(wordValue, metadata);
 
     wordContent.innerHTML = contentHTML;
 
@@ -202,6 +258,7 @@ export async function loadWordView(topicKeys, docTopic, metadata, searchWord = n
         .style('height', '100%')
         .style('padding-right', '5px')
         .classed('topic-label', true)
+        .attr('title', d.wordCount ? `${d.wordCount} tokens of "${searchWord}"` : null)
         .text(labelText);
     });
 
@@ -3,6 +3,10 @@
 Simple HTTP server for SPA with HTML5 history routing.
 All requests are served index.html to allow client-side routing.
 
+Files with a pre-compressed sibling (file.br or file.gz, as written by
+prepare_data.py --compress) are sent compressed to browsers that accept the
+encoding.
+
 Usage:
     python3 server.py [port]
 
@@ -13,16 +17,94 @@ Examples:
     python3 server.py 5000     # Run on port 5000
 """
 
+import datetime
+import email.utils
 import http.server
 import os
 import socketserver
 import sys
+from contextlib import ExitStack
+from http import HTTPStatus
 from urllib.parse import unquote
 
 DEFAULT_PORT = 8000
 
+# Pre-compressed sibling suffixes, in order of preference
+ENCODING_SUFFIXES = [("br", ".br"), ("gzip", ".gz")]
+
+
+def accepted_encodings(header):
+    """Return the content codings an Accept-Encoding header allows."""
+    accepted = set()
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
 
 class SPAHandler(http.server.SimpleHTTPRequestHandler):
+    def send_head(self):
+        # Send a pre-compressed sibling if the browser accepts its encoding
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            accepted = accepted_encodings(self.headers.get("Accept-Encoding"))
+            for encoding, suffix in ENCODING_SUFFIXES:
+                sibling = path + suffix
+                # Skip siblings older than the file, left over from earlier runs
+                if (
+                    encoding in accepted
+                    and os.path.isfile(sibling)
+                    and os.path.getmtime(sibling) >= os.path.getmtime(path)
+                ):
+                    return self.send_compressed(path, sibling, encoding)
+        return super().send_head()
+
+    def not_modified_since(self, mtime):
+        """Whether If-Modified-Since allows a 304, as in send_head."""
+        if "If-Modified-Since" not in self.headers or "If-None-Match" in self.headers:
+            return False
+        try:
+            ims = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if ims.tzinfo is None:
+            ims = ims.replace(tzinfo=datetime.UTC)
+        if ims.tzinfo is not datetime.UTC:
+            return False
+        last_modified = datetime.datetime.fromtimestamp(mtime, datetime.UTC)
+        return last_modified.replace(microsecond=0) <= ims
+
+    def send_compressed(self, path, sibling, encoding):
+        with ExitStack() as stack:
+            f = stack.enter_context(open(sibling, "rb"))
+            fs = os.fstat(f.fileno())
+            if self.not_modified_since(fs.st_mtime):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return None
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-type", self.guess_type(path))
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(fs.st_size))
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header(
+                "Last-Modified", email.utils.formatdate(fs.st_mtime, usegmt=True)
+            )
+            self.end_headers()
+            # From here the caller closes the file
+            stack.pop_all()
+            return f
+
     def do_GET(self):
         # Decode URL
         path = unquote(self.path)
@@ -52,6 +134,8 @@ class SPAHandler(http.server.SimpleHTTPRequestHandler):
                     ".txt",
                     ".csv",
                     ".gz",
+                    ".br",
+                    ".bin",
                 ]
             ):
                 self.path = "/index.html"
@@ -0,0 +1,117 @@
+"""
+Pytest test suite for benchmark_prepare_data.py
+
+Run with: pytest test_benchmark_prepare_data.py -v
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add parent directory to path to import the module
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "bin"))
+
+from benchmark_prepare_data import (
+    check_golden,
+    compare_to_baseline,
+    golden_digests,
+    write_synthetic_state,
+)
+from prepare_data import read_state_counts
+
+
+@pytest.fixture
+def temp_output_dir():
+    """Create a temporary directory for test outputs."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield tmpdir
+
+
+def test_write_synthetic_state(temp_output_dir):
+    """Test that synthetic state files parse and follow their settings."""
+    state_file = os.path.join(temp_output_dir, "state.gz")
+    tokens = write_synthetic_state(
+        state_file, num_docs=30, tokens_per_doc=50, vocab_size=100, num_topics=4
+    )
+
+    counts = read_state_counts(state_file, engine="numpy")
+    assert counts.line_count == tokens
+    assert counts.num_docs == 30
+    assert counts.num_topics == 4
+    assert counts.doc_topic.sum() == tokens
+    assert len(counts.alpha) == 4
+    # The python engine splits sources with spaces the same way
+    python_counts = read_state_counts(state_file, engine="python")
+    assert np.array_equal(python_counts.doc_topic, counts.doc_topic)
+
+    with gzip.open(state_file, "rt") as f:
+        lines = f.read().splitlines()
+    assert " ".join(lines[3].split()[1:4]) == "file:/corpus/Volume 0/doc 0.txt"
+
+    # Same seed, same file
+    again = os.path.join(temp_output_dir, "again.gz")
+    write_synthetic_state(
+        again, num_docs=30, tokens_per_doc=50, vocab_size=100, num_topics=4
+    )
+    with gzip.open(again, "rt") as f:
+        assert f.read().splitlines() == lines
+
+
+def test_compare_to_baseline():
+    """Test that only slowdowns past the threshold and noise floor fail."""
+    baseline = {
+        "tiers": {
+            "small": {
+                "timings": {"jsd_matrix": 1.0, "compute_mds": 0.01, "stage:read": 2.0},
+                "golden": {"doc-topic.txt": "a", "topic-keys.txt": "b"},
+            }
+        }
+    }
+    results = {
+        "tiers": {
+            "small": {
+                "timings": {"jsd_matrix": 1.5, "compute_mds": 0.03, "stage:read": 2.1},
+                "golden": {"doc-topic.txt": "a", "topic-keys.txt": "c"},
+            },
+            "medium": {"timings": {"jsd_matrix": 9.0}},
+        }
+    }
+
+    failures = compare_to_baseline(results, baseline, threshold=0.25)
+
+    assert len(failures) == 2
+    assert failures[0].startswith("small: jsd_matrix took 1.500s, 50% slower")
+    assert failures[1] == "small: topic-keys.txt differs from the baseline output"
+
+
+def test_check_golden(temp_output_dir):
+    """Test that the fast paths write the reference files."""
+    state_file = os.path.join(temp_output_dir, "state.gz")
+    write_synthetic_state(
+        state_file,
+        num_docs=40,
+        tokens_per_doc=30,
+        vocab_size=200,
+        num_topics=5,
+        unused_topics=1,
+    )
+
+    reference, mismatches = check_golden(
+        state_file,
+        temp_output_dir,
+        {
+            "numpy": {"engine": "numpy", "workers": 2},
+            "writers": {"writers": 2},
+            "max_memory": {"engine": "numpy", "max_memory": 1 << 16},
+        },
+    )
+
+    assert mismatches == []
+    assert {"doc-topic.txt", "dt.zip", "topic-docs/topic-00004.bin"} <= set(reference)
+    assert "topic-docs/topic-00005.bin" not in reference
+    assert golden_digests(os.path.join(temp_output_dir, "writers")) == reference
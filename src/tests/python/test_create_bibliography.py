@@ -24,8 +24,11 @@ The following functions currently fail because there is no test file for them to
 """
 
 import json
+import subprocess
 import sys
 import tempfile
+import textwrap
+import time
 from pathlib import Path
 
 import pandas as pd
@@ -779,6 +782,53 @@ class TestIntegration:
             assert output.exists()
 
 
+# ============================================================================
+# Startup Tests
+# ============================================================================
+
+CLI_STARTUP_BUDGET = 1.0  # Seconds `create_bibliography.py --help` may take
+
+
+class TestStartup:
+    """Test that the CLI starts without loading its heavy dependencies."""
+
+    def test_import_skips_heavy_dependencies(self):
+        """Test that importing the module loads none of its dependencies."""
+        bin_dir = Path(__file__).parent.parent.parent / "bin"
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                textwrap.dedent(
+                    """
+                    import sys, create_bibliography
+                    heavy = ("pandas", "dateutil", "nameparser", "citeproc")
+                    print(*[m for m in heavy if m in sys.modules])
+                    """
+                ),
+            ],
+            cwd=bin_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == ""
+
+    def test_help_within_budget(self):
+        """Test that --help runs within the startup budget."""
+        script = Path(__file__).parent.parent.parent / "bin" / "create_bibliography.py"
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, str(script), "--help"],
+                capture_output=True,
+                check=True,
+            )
+            times.append(time.perf_counter() - start)
+        assert min(times) < CLI_STARTUP_BUDGET
+
+
 # ============================================================================
 # Run tests
 # ============================================================================
@@ -4,30 +4,49 @@ Pytest test suite for prepare_data.py
 Run with: pytest test_prepare_dfr_data.py -v
 """
 
+import bz2
 import gzip
 import json
+import lzma
 import os
+import shutil
+import subprocess
 import sys
 import tempfile
+import textwrap
+import time
 import zipfile
+from itertools import pairwise
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 import pytest
+from scipy import sparse
 
 # Add parent directory to path to import the module
 sys.path.insert(0, str(Path(__file__).parent.parent.parent / "bin"))
 
+import prepare_data
 from prepare_data import (
+    PARSE_ENGINES,
+    classical_mds,
     compute_mds,
+    doc_topic_csc,
     get_top_words_and_weights,
     jensen_shannon,
     jsd_matrix,
+    layout_stress,
     normalize_doc_topic_proportions,
+    open_state_file,
+    parse_state_block,
+    parse_state_line,
     process_mallet_state_file,
+    read_state_counts,
     sparse_doc_topic_matrix,
+    topic_word_distributions,
     topic_word_matrix_from_topic_words,
+    warm_start_layout,
     write_basic_metadata_csv,
     write_doc_topic_counts_csv,
     write_doc_topic_txt,
@@ -67,11 +86,13 @@ def sample_topic_words():
 @pytest.fixture
 def sample_doc_topic_counts():
     """Sample document-topic counts."""
-    return [
-        {0: 10, 1: 5, 2: 2},  # Doc 0
-        {0: 3, 1: 15, 2: 1},  # Doc 1
-        {0: 1, 1: 2, 2: 20},  # Doc 2
-    ]
+    return np.array(
+        [
+            [10, 5, 2],  # Doc 0
+            [3, 15, 1],  # Doc 1
+            [1, 2, 20],  # Doc 2
+        ]
+    )
 
 
 @pytest.fixture
@@ -108,6 +129,28 @@ def sample_state_file(temp_output_dir):
     return state_file
 
 
+@pytest.fixture
+def spaced_state_file(temp_output_dir):
+    """Create a MALLET state file whose sources contain spaces."""
+    state_file = os.path.join(temp_output_dir, "spaced-state.gz")
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta"]
+
+    with gzip.open(state_file, "wt") as f:
+        f.write("#doc source pos typeindex type topic\n")
+        f.write("#alpha : 0.1 0.2 0.3 0.4\n")
+        f.write("#beta : 0.01\n")
+        for doc in range(40):
+            source = f"file:/My Documents/doc {doc}.txt"
+            for pos in range(25 + doc % 7):
+                type_index = (doc * 7 + pos * 3) % len(words)
+                topic = (doc + pos * pos) % 4
+                f.write(
+                    f"{doc} {source} {pos} {type_index} {words[type_index]} {topic}\n"
+                )
+
+    return state_file
+
+
 # --- Test utility functions ---
 
 
@@ -127,6 +170,38 @@ def test_get_top_words_and_weights():
     assert result["weights"] == [20, 15, 10]
 
 
+def test_get_top_words_and_weights_ties():
+    """Test that ties are broken by word index, as a stable sort would."""
+    word_counts = np.array([3, 7, 3, 0, 7, 3, 1])
+    vocab = [f"word{i}" for i in range(7)]
+
+    result = get_top_words_and_weights(word_counts, vocab, 4)
+
+    assert result["words"] == ["word1", "word4", "word0", "word2"]
+    assert result["weights"] == [7, 7, 3, 3]
+    assert get_top_words_and_weights(word_counts, vocab, 20)["weights"] == [
+        7,
+        7,
+        3,
+        3,
+        3,
+        1,
+        0,
+    ]
+
+
+def test_sparse_topic_word_counts(spaced_state_file, monkeypatch):
+    """Test that a sparse topic-word matrix gives the same counts."""
+    dense = read_state_counts(spaced_state_file, engine="numpy")
+    monkeypatch.setattr(prepare_data, "DENSE_TOPIC_WORD_LIMIT", 0)
+    for engine in PARSE_ENGINES:
+        counts = read_state_counts(spaced_state_file, engine=engine)
+        assert sparse.issparse(counts.topic_word)
+        assert np.array_equal(counts.topic_word.toarray(), dense.topic_word)
+        assert np.array_equal(counts.doc_topic, dense.doc_topic)
+        assert counts.vocab == dense.vocab
+
+
 def test_sparse_doc_topic_matrix():
     """Test conversion to sparse matrix format."""
     dense_matrix = [
@@ -169,11 +244,12 @@ def test_normalize_doc_topic_proportions(sample_doc_topic_counts):
 
 def test_normalize_empty_document():
     """Test normalization with empty document."""
-    doc_counts = [{}]  # Empty document
+    doc_counts = np.array([[0, 0, 0], [1, 0, 3]])  # Doc 0 is empty
     proportions = normalize_doc_topic_proportions(doc_counts)
 
-    assert len(proportions) == 1
-    assert proportions[0] == []
+    assert len(proportions) == 2
+    assert proportions[0].tolist() == [0.0, 0.0, 0.0]
+    assert proportions[1].tolist() == [0.25, 0.0, 0.75]
 
 
 # --- Test coordinate generation functions ---
@@ -229,6 +305,31 @@ def test_jsd_matrix():
     assert abs(dist[0, 1]) < 1e-10
 
 
+def test_jsd_matrix_matches_pairwise():
+    """Test the blocked JSD matrix against pairwise jensen_shannon calls."""
+    rng = np.random.default_rng(0)
+    mat = rng.random((7, 12)) * (rng.random((7, 12)) > 0.4)
+    mat /= mat.sum(axis=1, keepdims=True)
+    expected = np.array([[jensen_shannon(p, q) for q in mat] for p in mat])
+
+    assert np.allclose(jsd_matrix(mat), expected, atol=1e-12)
+    assert np.allclose(jsd_matrix(mat, block_size=2, n_jobs=3), expected, atol=1e-12)
+    assert np.allclose(jsd_matrix(sparse.csr_matrix(mat), block_size=3), expected)
+
+
+def test_jsd_matrix_smoothed_sparse():
+    """Test that sparse counts plus smoothing match dense smoothed distributions."""
+    counts = np.array([[5, 0, 0, 2, 0], [0, 3, 0, 0, 0], [1, 1, 0, 0, 7]])
+    beta = 0.1
+    dense = (counts + beta) / (counts.sum(axis=1, keepdims=True) + 5 * beta)
+    expected = np.array([[jensen_shannon(p, q) for q in dense] for p in dense])
+
+    mat, smoothing = topic_word_distributions(sparse.csr_matrix(counts), beta)
+
+    assert np.allclose(mat.toarray() + smoothing[:, None], dense)
+    assert np.allclose(jsd_matrix(mat, smoothing=smoothing), expected)
+
+
 def test_compute_mds():
     """Test MDS coordinate computation."""
     # Create a simple distance matrix
@@ -245,6 +346,47 @@ def test_compute_mds():
     assert coords.shape == (3, 2)  # 3 topics, 2D coordinates
 
 
+def test_compute_mds_cold_start_uses_sklearn_defaults():
+    """Test that random starts are not stopped early by the warm-start tolerance."""
+    from sklearn.manifold import MDS
+
+    rng = np.random.default_rng(0)
+    points = rng.random((12, 5))
+    dist = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+
+    expected = MDS(
+        n_components=2,
+        dissimilarity="precomputed",
+        random_state=42,
+        n_init=4,
+        max_iter=300,
+    ).fit_transform(dist)
+    assert np.array_equal(compute_mds(dist, tol=0.5), expected)
+
+
+def test_classical_mds_recovers_euclidean_layout():
+    """Test that classical MDS reproduces distances of a planar layout."""
+    rng = np.random.default_rng(1)
+    points = rng.random((6, 2))
+    dist = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+
+    coords = compute_mds(dist, engine="classical")
+
+    assert coords.shape == (6, 2)
+    assert layout_stress(dist, coords) < 1e-8
+    assert np.array_equal(coords, classical_mds(dist))
+
+
+def test_layout_stress():
+    """Test stress-1 of a layout that doubles every distance."""
+    dist = np.array([[0.0, 1.0], [1.0, 0.0]])
+    coords = np.array([[0.0, 0.0], [2.0, 0.0]])
+
+    assert layout_stress(dist, coords) == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        compute_mds(dist, engine="tsne")
+
+
 # --- Test file writing functions ---
 
 
@@ -291,6 +433,201 @@ def test_write_doc_topic_txt(temp_output_dir):
     assert len(parts) == 5  # docNum, docName, 3 proportions
 
 
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 1e-7), ("uint16", 1e-5)])
+def test_write_doc_topic_bin(temp_output_dir, dtype, tolerance):
+    """Test doc-topic.bin generation and round trip."""
+    counts = np.array([[5, 3, 2], [1, 7, 2], [0, 0, 0]])
+    proportions = normalize_doc_topic_proportions(counts)
+
+    prepare_data.write_doc_topic_bin(
+        prepare_data.iter_doc_proportions(counts, chunk_rows=2),
+        3,
+        3,
+        temp_output_dir,
+        dtype=dtype,
+    )
+
+    filepath = os.path.join(temp_output_dir, "doc-topic.bin")
+    with open(filepath, "rb") as f:
+        assert f.read(4) == b"DFRT"
+        header_length = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_length))
+    assert (8 + header_length) % 8 == 0
+    assert header["numDocs"] == 3
+    assert header["numTopics"] == 3
+    assert header["dtype"] == dtype
+
+    values = prepare_data.read_doc_topic_bin(filepath)
+    assert values.dtype == np.float32
+    assert np.allclose(values, proportions, atol=tolerance)
+
+
+def test_write_doc_counts_bin(sample_doc_topic_counts, temp_output_dir):
+    """Test doc-lengths.bin and doc-topic-counts.bin round trips."""
+    prepare_data.write_doc_lengths_bin(sample_doc_topic_counts, temp_output_dir)
+    prepare_data.write_doc_topic_counts_bin(
+        sample_doc_topic_counts, temp_output_dir, chunk_rows=2
+    )
+
+    header, arrays = prepare_data.read_binary_arrays(
+        os.path.join(temp_output_dir, "doc-lengths.bin")
+    )
+    assert header["numDocs"] == 3
+    assert arrays["lengths"].tolist() == sample_doc_topic_counts.sum(axis=1).tolist()
+
+    header, arrays = prepare_data.read_binary_arrays(
+        os.path.join(temp_output_dir, "doc-topic-counts.bin")
+    )
+    assert arrays["indices"].dtype == np.dtype("<u2")
+    for spec in header["arrays"].values():
+        assert spec["offset"] % 8 == 0
+    matrix = sparse.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=(header["numDocs"], header["numTopics"]),
+    )
+    assert np.array_equal(matrix.toarray(), sample_doc_topic_counts)
+
+
+def test_write_word_topics(temp_output_dir):
+    """Test vocab.txt ordering and the word-topics.bin index."""
+    topic_word = np.array([[5, 0, 1, 0], [2, 3, 0, 0]])
+    vocab = ["alpha", "beta", "gamma", "delta"]
+
+    prepare_data.write_word_topics(
+        sparse.csr_matrix(topic_word), vocab, temp_output_dir
+    )
+
+    with open(os.path.join(temp_output_dir, "vocab.txt")) as f:
+        lines = [line.rstrip("\n").split("\t") for line in f]
+    assert lines == [["alpha", "7"], ["beta", "3"], ["gamma", "1"], ["delta", "0"]]
+
+    header, arrays = prepare_data.read_binary_arrays(
+        os.path.join(temp_output_dir, "word-topics.bin")
+    )
+    word_topic = sparse.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=(header["numWords"], header["numTopics"]),
+    )
+    assert np.array_equal(word_topic.toarray(), topic_word.T)
+
+
+def test_write_topic_docs(temp_output_dir):
+    """Test per-topic top documents, ranked with ties in document order."""
+    counts = np.array([[2, 2], [0, 3], [1, 3], [4, 0], [1, 1], [0, 0]])
+
+    prepare_data.write_topic_docs(counts, temp_output_dir, top_docs=3, chunk_rows=2)
+
+    expected = {0: ([3, 0, 4], [4, 2, 1]), 1: ([1, 2, 0], [3, 3, 2])}
+    for topic, (docs, topic_counts) in expected.items():
+        header, arrays = prepare_data.read_binary_arrays(
+            os.path.join(temp_output_dir, "topic-docs", f"topic-{topic:05d}.bin")
+        )
+        assert header["docsWithTopic"] == 4
+        assert arrays["docs"].tolist() == docs
+        assert arrays["counts"].tolist() == topic_counts
+        assert np.allclose(
+            arrays["proportions"], counts[docs, topic] / counts[docs].sum(axis=1)
+        )
+
+
+def test_write_metadata_facets(temp_output_dir):
+    """Test topic totals and document lists by metadata bucket."""
+    counts = np.array([[2, 2], [0, 3], [1, 3], [4, 0], [1, 1], [0, 0]])
+    metadata_file = os.path.join(temp_output_dir, "metadata.csv")
+    pd.DataFrame(
+        {
+            "year": ["1999", "2001", "", "1999", "10", "2001"],
+            "date": ["1999-03-01", "2001-01-05", "", "1999-04-02", "", "x"],
+        }
+    ).to_csv(metadata_file, index=False)
+
+    prepare_data.write_metadata_facets(
+        counts, metadata_file, temp_output_dir, ("year", "date:month"), chunk_rows=4
+    )
+
+    header, arrays = prepare_data.read_binary_arrays(
+        os.path.join(temp_output_dir, "facets", "year.bin")
+    )
+    # Numeric labels sort numerically; documents without a year are left out
+    assert header["buckets"] == ["10", "1999", "2001"]
+    assert arrays["docCounts"].tolist() == [1, 2, 2]
+    assert arrays["topicTokens"].reshape(2, 3).tolist() == [[1, 6, 0], [1, 2, 3]]
+    assert np.allclose(
+        arrays["proportionSums"].reshape(2, 3), [[0.5, 1.5, 0.0], [0.5, 0.5, 1.0]]
+    )
+    assert arrays["offsets"].tolist() == [0, 1, 3, 5]
+    assert arrays["docs"].tolist() == [4, 0, 3, 1, 5]
+
+    header, arrays = prepare_data.read_binary_arrays(
+        os.path.join(temp_output_dir, "facets", "date-month.bin")
+    )
+    assert header["buckets"] == ["1999-03", "1999-04", "2001-01"]
+    assert arrays["docs"].tolist() == [0, 3, 1]
+
+    # Documents a sample skipped are in no bucket
+    sampled_docs = np.array([True, False, True, True, False, True])
+    prepare_data.write_metadata_facets(
+        counts, metadata_file, temp_output_dir, ("year",), sampled_docs=sampled_docs
+    )
+    header, arrays = prepare_data.read_binary_arrays(
+        os.path.join(temp_output_dir, "facets", "year.bin")
+    )
+    assert header["buckets"] == ["10", "1999", "2001"]
+    assert arrays["docCounts"].tolist() == [0, 2, 1]
+    assert arrays["docs"].tolist() == [0, 3, 5]
+
+
+def test_varint_round_trip():
+    """Test LEB128 varint encoding."""
+    values = np.array([0, 1, 127, 128, 300, 2**21, 2**32 + 5], dtype=np.uint64)
+    encoded = prepare_data.encode_varints(values)
+    assert encoded[:4].tolist() == [0, 1, 127, 0x80]
+    assert np.array_equal(prepare_data.decode_varints(encoded), values)
+
+
+@pytest.mark.parametrize("shard_tokens", [prepare_data.INDEX_SHARD_TOKENS, 30])
+def test_write_word_doc_index(
+    spaced_state_file, temp_output_dir, monkeypatch, shard_tokens
+):
+    """Test the word-doc index against postings counted line by line."""
+    # Small shards split the words, and give the most frequent words
+    # shards of their own
+    monkeypatch.setattr(prepare_data, "INDEX_SHARD_TOKENS", shard_tokens)
+    counts = read_state_counts(spaced_state_file)
+    prepare_data.write_word_doc_index(
+        spaced_state_file,
+        counts.topic_word,
+        temp_output_dir,
+        block_size=256,
+        buffer_postings=16,
+    )
+
+    order, _ = prepare_data.vocabulary_order(counts.topic_word)
+    expected = {}
+    with gzip.open(spaced_state_file, "rt") as f:
+        for line in f:
+            if not line.startswith("#"):
+                doc, type_index, _, topic = parse_state_line(line)
+                key = (type_index, doc, topic)
+                expected[key] = expected.get(key, 0) + 1
+
+    with open(os.path.join(temp_output_dir, "word-docs", "index.json")) as f:
+        manifest = json.load(f)
+    assert manifest["numWords"] == len(order)
+    assert (len(manifest["shards"]) > 1) == (shard_tokens == 30)
+    for word_id, type_index in enumerate(order):
+        postings = prepare_data.read_word_postings(temp_output_dir, word_id)
+        assert postings.tolist() == [
+            [doc, topic, count]
+            for (t, doc, topic), count in sorted(expected.items())
+            if t == type_index
+        ]
+    assert not any(
+        name.endswith(".run")
+        for name in os.listdir(os.path.join(temp_output_dir, "word-docs"))
+    )
+
+
 def test_write_topic_coords_csv(sample_topic_words, temp_output_dir):
     """Test topic_coords.csv generation."""
     write_topic_coords_csv(sample_topic_words, temp_output_dir, top_n=5)
@@ -305,6 +642,57 @@ def test_write_topic_coords_csv(sample_topic_words, temp_output_dir):
     assert df["topic"].tolist() == [0, 1, 2]
 
 
+def test_write_topic_coords_csv_full_distributions(sample_topic_words, temp_output_dir):
+    """Test topic_coords.csv generation from full topic-word counts."""
+    topic_word = np.array([[9, 1, 0, 0], [0, 8, 2, 0], [0, 0, 3, 7]])
+    write_topic_coords_csv(
+        sample_topic_words, temp_output_dir, topic_word=topic_word, beta=0.01
+    )
+
+    df = pd.read_csv(os.path.join(temp_output_dir, "topic_coords.csv"))
+
+    assert df["topic"].tolist() == [0, 1, 2]
+    assert np.isfinite(df[["x", "y"]].to_numpy()).all()
+
+
+def test_write_topic_coords_csv_warm_start(temp_output_dir):
+    """Test that a warm-started layout stays in place across model versions."""
+    rng = np.random.default_rng(2)
+    topic_word = rng.integers(0, 20, size=(6, 30))
+    topic_words = [{"words": [], "weights": []} for _ in range(6)]
+    write_topic_coords_csv(topic_words, temp_output_dir, topic_word=topic_word)
+    previous_path = os.path.join(temp_output_dir, "previous_coords.csv")
+    os.rename(os.path.join(temp_output_dir, "topic_coords.csv"), previous_path)
+    previous = pd.read_csv(previous_path)
+
+    # The new model lists the same topics in reverse order
+    write_topic_coords_csv(
+        topic_words,
+        temp_output_dir,
+        topic_word=topic_word[::-1],
+        previous_coords=previous_path,
+        topic_alignment={t: 5 - t for t in range(6)},
+    )
+    df = pd.read_csv(os.path.join(temp_output_dir, "topic_coords.csv"))
+
+    expected = previous[["x", "y"]].to_numpy()[::-1]
+    scale = np.ptp(expected, axis=0).max()
+    assert np.abs(df[["x", "y"]].to_numpy() - expected).max() < 0.05 * scale
+
+
+def test_warm_start_layout_places_new_topics():
+    """Test that unaligned topics start next to their nearest aligned topic."""
+    dist = np.array([[0.0, 0.9, 0.1], [0.9, 0.0, 0.8], [0.1, 0.8, 0.0]])
+    previous = pd.DataFrame({"topic": [0, 1], "x": [0.0, 1.0], "y": [0.0, 1.0]})
+
+    init, matched = warm_start_layout(dist, previous)
+
+    assert matched.tolist() == [0, 1]
+    assert init[:2].tolist() == [[0.0, 0.0], [1.0, 1.0]]
+    assert np.linalg.norm(init[2] - init[0]) < 0.05
+    assert warm_start_layout(dist, previous, {0: 7})[0] is None
+
+
 def test_write_doc_topic_counts_csv(sample_doc_topic_counts, temp_output_dir):
     """Test doc-topic-counts.csv generation."""
     write_doc_topic_counts_csv(sample_doc_topic_counts, 3, temp_output_dir)
@@ -373,6 +761,872 @@ def test_write_doc_topics_zip(temp_output_dir):
         assert "dt.json" in zf.namelist()
         data = json.loads(zf.read("dt.json"))
         assert data == sparse_matrix
+        assert zf.getinfo("dt.json").compress_type == zipfile.ZIP_DEFLATED
+
+
+@pytest.mark.parametrize("chunk_rows", [None, 1, 4])
+def test_doc_topic_csc(chunk_rows, temp_output_dir):
+    """Test the vectorized sparse matrix against a per-topic scan."""
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 5, (10, 4)) * (rng.random((10, 4)) < 0.4)
+
+    csc = doc_topic_csc(counts, chunk_rows)
+
+    indices, indptr, data = [], [0], []
+    for topic_counts in counts.T:
+        nonzero = np.flatnonzero(topic_counts)
+        indices += nonzero.tolist()
+        data += topic_counts[nonzero].tolist()
+        indptr.append(len(indices))
+    assert csc["i"].tolist() == indices
+    assert csc["p"].tolist() == indptr
+    assert csc["x"].tolist() == data
+
+    # Built out of core, the arrays are memory-mapped but the same
+    spill_path = os.path.join(temp_output_dir, "csc")
+    mapped = doc_topic_csc(counts, chunk_rows, spill_path)
+    assert isinstance(mapped["i"], np.memmap)
+    assert isinstance(mapped["x"], np.memmap)
+    assert all(np.array_equal(mapped[key], csc[key]) for key in csc)
+    mapped = None
+    os.remove(spill_path + ".i")
+    os.remove(spill_path + ".x")
+
+    # The streamed dt.json is what json.dumps gives for the same lists
+    write_doc_topics_zip(csc, temp_output_dir, compresslevel=9)
+    with zipfile.ZipFile(os.path.join(temp_output_dir, "dt.zip")) as zf:
+        assert (
+            zf.read("dt.json")
+            == json.dumps({"i": indices, "p": indptr, "x": data}).encode()
+        )
+        info = zf.getinfo("dt.json")
+    assert info.date_time == (1980, 1, 1, 0, 0, 0)
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    best = info.compress_size
+
+    # The level reaches the streamed entry
+    write_doc_topics_zip(csc, temp_output_dir, compresslevel=0)
+    with zipfile.ZipFile(os.path.join(temp_output_dir, "dt.zip")) as zf:
+        assert zf.getinfo("dt.json").compress_size > best
+
+
+# --- Test state parsing engines ---
+
+
+def test_write_compressed_siblings(temp_output_dir):
+    """Test .gz siblings, skipped where compression does not help."""
+    doc_topic = os.path.join(temp_output_dir, "doc-topic.txt")
+    with open(doc_topic, "w") as f:
+        f.write("0.25\t0.75\n" * 1000)
+    tiny = os.path.join(temp_output_dir, "tiny.json")
+    with open(tiny, "w") as f:
+        f.write("{}")
+
+    zipped = os.path.join(temp_output_dir, "dt.zip")
+    paths = prepare_data.compressible_outputs([tiny, zipped, doc_topic])
+    assert paths == [doc_topic, tiny]
+    written = prepare_data.write_compressed_siblings(paths, encodings=["gzip"])
+
+    assert written == [doc_topic + ".gz"]
+    with gzip.open(doc_topic + ".gz", "rt") as f:
+        assert f.read() == "0.25\t0.75\n" * 1000
+    assert not os.path.exists(tiny + ".gz")
+
+
+@pytest.mark.parametrize("profile", [False, True])
+def test_compress_only_written_files(spaced_state_file, temp_output_dir, profile):
+    """Test that --compress leaves files the run did not write alone."""
+    unrelated = os.path.join(temp_output_dir, "other-model", "doc-topic.txt")
+    os.makedirs(os.path.dirname(unrelated))
+    with open(unrelated, "w") as f:
+        f.write("0.25\t0.75\n" * 1000)
+
+    process_mallet_state_file(
+        spaced_state_file, temp_output_dir, compress=True, profile=profile
+    )
+
+    assert os.path.exists(os.path.join(temp_output_dir, "doc-topic.txt.gz"))
+    assert os.path.exists(
+        os.path.join(temp_output_dir, "topic-docs", "topic-00000.bin.gz")
+    )
+    assert not os.path.exists(unrelated + ".gz")
+    for name in [prepare_data.SEEK_INDEX_FILENAME, prepare_data.PROFILE_FILENAME]:
+        assert not os.path.exists(os.path.join(temp_output_dir, name + ".gz"))
+
+
+@pytest.mark.parametrize(
+    "compression", ["plain", "gzip", "two gzip members", "bz2", "xz"]
+)
+@pytest.mark.parametrize("pipelined", [True, False])
+def test_open_state_file_formats(
+    spaced_state_file, temp_output_dir, compression, pipelined
+):
+    """Test that state files are read alike whatever their compression."""
+    with gzip.open(spaced_state_file, "rb") as f:
+        text = f.read()
+    compressors = {
+        "plain": lambda data: data,
+        "gzip": gzip.compress,
+        "two gzip members": lambda data: (
+            gzip.compress(data[:1000]) + b"\0" * 8 + gzip.compress(data[1000:])
+        ),
+        "bz2": bz2.compress,
+        "xz": lzma.compress,
+    }
+    # The format is detected from the contents, not the name
+    state_file = os.path.join(temp_output_dir, "topic-state")
+    with open(state_file, "wb") as f:
+        f.write(compressors[compression](text))
+
+    with open_state_file(state_file, pipelined=pipelined) as f:
+        assert f.read() == text
+    with open_state_file(state_file, text=True, pipelined=pipelined) as f:
+        assert f.read() == text.decode("utf-8")
+    expected = read_state_counts(spaced_state_file, engine="python")
+    for engine in PARSE_ENGINES:
+        counts = read_state_counts(state_file, engine=engine)
+        assert np.array_equal(counts.doc_topic, expected.doc_topic)
+        assert counts.vocab == expected.vocab
+
+
+def test_open_state_file_truncated(spaced_state_file, temp_output_dir):
+    """Test that a truncated compressed state file is an error."""
+    truncated = os.path.join(temp_output_dir, "truncated.gz")
+    with open(spaced_state_file, "rb") as f, open(truncated, "wb") as out:
+        out.write(f.read()[:-20])
+
+    with pytest.raises(EOFError), open_state_file(truncated) as f:
+        f.read()
+
+
+def test_state_file_from_stdin(spaced_state_file, temp_output_dir):
+    """Test piping a state file into the CLI."""
+    output_dir = os.path.join(temp_output_dir, "piped")
+    with open(spaced_state_file, "rb") as f:
+        subprocess.run(
+            [sys.executable, prepare_data.__file__, "-", "-o", output_dir],
+            stdin=f,
+            capture_output=True,
+            check=True,
+        )
+    process_mallet_state_file(spaced_state_file, temp_output_dir)
+
+    for name in ["doc-topic.txt", "topic-keys.txt", "vocab.txt"]:
+        with (
+            open(os.path.join(output_dir, name), "rb") as a,
+            open(os.path.join(temp_output_dir, name), "rb") as b,
+        ):
+            assert a.read() == b.read(), name
+
+
+@pytest.mark.parametrize("compression", ["plain", "gzip", "gzip without zran", "xz"])
+def test_state_seek_index(spaced_state_file, temp_output_dir, monkeypatch, compression):
+    """Test reading ranges of documents through the seek index."""
+    with gzip.open(spaced_state_file, "rb") as f:
+        text = f.read()
+
+    state_file = spaced_state_file
+    if compression == "plain":
+        state_file = os.path.join(temp_output_dir, "topic-state.txt")
+        with open(state_file, "wb") as f:
+            f.write(text)
+    elif compression == "gzip":
+        pytest.importorskip("indexed_gzip")
+        # Eight copies of the documents, stored, span several seek points
+        lines = text.splitlines(keepends=True)
+        text = b"".join(lines[:3]) + b"".join(
+            b"%d %s" % (int(doc) + 40 * copy, rest)
+            for copy in range(8)
+            for doc, rest in (line.split(b" ", 1) for line in lines[3:])
+        )
+        state_file = os.path.join(temp_output_dir, "topic-state.gz")
+        with open(state_file, "wb") as f:
+            f.write(gzip.compress(text, compresslevel=0))
+    else:
+        # No seek points, so no index
+        if compression == "xz":
+            state_file = os.path.join(temp_output_dir, "topic-state.xz")
+            with open(state_file, "wb") as f:
+                f.write(lzma.compress(text))
+        else:
+            monkeypatch.setattr(prepare_data, "seek_backend", lambda: None)
+        with pytest.raises(ValueError):
+            prepare_data.build_state_seek_index(
+                state_file, os.path.join(temp_output_dir, "state-seek.bin")
+            )
+        return
+    lines = text.splitlines(keepends=True)[3:]
+    docs = np.array([int(line.split(b" ")[0]) for line in lines])
+
+    index_path = os.path.join(temp_output_dir, "state-seek.bin")
+    # The smallest spacing, just over the 32 KiB window
+    header = prepare_data.build_state_seek_index(
+        state_file, index_path, spacing=(1 << 15) + 1
+    )
+    assert header["numDocs"] == docs[-1] + 1
+    _, arrays = prepare_data.read_binary_arrays(index_path)
+    if compression == "gzip":
+        assert len(arrays["pointsIn"]) > 1
+        assert len(arrays["zran"]) > 0
+    else:
+        assert len(arrays["pointsIn"]) == 0
+
+    num_docs = header["numDocs"]
+    for start, stop in [(0, 1), (7, 19), (num_docs // 2, num_docs), (12, 12)]:
+        expected = b"".join(
+            line for line, doc in zip(lines, docs) if start <= doc < stop
+        )
+        assert prepare_data.read_state_docs(state_file, index_path, start, stop) == (
+            expected
+        )
+    with pytest.raises(IndexError):
+        prepare_data.read_state_docs(state_file, index_path, 0, num_docs + 1)
+
+    # A reader keeps the index and the file open between reads
+    with prepare_data.StateDocReader(state_file, index_path) as reader:
+        for doc in [num_docs - 1, 0, num_docs // 2]:
+            assert reader.read(doc) == prepare_data.read_state_docs(
+                state_file, index_path, doc
+            )
+
+    # Seek points closer than their windows cannot be saved
+    with pytest.raises(ValueError):
+        prepare_data.build_state_seek_index(state_file, index_path, spacing=1 << 14)
+
+    # A changed state file needs a new index
+    os.utime(state_file, ns=(0, 0))
+    assert prepare_data.load_state_seek_index(index_path, state_file) is None
+    with pytest.raises(ValueError):
+        prepare_data.read_state_docs(state_file, index_path, 0)
+
+
+@pytest.mark.parametrize("compression", ["plain", "gzip"])
+def test_process_writes_seek_index(
+    spaced_state_file, temp_output_dir, monkeypatch, compression
+):
+    """Test that the seek index is written on request, reused and split by workers."""
+    state_file = spaced_state_file
+    if compression == "plain":
+        state_file = os.path.join(temp_output_dir, "topic-state.txt")
+        with gzip.open(spaced_state_file, "rb") as f, open(state_file, "wb") as out:
+            out.write(f.read())
+    else:
+        pytest.importorskip("indexed_gzip")
+    exact_dir = os.path.join(temp_output_dir, "exact")
+    process_mallet_state_file(state_file, exact_dir, generate_all=True)
+    assert not os.path.exists(os.path.join(exact_dir, prepare_data.SEEK_INDEX_FILENAME))
+
+    # Small blocks so the documents are split into several ranges
+    monkeypatch.setattr(prepare_data, "STATE_BLOCK_SIZE", 512)
+    split_dir = os.path.join(temp_output_dir, "split")
+    process_mallet_state_file(
+        state_file,
+        split_dir,
+        generate_all=True,
+        engine="numpy",
+        workers=2,
+        seek_index=True,
+    )
+    index_path = os.path.join(split_dir, prepare_data.SEEK_INDEX_FILENAME)
+    assert prepare_data.read_state_docs(state_file, index_path, 3).startswith(
+        b"3 file:/My Documents/doc 3.txt 0 "
+    )
+    index = prepare_data.load_state_seek_index(index_path, state_file)
+    assert len(prepare_data.state_doc_ranges(index)) > 1
+    for name in [
+        "doc-topic.txt",
+        "doc-topic-counts.csv",
+        "topic-keys.txt",
+        "vocab.txt",
+    ]:
+        with (
+            open(os.path.join(exact_dir, name), "rb") as a,
+            open(os.path.join(split_dir, name), "rb") as b,
+        ):
+            assert a.read() == b.read(), name
+
+    def fail(*args, **kwargs):
+        raise AssertionError("seek index built again")
+
+    monkeypatch.setattr(prepare_data, "build_state_seek_index", fail)
+    process_mallet_state_file(state_file, split_dir, seek_index=True)
+
+
+def test_seek_index_needs_seek_points(spaced_state_file, temp_output_dir, monkeypatch):
+    """Test that --seek-index fails before reading a state it cannot index."""
+    monkeypatch.setattr(prepare_data, "seek_backend", lambda: None)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("state file read")
+
+    monkeypatch.setattr(prepare_data, "read_state_counts", fail)
+    with pytest.raises(ValueError, match="indexed_gzip"):
+        process_mallet_state_file(spaced_state_file, temp_output_dir, seek_index=True)
+    with pytest.raises(ValueError):
+        process_mallet_state_file("-", temp_output_dir, seek_index=True)
+
+
+def test_parse_state_line_source_with_spaces():
+    """Test that fields are read from the right when the source has spaces."""
+    parsed = parse_state_line("3 file:/My Documents/a b.txt 12 45 word 7\n")
+    assert parsed == (3, 45, "word", 7)
+    assert parse_state_line("3 word 7\n") is None
+
+
+def test_parse_state_block():
+    """Test bulk parsing of a block of token lines."""
+    block = (
+        b"0 doc one 0 5 apple 2\n0 doc one 1 9 pear 0\r\nshort line\n1 d 0 5 apple 11\n"
+    )
+    docs, types, topics, word_starts, word_ends, line_count = parse_state_block(block)
+
+    assert line_count == 4
+    assert docs.tolist() == [0, 0, 1]
+    assert types.tolist() == [5, 9, 5]
+    assert topics.tolist() == [2, 0, 11]
+    assert [block[s:e] for s, e in zip(word_starts, word_ends)] == [
+        b"apple",
+        b"pear",
+        b"apple",
+    ]
+
+
+def test_parse_state_block_rejects_bad_integers():
+    """Test that malformed integer fields raise like int() does."""
+    with pytest.raises(ValueError):
+        parse_state_block(b"0 doc 0 x1 word 2\n")
+
+
+def test_numpy_engine_matches_python_engine(spaced_state_file, monkeypatch):
+    """Test that both parse engines write byte-identical files."""
+    # Small blocks so documents straddle block boundaries
+    monkeypatch.setattr(prepare_data, "STATE_BLOCK_SIZE", 512)
+    with (
+        tempfile.TemporaryDirectory() as python_dir,
+        tempfile.TemporaryDirectory() as numpy_dir,
+    ):
+        process_mallet_state_file(
+            spaced_state_file, python_dir, n_top_words=4, generate_all=True
+        )
+        process_mallet_state_file(
+            spaced_state_file,
+            numpy_dir,
+            n_top_words=4,
+            generate_all=True,
+            engine="numpy",
+        )
+        names = sorted(
+            str(path.relative_to(python_dir))
+            for path in Path(python_dir).rglob("*")
+            if path.is_file()
+        )
+        assert names == sorted(
+            str(path.relative_to(numpy_dir))
+            for path in Path(numpy_dir).rglob("*")
+            if path.is_file()
+        )
+        for name in names:
+            with (
+                open(os.path.join(python_dir, name), "rb") as a,
+                open(os.path.join(numpy_dir, name), "rb") as b,
+            ):
+                assert a.read() == b.read(), name
+
+
+def test_parallel_parsing_matches_single_process(spaced_state_file, monkeypatch):
+    """Test that parsing with worker processes gives identical counts."""
+    monkeypatch.setattr(prepare_data, "STATE_BLOCK_SIZE", 512)
+    single = read_state_counts(spaced_state_file, engine="numpy")
+    parallel = read_state_counts(spaced_state_file, engine="numpy", workers=3)
+
+    assert np.array_equal(parallel.doc_topic, single.doc_topic)
+    assert np.array_equal(parallel.topic_word, single.topic_word)
+    assert parallel.vocab == single.vocab
+    assert parallel.line_count == single.line_count
+    with pytest.raises(ValueError):
+        read_state_counts(spaced_state_file, engine="python", workers=2)
+
+
+@pytest.mark.parametrize("chunk_tokens", [10, 1 << 21])
+def test_binary_state_matches_text(
+    spaced_state_file, temp_output_dir, monkeypatch, chunk_tokens
+):
+    """Test that a binary state gives the same counts and files as its text."""
+    # Small chunks aggregate topic-word counts as keys rather than densely
+    monkeypatch.setattr(prepare_data, "BINARY_STATE_CHUNK_TOKENS", chunk_tokens)
+    binary_file = os.path.join(temp_output_dir, "topic-state.bin")
+    header = prepare_data.write_binary_state(
+        spaced_state_file, binary_file, block_size=512
+    )
+    assert prepare_data.is_binary_state(binary_file)
+    assert not prepare_data.is_binary_state(spaced_state_file)
+
+    state = prepare_data.open_binary_state(binary_file)
+    assert isinstance(state.types, np.memmap)
+    assert header["numDocs"] == 40
+    assert state.doc_ids.tolist() == list(range(40))
+    assert state.doc_lengths.tolist() == [25 + doc % 7 for doc in range(40)]
+    assert state.source(12) == "file:/My Documents/doc 12.txt"
+
+    expected = read_state_counts(spaced_state_file, engine="numpy")
+    for counts in [
+        read_state_counts(binary_file),
+        read_state_counts(
+            binary_file,
+            doc_topic_path=os.path.join(temp_output_dir, "doc-topic.i32"),
+        ),
+    ]:
+        assert np.array_equal(counts.doc_topic, expected.doc_topic)
+        assert np.array_equal(counts.topic_word, expected.topic_word)
+        assert counts.vocab == expected.vocab
+        assert counts.alpha == expected.alpha
+        assert counts.beta == expected.beta
+
+    text_dir = os.path.join(temp_output_dir, "text")
+    binary_dir = os.path.join(temp_output_dir, "binary")
+    process_mallet_state_file(
+        spaced_state_file, text_dir, generate_all=True, word_index=True
+    )
+    process_mallet_state_file(
+        binary_file, binary_dir, generate_all=True, word_index=True
+    )
+    names = sorted(
+        str(path.relative_to(text_dir))
+        for path in Path(text_dir).rglob("*")
+        if path.is_file()
+    )
+    assert names == sorted(
+        str(path.relative_to(binary_dir))
+        for path in Path(binary_dir).rglob("*")
+        if path.is_file()
+    )
+    for name in names:
+        with (
+            open(os.path.join(text_dir, name), "rb") as a,
+            open(os.path.join(binary_dir, name), "rb") as b,
+        ):
+            assert a.read() == b.read(), name
+
+
+def test_partial_counts_merge(spaced_state_file, temp_output_dir):
+    """Test mapping state shards to partials and merging them in any tree."""
+    with gzip.open(spaced_state_file, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    # Shards of uneven size, cut inside documents; only the first has the header
+    cuts = [0, 100, 101, 517, 900, len(lines)]
+    shards = []
+    for i, (start, stop) in enumerate(pairwise(cuts)):
+        shards.append(os.path.join(temp_output_dir, f"shard-{i}.gz"))
+        with gzip.open(shards[-1], "wb") as f:
+            f.writelines(lines[start:stop])
+
+    # Map each shard in its own process, one of them out of core
+    partials = [shard.replace(".gz", ".npz") for shard in shards]
+    script = prepare_data.__file__
+    mappers = [
+        subprocess.Popen(
+            [sys.executable, script, shard, "--partial", partial]
+            + (["--max-memory", "1M"] if i == 3 else []),
+            stdout=subprocess.DEVNULL,
+        )
+        for i, (shard, partial) in enumerate(zip(shards, partials))
+    ]
+    assert [mapper.wait() for mapper in mappers] == [0] * len(shards)
+    assert not any(name.endswith(".i32") for name in os.listdir(temp_output_dir))
+
+    # Options that do not apply are rejected rather than ignored
+    for command in [
+        [shards[0], "--partial", partials[0], "--sample", "0.5"],
+        ["--merge", *partials, "--cache"],
+        ["--merge", *partials, "--partial", partials[0], "--word-index"],
+    ]:
+        rejected = subprocess.run(
+            [sys.executable, script, *command],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        assert rejected.returncode == 2
+        assert "cannot be combined with" in rejected.stderr
+
+    expected = read_state_counts(spaced_state_file)
+    flat = prepare_data.merge_partial_counts(partials)
+    left = os.path.join(temp_output_dir, "left.npz")
+    right = os.path.join(temp_output_dir, "right.npz")
+    prepare_data.merge_partial_counts(partials[3:0:-1], left)
+    subprocess.run(
+        [
+            sys.executable,
+            script,
+            "--merge",
+            partials[4],
+            partials[0],
+            "--partial",
+            right,
+        ],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    tree = prepare_data.merge_partial_counts([right, left])
+    for counts in [flat, tree]:
+        assert counts.doc_ids.tolist() == list(range(40))
+        assert np.array_equal(counts.doc_topic, expected.doc_topic)
+        assert np.array_equal(counts.topic_word, expected.topic_word)
+        assert counts.vocab == expected.vocab
+        assert counts.alpha == expected.alpha
+        assert counts.beta == expected.beta
+        assert counts.line_count == expected.line_count
+
+    whole_dir = os.path.join(temp_output_dir, "whole")
+    merged_dir = os.path.join(temp_output_dir, "merged")
+    process_mallet_state_file(spaced_state_file, whole_dir, generate_all=True)
+    prepare_data.process_partial_counts([left, right], merged_dir, generate_all=True)
+    names = sorted(
+        str(path.relative_to(whole_dir))
+        for path in Path(whole_dir).rglob("*")
+        if path.is_file()
+    )
+    assert names == sorted(
+        str(path.relative_to(merged_dir))
+        for path in Path(merged_dir).rglob("*")
+        if path.is_file()
+    )
+    for name in names:
+        with (
+            open(os.path.join(whole_dir, name), "rb") as a,
+            open(os.path.join(merged_dir, name), "rb") as b,
+        ):
+            assert a.read() == b.read(), name
+
+    with pytest.raises(ValueError):
+        prepare_data.process_partial_counts(partials[1:], merged_dir)
+
+
+@pytest.mark.parametrize("block_size", [None, 300])
+def test_state_sample(spaced_state_file, temp_output_dir, block_size):
+    """Test sampled counts and the approximate mark in config.json."""
+    assert prepare_data.parse_sample("5%") == 0.05
+    assert prepare_data.parse_sample("0.25") == 0.25
+    assert prepare_data.parse_sample("1000") == 1000
+    for value in ["0", "1.5", "-3", "many"]:
+        with pytest.raises(ValueError):
+            prepare_data.parse_sample(value)
+
+    # Every fourth token of each document from its first, counted four times
+    expected = np.zeros((40, 4), dtype=np.int32)
+    for doc in range(40):
+        for pos in range(0, 25 + doc % 7, 4):
+            expected[doc, (doc + pos * pos) % 4] += 4
+    counts, sample = prepare_data.read_state_sample(
+        spaced_state_file, 0.25, block_size=block_size
+    )
+    assert np.array_equal(counts.doc_topic, expected)
+    assert counts.topic_word.sum() == expected.sum()
+    assert counts.line_count == sum(25 + doc % 7 for doc in range(40))
+    # The tokens counted, not the tokens read
+    assert sample == {
+        "method": "tokens",
+        "fraction": 0.25,
+        "tokens": int(expected.sum()) // 4,
+    }
+
+    full = read_state_counts(spaced_state_file)
+    counts, sample = prepare_data.read_state_sample(
+        spaced_state_file, 7, block_size=block_size
+    )
+    assert np.array_equal(counts.doc_topic, full.doc_topic[:7])
+    assert counts.line_count == sum(25 + doc % 7 for doc in range(7))
+    assert sample == {"method": "first_docs", "documents": 7}
+
+    config_path = os.path.join(temp_output_dir, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"doc_topic_file": "data/doc-topic.txt"}, f)
+    process_mallet_state_file(
+        spaced_state_file, temp_output_dir, sample=0.25, config_file=config_path
+    )
+    with open(config_path) as f:
+        assert json.load(f)["approximate"]["fraction"] == 0.25
+    assert not os.path.exists(
+        os.path.join(temp_output_dir, prepare_data.SEEK_INDEX_FILENAME)
+    )
+    with open(os.path.join(temp_output_dir, "doc-topic.txt")) as f:
+        assert len(f.read().splitlines()) == 40
+
+    process_mallet_state_file(
+        spaced_state_file, temp_output_dir, config_file=config_path
+    )
+    with open(config_path) as f:
+        assert json.load(f) == {"doc_topic_file": "data/doc-topic.txt"}
+
+
+def test_mark_config_approximate(temp_output_dir, capsys):
+    """Test that the site's config.json is marked, and never created."""
+    output_dir = os.path.join(temp_output_dir, "data", "project")
+    os.makedirs(output_dir)
+    assert prepare_data.find_browser_config(output_dir) is None
+    config_path = os.path.join(temp_output_dir, "config.json")
+    prepare_data.mark_config_approximate(config_path, {"method": "tokens"})
+    assert not os.path.exists(config_path)
+    assert "Warning" in capsys.readouterr().out
+
+    # The site root holds index.html and config.json
+    for name in ("index.html", "config.json"):
+        with open(os.path.join(temp_output_dir, name), "w") as f:
+            f.write("{}")
+    assert prepare_data.find_browser_config(output_dir) == config_path
+
+    # A config.json holding only the mark is removed again
+    prepare_data.mark_config_approximate(config_path, {"method": "tokens"})
+    with open(config_path) as f:
+        assert json.load(f) == {"approximate": {"method": "tokens"}}
+    prepare_data.mark_config_approximate(config_path, None)
+    assert not os.path.exists(config_path)
+
+
+@pytest.mark.parametrize("source", ["seek index", "binary"])
+@pytest.mark.parametrize("out_of_core", [False, True])
+def test_state_doc_sample(spaced_state_file, temp_output_dir, source, out_of_core):
+    """Test fractional samples that seek to whole documents."""
+    state_file = os.path.join(temp_output_dir, "topic-state.txt")
+    with gzip.open(spaced_state_file, "rb") as f, open(state_file, "wb") as out:
+        out.write(f.read())
+    index_path = None
+    if source == "binary":
+        state_file_text, state_file = state_file, state_file + ".bin"
+        prepare_data.write_binary_state(state_file_text, state_file)
+    else:
+        index_path = os.path.join(temp_output_dir, prepare_data.SEEK_INDEX_FILENAME)
+        prepare_data.build_state_seek_index(state_file, index_path)
+    doc_topic_path = (
+        os.path.join(temp_output_dir, "doc-topic.i32") if out_of_core else None
+    )
+
+    # The documents are short enough for every fourth one, from the first,
+    # to be read exactly, and the others are left out
+    full = read_state_counts(spaced_state_file)
+    counts, sample = prepare_data.read_state_sample(
+        state_file, 0.25, doc_topic_path=doc_topic_path, seek_index=index_path
+    )
+    expected = np.zeros_like(full.doc_topic)
+    expected[::4] = full.doc_topic[::4]
+    assert np.array_equal(counts.doc_topic, expected)
+    assert np.array_equal(counts.sampled_docs, np.arange(len(expected)) % 4 == 0)
+    assert counts.topic_word.sum() == 4 * expected.sum()
+    assert counts.line_count == expected.sum()
+    assert sample == {
+        "method": "documents",
+        "fraction": 0.25,
+        "tokens": int(expected.sum()),
+    }
+
+    if source == "seek index":
+        # Written with the browser files, marked with the method
+        # The browser's config.json is found at the root of the site
+        output_dir = os.path.join(temp_output_dir, "site", "data", "preview")
+        os.makedirs(output_dir)
+        for name in ("index.html", "config.json"):
+            with open(os.path.join(temp_output_dir, "site", name), "w") as f:
+                f.write("{}")
+        shutil.copy(index_path, output_dir)
+        process_mallet_state_file(state_file, output_dir, sample=0.25)
+        with open(os.path.join(temp_output_dir, "site", "config.json")) as f:
+            assert json.load(f)["approximate"]["method"] == "documents"
+
+
+def test_count_cache_reused(spaced_state_file, temp_output_dir, monkeypatch):
+    """Test that cached counts are reused while the state file is unchanged."""
+    process_mallet_state_file(spaced_state_file, temp_output_dir, cache=True)
+    cache_path = os.path.join(temp_output_dir, prepare_data.CACHE_FILENAME)
+    assert os.path.exists(cache_path)
+    with open(os.path.join(temp_output_dir, "doc-topic.txt")) as f:
+        expected = f.read()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("state file parsed again")
+
+    monkeypatch.setattr(prepare_data, "read_state_counts", fail)
+    # Touching the file changes its mtime but not its contents
+    os.utime(spaced_state_file, ns=(0, 0))
+    process_mallet_state_file(spaced_state_file, temp_output_dir, cache=True)
+    with open(os.path.join(temp_output_dir, "doc-topic.txt")) as f:
+        assert f.read() == expected
+
+
+def test_count_cache_invalidated(spaced_state_file, temp_output_dir, monkeypatch):
+    """Test that a changed state file is not served from the cache."""
+    monkeypatch.setattr(prepare_data, "DENSE_TOPIC_WORD_LIMIT", 0)
+    counts = read_state_counts(spaced_state_file)
+    cache_path = os.path.join(temp_output_dir, prepare_data.CACHE_FILENAME)
+    fingerprint = prepare_data.state_fingerprint(spaced_state_file)
+    prepare_data.save_state_counts(counts, cache_path, fingerprint)
+
+    cached = prepare_data.load_state_counts(cache_path, spaced_state_file)
+    assert sparse.issparse(cached.topic_word)
+    assert (cached.topic_word != counts.topic_word).nnz == 0
+    assert np.array_equal(cached.doc_topic, counts.doc_topic)
+    assert cached.vocab == counts.vocab
+    assert cached.alpha == counts.alpha
+    assert cached.beta == counts.beta
+    mapped = prepare_data.load_state_counts(cache_path, spaced_state_file, mmap=True)
+    assert isinstance(mapped.doc_topic, np.memmap)
+    assert np.array_equal(mapped.doc_topic, counts.doc_topic)
+
+    with open(spaced_state_file, "rb") as f:
+        data = bytearray(f.read())
+    data[-1] ^= 0xFF
+    with open(spaced_state_file, "wb") as f:
+        f.write(data)
+    os.utime(spaced_state_file, ns=(0, 0))
+    assert prepare_data.load_state_counts(cache_path, spaced_state_file) is None
+
+
+def test_out_of_core_counts_match_in_memory(spaced_state_file, temp_output_dir):
+    """Test that memory-mapped doc-topic counts match in-memory counts."""
+    in_memory = read_state_counts(spaced_state_file, engine="numpy")
+    doc_topic_path = os.path.join(temp_output_dir, "doc-topic.i32")
+    mapped = read_state_counts(
+        spaced_state_file, engine="numpy", doc_topic_path=doc_topic_path, block_size=256
+    )
+
+    assert isinstance(mapped.doc_topic, np.memmap)
+    assert np.array_equal(mapped.doc_topic, in_memory.doc_topic)
+    assert np.array_equal(mapped.topic_word, in_memory.topic_word)
+    assert mapped.vocab == in_memory.vocab
+    with pytest.raises(ValueError):
+        read_state_counts(spaced_state_file, doc_topic_path=doc_topic_path)
+
+    # Topics after the last one with tokens are left out either way
+    unused_topic_file = os.path.join(temp_output_dir, "unused-topic.txt")
+    with open(unused_topic_file, "w") as f:
+        f.write("#doc source pos typeindex type topic\n")
+        f.write("#alpha : 0.1 0.1 0.1 0.1\n#beta : 0.01\n")
+        f.writelines(f"{doc} doc{doc} 0 {doc} w{doc} {doc // 4}\n" for doc in range(12))
+    in_memory = read_state_counts(unused_topic_file, engine="numpy")
+    mapped = read_state_counts(
+        unused_topic_file, engine="numpy", doc_topic_path=doc_topic_path, block_size=64
+    )
+    assert in_memory.num_topics == mapped.num_topics == 3
+    assert np.array_equal(mapped.doc_topic, in_memory.doc_topic)
+    assert np.array_equal(mapped.topic_word, in_memory.topic_word)
+
+    # Without the header, rows already written are widened for later topics
+    with open(unused_topic_file) as f:
+        lines = f.readlines()[3:]
+    with open(unused_topic_file, "w") as f:
+        f.writelines(lines)
+    mapped = read_state_counts(
+        unused_topic_file, engine="numpy", doc_topic_path=doc_topic_path, block_size=64
+    )
+    assert np.array_equal(mapped.doc_topic, in_memory.doc_topic)
+
+
+def test_process_with_max_memory(spaced_state_file, temp_output_dir):
+    """Test that a memory budget gives the same files as an unbounded run."""
+    expected_dir = os.path.join(temp_output_dir, "expected")
+    bounded_dir = os.path.join(temp_output_dir, "bounded")
+    process_mallet_state_file(spaced_state_file, expected_dir, generate_all=True)
+    # A budget this small formats one document at a time
+    process_mallet_state_file(
+        spaced_state_file,
+        bounded_dir,
+        generate_all=True,
+        engine="numpy",
+        max_memory=1024,
+    )
+
+    for name in ["doc-topic.txt", "doc-topic-counts.csv", "topic-keys.txt"]:
+        with open(os.path.join(expected_dir, name)) as f:
+            expected = f.read()
+        with open(os.path.join(bounded_dir, name)) as f:
+            assert f.read() == expected
+    assert not os.path.exists(
+        os.path.join(bounded_dir, prepare_data.DOC_TOPIC_SPILL_FILENAME)
+    )
+
+
+def test_concurrent_writers_match_sequential(spaced_state_file, temp_output_dir):
+    """Test that writing files concurrently gives the same files."""
+    sequential_dir = os.path.join(temp_output_dir, "sequential")
+    concurrent_dir = os.path.join(temp_output_dir, "concurrent")
+    process_mallet_state_file(spaced_state_file, sequential_dir, generate_all=True)
+    process_mallet_state_file(
+        spaced_state_file, concurrent_dir, generate_all=True, writers=4
+    )
+
+    names = sorted(
+        str(path.relative_to(sequential_dir))
+        for path in Path(sequential_dir).rglob("*")
+        if path.is_file()
+    )
+    assert names == sorted(
+        str(path.relative_to(concurrent_dir))
+        for path in Path(concurrent_dir).rglob("*")
+        if path.is_file()
+    )
+    for name in names:
+        with (
+            open(os.path.join(sequential_dir, name), "rb") as a,
+            open(os.path.join(concurrent_dir, name), "rb") as b,
+        ):
+            assert a.read() == b.read(), name
+
+
+@pytest.mark.parametrize("writers", [1, 2])
+def test_profile_report(spaced_state_file, temp_output_dir, writers):
+    """Test the stage report of a profiled run."""
+    process_mallet_state_file(
+        spaced_state_file,
+        temp_output_dir,
+        engine="numpy",
+        writers=writers,
+        profile=True,
+    )
+
+    with open(os.path.join(temp_output_dir, "profile.json")) as f:
+        report = json.load(f)
+    assert report["tokens"] > 0
+    assert report["writers"] == writers
+    stages = {stage["name"]: stage for stage in report["stages"]}
+    assert {"read", "decompress", "parse", "aggregate", "top_words"} <= set(stages)
+    assert {"write_doc_topic_txt", "write_topic_coords_csv"} <= set(stages)
+    # Stages of the layout, which runs in a separate process with writers > 1
+    assert {"jsd", "mds"} <= set(stages)
+    assert stages["parse"]["calls"] == stages["decompress"]["calls"]
+    for stage in stages.values():
+        assert stage["calls"] >= 1
+        assert stage["wall_seconds"] >= 0
+        assert stage["tokens_per_second"] is None or stage["tokens_per_second"] > 0
+    assert not os.path.exists(os.path.join(temp_output_dir, "profile"))
+
+
+def test_format_proportions():
+    """Test bulk formatting against Python's fixed-point formatting."""
+    rng = np.random.default_rng(0)
+    values = rng.random((50, 20))
+    # Zeros, ones, exact binary fractions and values at rounding ties
+    values[0, :6] = [0.0, 1.0, 0.5e-10, 2.5e-10, 0.99999999999, 2**-11]
+    values[1] = rng.integers(1, 2**20, 20) / 2**20
+    text = prepare_data.format_proportions(values)
+    assert text.shape == (50, 20, 12)
+    for row, row_text in zip(values.tolist(), text):
+        assert [bytes(cell).decode() for cell in row_text] == [
+            f"{value:.10f}" for value in row
+        ]
+
+
+def test_parse_memory_size():
+    """Test parsing of memory budgets."""
+    assert prepare_data.parse_memory_size("1024") == 1024
+    assert prepare_data.parse_memory_size("512M") == 512 * 1024**2
+    assert prepare_data.parse_memory_size("1.5GiB") == 3 * 1024**3 // 2
+    with pytest.raises(ValueError):
+        prepare_data.parse_memory_size("lots")
+
+
+def test_unknown_engine(sample_state_file, temp_output_dir):
+    """Test that an unknown parse engine is rejected."""
+    with pytest.raises(ValueError):
+        process_mallet_state_file(sample_state_file, temp_output_dir, engine="fast")
 
 
 # --- Integration tests ---
@@ -389,6 +1643,12 @@ def test_process_mallet_state_file_core_only(sample_state_file, temp_output_dir)
     assert os.path.exists(os.path.join(temp_output_dir, "doc-topic.txt"))
     assert os.path.exists(os.path.join(temp_output_dir, "topic_coords.csv"))
     assert os.path.exists(os.path.join(temp_output_dir, "metadata.csv"))
+    assert os.path.exists(os.path.join(temp_output_dir, "doc-lengths.bin"))
+    assert os.path.exists(os.path.join(temp_output_dir, "doc-topic-counts.bin"))
+    assert os.path.exists(
+        os.path.join(temp_output_dir, "topic-docs", "topic-00000.bin")
+    )
+    assert os.path.exists(os.path.join(temp_output_dir, "facets", "year.bin"))
 
     # Check that additional files don't exist
     assert not os.path.exists(os.path.join(temp_output_dir, "doc-topic-counts.csv"))
@@ -472,5 +1732,42 @@ def test_single_topic_coordinates():
     assert coords.shape == (1, 2)
 
 
+# --- Startup tests ---
+
+CLI_STARTUP_BUDGET = 1.0  # Seconds `prepare_data.py --help` may take
+
+
+def test_cli_startup():
+    """Test that the CLI starts quickly, without the heavy dependencies."""
+    script = Path(prepare_data.__file__)
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            textwrap.dedent(
+                """
+                import sys, prepare_data
+                print(*[m for m in ("pandas", "scipy", "sklearn") if m in sys.modules])
+                """
+            ),
+        ],
+        cwd=script.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert loaded.stdout.strip() == ""
+
+    # Best of three, to ride out a busy machine
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(script), "--help"], capture_output=True, check=True
+        )
+        times.append(time.perf_counter() - start)
+    assert min(times) < CLI_STARTUP_BUDGET
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])